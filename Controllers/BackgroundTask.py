@@ -0,0 +1,91 @@
+import threading
+import traceback
+from typing import Callable
+
+from PyQt5 import QtCore
+
+
+class TaskCancelled(Exception):
+    """
+    TaskCancelled is raised inside of the background task at its next report, after the user cancelled it
+    """
+
+
+class BackgroundTaskSignals(QtCore.QObject):
+    """
+    BackgroundTaskSignals are the signals of BackgroundTask (QRunnable isn't a QObject, so it can't have its own).
+    The object is created on the GUI thread, so slots connected to these signals are called on the GUI thread,
+    even though the signals are emitted from the worker thread.
+
+    Attributes:
+        progress (QtCore.pyqtSignal -> (str, int)): status message and percent of the current stage
+        finished (QtCore.pyqtSignal -> object): the result of the calculation
+        failed (QtCore.pyqtSignal -> Exception): the exception which stopped the calculation
+        cancelled (QtCore.pyqtSignal): the calculation was stopped by the user
+    """
+    progress = QtCore.pyqtSignal(str, int)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+    cancelled = QtCore.pyqtSignal()
+
+
+class BackgroundTask(QtCore.QRunnable):
+    """
+    BackgroundTask runs one analysis (reading, filtering, detection, sorting, ...) on a QThreadPool worker thread,
+    so the main window isn't frozen meanwhile. The calculation gets the task itself and calls report between
+    its stages, report updates the progress and stops the calculation with TaskCancelled if the user cancelled it.
+    cancellation is cooperative, so the running stage is finished first.
+    The result, the exception or the cancellation comes back with signals, which are handled on the GUI thread.
+
+    Attributes:
+        title (str): name of the analysis, which is shown in the status bar
+        signals (BackgroundTaskSignals): signals of the task
+        is_cancelled (bool): whether the user cancelled the task
+
+    Args:
+        title (str): name of the analysis, which is shown in the status bar
+        calculate (function): calculate(task) returns the result, it runs on the worker thread,
+                              so it must not touch any widget, values of widgets are read before the task starts
+    """
+    def __init__(self, title: str, calculate: Callable[["BackgroundTask"], object]):
+        super().__init__()
+        self.title = title
+        self.signals = BackgroundTaskSignals()
+        self._calculate = calculate
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """
+        asks the task to stop at its next report, it can be called from any thread
+        """
+        self._cancel_event.set()
+
+    def report(self, stage: str, done: int = 0, total: int = 1) -> None:
+        """
+        reports the progress of the calculation, it's called by the calculation itself
+
+        Args:
+            stage (str): what the calculation does now, e.g. "Detecting spikes"
+            done (int): the quantity of finished items of the stage (e.g. channels)
+            total (int): the quantity of all items of the stage
+        """
+        if self.is_cancelled:
+            raise TaskCancelled(f"{self.title} is cancelled")
+        self.signals.progress.emit(f"{self.title}: {stage}", int(100 * done / max(total, 1)))
+
+    def run(self) -> None:
+        try:
+            self.report("Started")
+            result = self._calculate(self)
+            self.report("Finished", 1)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
@@ -1,7 +1,9 @@
-import numpy as np
 import pandas as pd
+from functools import partial
+from Controllers.BackgroundTask import BackgroundTask
 from Controllers.Controller import Controller
 from Controllers.utils import catch_exception
+from Modules.SpikeTable import SpikeTable
 from Modules.stimulus import Stimulus
 from Modules.utils import plot_bins, plot_stimulus
 from Widgets.BinWidget import BinWidget
@@ -15,6 +17,10 @@ class BinController(Controller):
 
     Note that, Arguments are documented in parent class
     """
+    parameter_names = Controller.parameter_names + ("bin_width", "spike_dead_time", "spike_threshold_from",
+                                                    "spike_threshold_to", "stimulus_dead_time",
+                                                    "stimulus_threshold_from", "stimulus_threshold_to")
+
     def __init__(self, *args):
         self.view = BinWidget("Description\n On the given tab we are observing the distribution of spikes in bin range."
                               " you can analyze several channels or an average of them by selecting average check box. "
@@ -28,50 +34,77 @@ class BinController(Controller):
     @catch_exception
     def plot_clicked(self) -> None:
         """
-        This function firstly makes the bin module object, preprocesses signal and then uses
-        bin plot function from utils to plot the calculated bins.
+        This function firstly makes the bin module objects, preprocesses signal and calculates bins in background
+        and then uses bin plot function from utils to plot the calculated bins.
         """
         marked_channels = self.view.channel_widget.marked_spike_channels
         if len(marked_channels) == 0:
             raise ValueError("At least one channel should be marked")
 
-        if self._dialog:
-            self._dialog.accept()
-            self._dialog = None
+        self._accept_dialog()
+        stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
+        self._run_in_background("Bin", partial(self._calculate_bins, marked_channels, stimulus_marked_channels,
+                                               self._read_parameters()), self._plot_bins)
 
-        self.view.create_plot_window("Bin", "icons/bin.png")
-        self.mdi.addSubWindow(self.view.plot_window)
+    def _calculate_bins(self, marked_channels: list, stimulus_marked_channels: list, parameters: dict,
+                        task: BackgroundTask) -> (list, list):
+        """
+        Calculates bins of the average or of every channel and the stimulus, it runs on a worker thread
 
-        stimulus_time_range = self._get_stimulus_time_range()
+        Args:
+            marked_channels (list): user's chosen channels list
+            stimulus_marked_channels (list): user's chosen stimulus channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
 
-        if self.view.channel_widget.is_avg:
-            self.plt_bin_in_channel(marked_channels, 0)
-            plot_stimulus(stimulus_time_range, self.view.canvas, ax_idx=0)
-        else:
-            for i, ch in enumerate(marked_channels):
-                self.plt_bin_in_channel([ch], i)
-                plot_stimulus(stimulus_time_range, self.view.canvas, ax_idx=i)
+        Returns:
+            axes (list -> tuple): (bins, bin range, bin width, channels) of every axis
+            stimulus_time_range (list): corresponding stimulus's times
+        """
+        axes = self._calculate_channel_bins(marked_channels, parameters, task)
+        task.report("Detecting stimulus")
+        return axes, self._get_stimulus_time_range(stimulus_marked_channels, parameters)
+
+    def _plot_bins(self, result: (list, list)) -> None:
+        """
+        Plots the calculated bins and stimulus, every channel (or average) on its own axis
 
-        self.view.plot_window.show()
-        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.plot_window.closeEvent = lambda x: self._remove_me()
-        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.canvas.figure.tight_layout()
+        Args:
+            result (tuple): axes and stimulus time range calculated by _calculate_bins
+        """
+        axes, stimulus_time_range = result
+        self.view.create_plot_window("Bin", "icons/bin.png")
+        self.mdi.addSubWindow(self.view.plot_window)
+        for i, (bins, bin_range, bin_width, channels) in enumerate(axes):
+            plot_bins(bins, bin_range, bin_width, self.view.canvas, channels, "Bin Timestamp (s)", "Bin Freq (hz)",
+                      ax_idx=i)
+            plot_stimulus(stimulus_time_range, self.view.canvas, ax_idx=i)
+        self._show_plot_window()
 
-    def plt_bin_in_channel(self, ch, i) -> None:
+    def _calculate_channel_bins(self, marked_channels: list, parameters: dict, task: BackgroundTask) -> list:
         """
-        This function firstly makes the waveform module object, preprocesses signal and then uses
-        waveform plot function from utils to plot the desired signal.
+        Calculates bins of the average or of every channel, single channels take their spikes from one spike table
 
         Args:
-            ch (list -> str): user's chosen channels list
-            i (int): ax index to draw
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+
+        Returns:
+            axes (list -> tuple): (bins, bin range, bin width, channels) of every axis
         """
-        _bin = self._create_bin(ch)
-        bin_range = np.arange(_bin.from_s, _bin.to_s, _bin.bin_width)
-        pad_len = len(bin_range) - len(_bin.bins)
-        bins = np.concatenate([_bin.bins, [0] * pad_len])
-        plot_bins(bins, bin_range, _bin.bin_width, self.view.canvas, ch, "Bin Timestamp (s)", "Bin Freq (hz)", ax_idx=i)
+        if parameters["is_avg"]:
+            channel_groups, spike_table = [marked_channels], None
+        else:
+            channel_groups = [[ch] for ch in marked_channels]
+            spike_table = self._create_bin_spike_table(marked_channels, parameters, task)
+
+        axes = []
+        for i, channels in enumerate(channel_groups):
+            task.report("Calculating bins", i, len(channel_groups))
+            _bin = self._create_bin(channels, parameters, spike_table)
+            axes.append((_bin.bins, _bin.bin_range, _bin.bin_width, channels))
+        return axes
 
     @catch_exception
     def extract_clicked(self):
@@ -85,59 +118,70 @@ class BinController(Controller):
             if len(marked_channels) == 0:
                 raise ValueError("At least one channel should be marked")
 
-            if self.view.channel_widget.is_avg:
-                bin_dataframe = pd.DataFrame()
-                bin = self._create_bin(marked_channels)
-                bin_range = np.arange(bin.from_s, bin.to_s, bin.bin_width)
-                pad_len = len(bin_range) - len(bin.bins)
-                bins = np.concatenate([bin.bins, [0]*pad_len])
-
-                bin_dataframe["range"] = bin_range
-                bin_dataframe[f"Spikes_frequency_in_bins {marked_channels}"] = bins
-                bin_dataframe.to_csv(path + "bins.csv", index=False)
+            self._run_in_background("Bin extract",
+                                    partial(self._extract_bins, path, marked_channels, self._read_parameters()),
+                                    lambda result: self.popup_handler.info_popup("Success", "Data Created successfully"))
 
-            else:
-                bin_dataframe = pd.DataFrame()
-                for i, ch in enumerate(marked_channels):
-                    bin = self._create_bin([ch])
-                    bin_range = np.arange(bin.from_s, bin.to_s, bin.bin_width)
-                    pad_len = len(bin_range) - len(bin.bins)
-                    bins = np.concatenate([bin.bins, [0]*pad_len])
-                    if i == 0:
-                        bin_dataframe["range"] = bin_range
-                    bin_dataframe[f"Spikes_frequency_in_bins {ch}"] = bins
-                bin_dataframe.to_csv(path + "bins.csv", index=False)
+    def _extract_bins(self, path: str, marked_channels: list, parameters: dict, task: BackgroundTask) -> None:
+        """
+        Calculates bins of the average or of every channel and writes them into one csv file,
+        it runs on a worker thread
 
-            self.popup_handler.info_popup("Success", "Data Created successfully")
+        Args:
+            path (str): path to save the dataframe
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+        """
+        bin_dataframe = pd.DataFrame()
+        axes = self._calculate_channel_bins(marked_channels, parameters, task)
+        for i, (bins, bin_range, bin_width, channels) in enumerate(axes):
+            if i == 0:
+                bin_dataframe["range"] = bin_range
+            column = channels if parameters["is_avg"] else channels[0]
+            bin_dataframe[f"Spikes_frequency_in_bins {column}"] = bins
+        task.report("Writing bins")
+        bin_dataframe.to_csv(path + "bins.csv", index=False)
 
-    def _get_stimulus_time_range(self) -> list:
+    def _get_stimulus_time_range(self, stimulus_marked_channels: list, parameters: dict) -> list:
         """
         This function creates stimulus object and then returns the current signal's stimulus times as a list
 
+        Args:
+            stimulus_marked_channels (list): user's chosen stimulus channels list
+            parameters (dict): view's parameters read by _read_parameters
+
         Returns:
             stimulus time range (list): corresponding stimulus's times
         """
-        stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
         if len(stimulus_marked_channels):
-            stimulus = self._create_stimulus(stimulus_marked_channels)
+            stimulus = self._create_stimulus(stimulus_marked_channels, parameters)
             return stimulus.time_range
         return []
 
-    def _create_bin(self, channels: list) -> Bin:
+    def _create_bin_spike_table(self, channels: list, parameters: dict, task: BackgroundTask = None) -> SpikeTable:
+        """
+        Detects spikes of all channels at once with the bin's spike parameters
+        """
+        return self._create_spike_table(channels, parameters, parameters["spike_dead_time"],
+                                        parameters["spike_threshold_from"], parameters["spike_threshold_to"], task)
+
+    def _create_bin(self, channels: list, parameters: dict, spike_table: SpikeTable = None) -> Bin:
         """
         This function creates stimulus object and then returns the current signal's stimulus times as a list
 
         Returns:
             stimulus time range (list): corresponding stimulus's times
         """
-        return Bin(self.view.bin_width.text(), self.view.spike_dead_time.text(), self.view.spike_threshold_from.text(),
-                   self.view.spike_threshold_to.text(), self.file.recordings[0].analog_streams[0],
-                   channels, self.view.from_s.text(), self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(Bin, channels, parameters, bin_width=parameters["bin_width"],
+                              dead_time=parameters["spike_dead_time"],
+                              threshold_from=parameters["spike_threshold_from"],
+                              threshold_to=parameters["spike_threshold_to"], spike_table=spike_table)
 
-    def _create_stimulus(self, channels: list) -> Stimulus:
+    def _create_stimulus(self, channels: list, parameters: dict) -> Stimulus:
         """
         Creates stimulus class object
         """
-        return Stimulus(self.view.stimulus_dead_time.text(), self.view.stimulus_threshold_from.text(),
-                        self.view.stimulus_threshold_to.text(), "", self.file.recordings[0].analog_streams[0], channels,
-                        self.view.from_s.text(), self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(Stimulus, channels, parameters, dead_time=parameters["stimulus_dead_time"],
+                              threshold_from=parameters["stimulus_threshold_from"],
+                              threshold_to=parameters["stimulus_threshold_to"])
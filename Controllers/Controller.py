@@ -1,3 +1,10 @@
+from functools import partial
+from typing import Callable
+from Controllers.BackgroundTask import BackgroundTask
+from Controllers.utils import catch_exception
+from Modules.Pipeline import pipeline
+from Modules.SpikeTable import SpikeTable
+from Modules.Waveform import Waveform
 from utils import get_default_widget
 
 
@@ -12,6 +19,7 @@ class Controller:
               parameters_dock (QtWidgets.QDockWidget):
               mdi (QtWidgets.QMdiArea): the area where can be window objects displayed
               popup_handler (function): this function is to display corresponding popups
+              progress_handler (ProgressHandler.ProgressHandler): runs background tasks and shows their progress
               view (Widgets.WaveformWidget.WaveformWidget):
 
     Args:
@@ -22,11 +30,16 @@ class Controller:
               mdi (QtWidgets.QMdiArea): the area where can be window objects displayed
               parameters_dock ('PyQt5.QtWidgets.QDockWidget):
               popup_handler (function): this function is to display corresponding popups
+              progress_handler (ProgressHandler.ProgressHandler): runs background tasks and shows their progress
               dialog (PyQt5.QtWidgets.QDialog): dialog window for choosing channels, time and etc..
               view (Widgets.WaveformWidget.WaveformWidget):
 
+    Note that, parameter_names are names of the view's line edits, which are read by _read_parameters
     """
-    def __init__(self, file, key, open_window_dict, mdi, parameters_dock, popup_handler, dialog, view):
+    parameter_names = ("from_s", "to_s", "high_pass", "low_pass")
+
+    def __init__(self, file, key, open_window_dict, mdi, parameters_dock, popup_handler, progress_handler,
+                 dialog, view):
         self.file = file
         self._key = key
         self.open_window_dict = open_window_dict
@@ -34,9 +47,114 @@ class Controller:
         self._dialog = dialog
         self.mdi = mdi
         self.popup_handler = popup_handler
+        self.progress_handler = progress_handler
+        self._task = None
 
         self.view = view
 
+    def _run_in_background(self, title: str, calculate: Callable[[BackgroundTask], object],
+                           finish: Callable[[object], None]) -> None:
+        """
+        Runs calculate(task) on a worker thread and then finish(result) on the GUI thread, so the main window
+        isn't frozen during long calculations. Qt widgets can't be used from the worker thread, so calculate
+        gets every view value it needs from _read_parameters through partial. The parameters view is disabled
+        until the task ends and errors of both functions are displayed like catch_exception does
+
+        Args:
+            title (str): name of the analysis, which is shown in the status bar
+            calculate (function): reads, filters, detects, ... and returns everything finish needs,
+                                  it must not touch any widget
+            finish (function): draws or reports the result, widgets should be touched only here
+        """
+        self.view.setDisabled(True)
+        self._task = BackgroundTask(title, partial(self._calculate_in_pipeline, calculate))
+        self._task.signals.finished.connect(partial(self._finish_task, finish))
+        self._task.signals.failed.connect(self._task_failed)
+        self._task.signals.cancelled.connect(partial(self.view.setEnabled, True))
+        self.progress_handler.start(self._task)
+
+    def _calculate_in_pipeline(self, calculate: Callable[[BackgroundTask], object], task: BackgroundTask):
+        with pipeline.request(self):
+            return calculate(task)
+
+    def _finish_task(self, finish: Callable[[object], None], result) -> None:
+        self.view.setEnabled(True)
+        catch_exception(lambda controller: finish(result))(self)
+
+    def _task_failed(self, error: Exception) -> None:
+        self.view.setEnabled(True)
+        self.popup_handler.warning_popup(str(type(error).__name__), str(error))
+
+    def _show_plot_window(self) -> None:
+        """
+        Shows the drawn plot window and connects its events
+        """
+        self.view.plot_window.show()
+        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
+        self.view.plot_window.closeEvent = lambda x: self._remove_me()
+        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
+        self.view.canvas.figure.tight_layout()
+
+    def _accept_dialog(self) -> None:
+        """
+        Closes the channel choosing dialog after the first plot
+        """
+        if self._dialog:
+            self._dialog.accept()
+            self._dialog = None
+
+    def _read_parameters(self) -> dict:
+        """
+        Reads the view's parameters on the GUI thread, before they are passed to a background task
+
+        Returns:
+            parameters (dict): texts of the parameter_names line edits and "is_avg", whether average is checked
+        """
+        parameters = {name: getattr(self.view, name).text() for name in self.parameter_names}
+        parameters["is_avg"] = self.view.channel_widget.is_avg
+        return parameters
+
+    def _get_node(self, module_class: type, channels: list, parameters: dict, **module_parameters) -> Waveform:
+        """
+        Returns the window's module object from the analysis pipeline with the view's time range and filters.
+        The object is kept between plots, so only the stages, which depend on changed parameters, are recalculated
+
+        Args:
+            module_class (type): Waveform or one of its child classes
+            channels (list): user's chosen channels
+            parameters (dict): view's parameters read by _read_parameters
+            module_parameters: other constructor parameters of the class
+
+        Returns:
+            module object (Modules.Waveform.Waveform): object of the class with the given parameters
+        """
+        return pipeline.node(self, module_class, self.file.recordings[0].analog_streams[0], channels,
+                             from_s=parameters["from_s"], to_s=parameters["to_s"], high_pass=parameters["high_pass"],
+                             low_pass=parameters["low_pass"], **module_parameters)
+
+    def _create_spike_table(self, channels: list, parameters: dict, dead_time: str, threshold_from: str,
+                            threshold_to: str, task: BackgroundTask = None) -> SpikeTable:
+        """
+        Detects spikes of every channel at once into one spike table, which is shared with other windows
+        of the same signal and spike parameters. single channel module objects take their spikes from it
+        instead of detecting them one by one
+
+        Args:
+            channels (list): user's chosen channels
+            parameters (dict): view's parameters read by _read_parameters
+            dead_time (str): spike dead time
+            threshold_from (str): spike threshold from
+            threshold_to (str): spike threshold to
+            task (Controllers.BackgroundTask.BackgroundTask): the running task to report detection progress to
+
+        Returns:
+            spike table (Modules.SpikeTable.SpikeTable): spikes of every channel
+        """
+        waveform = Waveform(self.file.recordings[0].analog_streams[0], channels, parameters["from_s"],
+                            parameters["to_s"], parameters["high_pass"], parameters["low_pass"])
+        progress = None if task is None else partial(task.report, "Detecting spikes")
+        return pipeline.spike_table(waveform, dead_time, threshold_from, threshold_to, progress)
+
     def _enable_stimulus_if_checked(self) -> None:
         """
         This function enables stimulus channel on double click
@@ -51,4 +169,5 @@ class Controller:
         This function removes existing opened window object
         """
         del self.open_window_dict[self._key]
+        pipeline.release(self)
         self.parameters_dock.setWidget(get_default_widget())
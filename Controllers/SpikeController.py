@@ -1,10 +1,13 @@
+from functools import partial
+from Controllers.BackgroundTask import BackgroundTask
 from Controllers.Controller import Controller
 from Modules.stimulus import Stimulus
 from Controllers.utils import catch_exception
+from Modules.SpikeTable import SpikeTable
 from Modules.SpikeTogether import SpikeTogether
 import numpy as np
 import pandas as pd
-from Modules.utils import get_spikes_with_labels, plot_signal_with_spikes, plot_stimulus
+from Modules.utils import plot_signal_with_spikes, plot_stimulus
 from Modules.Bursts import Bursts
 from Widgets.SpikeWidget import SpikeWidget
 
@@ -17,6 +20,12 @@ class SpikeController(Controller):
 
     Note that, Arguments are documented in parent class
     """
+    parameter_names = Controller.parameter_names + ("pre", "post", "component_number", "spike_dead_time",
+                                                    "spike_threshold_from", "spike_threshold_to", "burst_max_start",
+                                                    "burst_max_end", "burst_between", "burst_duration", "burst_number",
+                                                    "stimulus_dead_time", "stimulus_threshold_from",
+                                                    "stimulus_threshold_to")
+
     def __init__(self, *args):
         self.view = SpikeWidget("Description\n On the given tab we are observing activity of the signal referring to "
                                 "spikes bursts and stimulus, for unit or multi-neural activities "
@@ -32,61 +41,67 @@ class SpikeController(Controller):
     @catch_exception
     def plot_clicked(self):
         """
-        This function firstly makes the spike module object, preprocesses signal and then uses
-        plot_one_channel function to plot the calculated spikes.
+        This function firstly makes the spike module objects, preprocesses signal and calculates spikes
+        and bursts in background and then plots the calculated spikes.
         """
         marked_channels = self.view.channel_widget.marked_spike_channels
         if len(marked_channels) == 0:
             raise ValueError("At least one channel should be marked")
 
-        if self._dialog:
-            self._dialog.accept()
-            self._dialog = None
-
-        self.view.create_plot_window("Spike", "icons/spike.png")
-        self.mdi.addSubWindow(self.view.plot_window)
+        self._accept_dialog()
         stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
-        if self.view.channel_widget.is_avg:
-            self.plot_one_channel(marked_channels, stimulus_marked_channels, 0)
-        else:
-            for i, ch in enumerate(marked_channels):
-                self.plot_one_channel([ch], stimulus_marked_channels, i)
-
-        self.view.plot_window.show()
-        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.plot_window.closeEvent = lambda x: self._remove_me()
-        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.canvas.figure.tight_layout()
+        self._run_in_background("Spike", partial(self._calculate_spikes, marked_channels, stimulus_marked_channels,
+                                                 self._read_parameters()), self._plot_spikes)
 
-    def plot_one_channel(self, marked_channels: list, stimulus_marked_channels: list, ax_idx: int):
+    def _calculate_spikes(self, marked_channels: list, stimulus_marked_channels: list, parameters: dict,
+                          task: BackgroundTask) -> (list, list):
         """
-        This function plots one particular channels spikes and stimulus if the length of the
-        marked_channels is 1, if not, then it averages the signal and plots the above mentioned things so.
+        Calculates spikes, their labels, bursts and stimulus of every axis, it runs on a worker thread
 
         Args:
             marked_channels (list): user's chosen channels list
             stimulus_marked_channels (list): user's chosen stimulus channels list
-            ax_idx (int): the index to plot
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+
+        Returns:
+            axes (list -> tuple): (signal, time, fs, title, spikes with colors, bursts with colors) of every axis
+            stimulus_time_range (list): stimulus times in seconds
         """
-        spike_together_obj = self._create_spiketogether_module(marked_channels)
+        channel_groups, spike_together_objs, _ = self._create_sorted_spiketogether_modules(marked_channels,
+                                                                                           parameters, task)
+        axes = []
+        for i, (channels, spike_together_obj) in enumerate(zip(channel_groups, spike_together_objs)):
+            task.report("Labeling spikes and finding bursts", i, len(spike_together_objs))
+            indices_colors_for_bursts = []
+            indices_colors_for_spikes = spike_together_obj.spike_labels_indexes
+            if parameters["is_burst"]:
+                indices_colors_for_bursts = self._create_bursts(spike_together_obj, parameters).bursts_colored_indexes
+            axes.append((spike_together_obj.signal, spike_together_obj.time, spike_together_obj.fs, channels,
+                         indices_colors_for_spikes, indices_colors_for_bursts))
 
-        labels = spike_together_obj.labels
-        indices_colors_for_bursts = []    
-        indices_colors_for_spikes = get_spikes_with_labels(labels, spike_together_obj.indexes)
+        task.report("Detecting stimulus")
         if len(stimulus_marked_channels):
-            stimulus = self._create_stimulus(stimulus_marked_channels)
-            stimulus_time_range = stimulus.time_range
+            stimulus_time_range = self._create_stimulus(stimulus_marked_channels, parameters).time_range
         else:
             stimulus_time_range = []
-        if self.view.burst_group_box.isChecked():
-            bursts_obj = Bursts(spike_together_obj, self.view.burst_max_start.text(), self.view.burst_max_end.text(),
-                                self.view.burst_between.text(), self.view.burst_duration.text(), self.view.burst_number.text())
-            indices_colors_for_bursts = bursts_obj.bursts_colored_indexes
+        return axes, stimulus_time_range
 
-        plot_signal_with_spikes(spike_together_obj.signal, spike_together_obj.time, spike_together_obj.fs, self.view.canvas,
-                                marked_channels, "Time (seconds)", "Signal voltage", indices_colors_for_spikes,
-                                ax_idx, indices_colors_for_bursts)
-        plot_stimulus(stimulus_time_range, self.view.canvas, ax_idx=ax_idx)
+    def _plot_spikes(self, result: (list, list)) -> None:
+        """
+        Plots the calculated spikes, bursts and stimulus, every channel (or average) on its own axis
+
+        Args:
+            result (tuple): axes and stimulus time range calculated by _calculate_spikes
+        """
+        axes, stimulus_time_range = result
+        self.view.create_plot_window("Spike", "icons/spike.png")
+        self.mdi.addSubWindow(self.view.plot_window)
+        for ax_idx, (signal, time, fs, channels, indices_colors_for_spikes, indices_colors_for_bursts) in enumerate(axes):
+            plot_signal_with_spikes(signal, time, fs, self.view.canvas, channels, "Time (seconds)", "Signal voltage",
+                                    indices_colors_for_spikes, ax_idx, indices_colors_for_bursts)
+            plot_stimulus(stimulus_time_range, self.view.canvas, ax_idx=ax_idx)
+        self._show_plot_window()
 
 
     @catch_exception
@@ -100,16 +115,55 @@ class SpikeController(Controller):
             if len(marked_channels) == 0:
                 raise ValueError("At least one channel should be marked")   
             stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
-            if self.view.channel_widget.is_avg:
-                self.extract_spike_dataframe(path, marked_channels, stimulus_marked_channels)
+            self._run_in_background("Spike extract",
+                                    partial(self._extract_spikes, path, marked_channels, stimulus_marked_channels,
+                                            self._read_parameters()),
+                                    lambda result: self.popup_handler.info_popup("Success", "Data Created successfully"))
 
-            else:
-                for ch in marked_channels:
-                    self.extract_spike_dataframe(path, [ch], stimulus_marked_channels)
+    def _extract_spikes(self, path: str, marked_channels: list, stimulus_marked_channels: list, parameters: dict,
+                        task: BackgroundTask) -> None:
+        """
+        Calculates and extracts spikes of every channel (or average), it runs on a worker thread
 
-            self.popup_handler.info_popup("Success", "Data Created successfully")
+        Args:
+            path (str): path to save the dataframes
+            marked_channels (list): marked spike channels
+            stimulus_marked_channels (list): marked stimulus channels
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+        """
+        channel_groups, spike_together_objs, spike_table = self._create_sorted_spiketogether_modules(
+            marked_channels, parameters, task)
+        for i, (channels, spike_together_obj) in enumerate(zip(channel_groups, spike_together_objs)):
+            task.report("Writing spikes", i, len(spike_together_objs))
+            self.extract_spike_dataframe(path, channels, stimulus_marked_channels, parameters, spike_together_obj)
+        if spike_table is not None:
+            task.report("Writing spike table")
+            self.extract_spike_table(path, marked_channels, spike_together_objs, spike_table)
 
-    def extract_spike_dataframe(self, path: str, marked_channels: list, stimulus_marked_channels: list) -> None:
+    @staticmethod
+    def extract_spike_table(path: str, marked_channels: list, spike_together_objs: list,
+                            spike_table: SpikeTable) -> None:
+        """
+        This function writes one row per spike of the marked channels with its channel, time, unit label and
+        amplitude. Labels are written into a copy of the spike table, because the table is shared with other windows
+
+        Args:
+            path (str): path to save the dataframe
+            marked_channels (list): marked spike channels
+            spike_together_objs (list -> SpikeTogether): sorted single channel objects of the marked channels
+            spike_table (SpikeTable): spikes of the marked channels, which the objects took their spikes from
+        """
+        channel_ids = [spike_together_obj._channels[0] for spike_together_obj in spike_together_objs]
+        labeled_table = spike_table.get_labeled({channel_id: spike_together_obj.unit_labels for channel_id,
+                                                 spike_together_obj in zip(channel_ids, spike_together_objs)},
+                                                spike_together_objs[0]._from_idx, spike_together_objs[0]._to_idx)
+        spike_table_df = labeled_table.to_dataframe()
+        spike_table_df["channel"] = spike_table_df["channel"].map(dict(zip(channel_ids, marked_channels)))
+        spike_table_df.to_csv(path + f" {marked_channels} " + "_spike_table.csv", index=False)
+
+    def extract_spike_dataframe(self, path: str, marked_channels: list, stimulus_marked_channels: list,
+                                parameters: dict, spike_together_obj: SpikeTogether = None) -> None:
         """
         This function firstly makes the spike module object, preprocesses signal, calculates spikes
         with appropriate parameters and then extracts those spikes into the user's desired input path
@@ -118,8 +172,11 @@ class SpikeController(Controller):
             path (str): path to save the dataframe
             marked_channels (list): marked spike channels
             stimulus_marked_channels (list): marked stimulus channels
+            parameters (dict): view's parameters read by _read_parameters
+            spike_together_obj (SpikeTogether): already created (and sorted) object of the marked channels
         """
-        spike_together_obj = self._create_spiketogether_module(marked_channels)
+        if spike_together_obj is None:
+            spike_together_obj = self._create_spiketogether_module(marked_channels, parameters)
         spikes_df = pd.DataFrame()
         signal = spike_together_obj.signal
         time_in_sec = spike_together_obj.time
@@ -134,9 +191,8 @@ class SpikeController(Controller):
                 to_be_spikes[indices] = i
                 i += 1
         spikes_df[f"spikes {marked_channels}"] = to_be_spikes
-        if self.view.burst_group_box.isChecked():
-            bursts_obj = Bursts(spike_together_obj, self.view.burst_max_start.text(), self.view.burst_max_end.text(),
-                                self.view.burst_between.text(), self.view.burst_duration.text(), self.view.burst_number.text())
+        if parameters["is_burst"]:
+            bursts_obj = self._create_bursts(spike_together_obj, parameters)
             to_be_bursts = np.zeros(len(spikes_df))
             indices_colors_for_bursts = bursts_obj.bursts_colored_indexes
             if len(indices_colors_for_bursts):
@@ -149,7 +205,7 @@ class SpikeController(Controller):
         else:
             spikes_df[f"bursts {marked_channels}"] = np.zeros(len(spikes_df))
         if len(stimulus_marked_channels):
-            stimulus = self._create_stimulus(stimulus_marked_channels)
+            stimulus = self._create_stimulus(stimulus_marked_channels, parameters)
             stimulus_indexes = stimulus.indexes
             to_be_stimulus = np.zeros(len(spikes_df))
             if len(stimulus_indexes):
@@ -157,19 +213,73 @@ class SpikeController(Controller):
             spikes_df["Stimulus"] = to_be_stimulus
         spikes_df.to_csv(path +f" {marked_channels} "+"_spikes.csv", index=False)
 
-    def _create_spiketogether_module(self, marked_channels: list) -> SpikeTogether:
+    def _create_sorted_spiketogether_modules(self, marked_channels: list, parameters: dict,
+                                             task: BackgroundTask) -> (list, list, SpikeTable):
+        """
+        Creates spiketogether objects of the average or of every channel and sorts their spikes,
+        single channels take their spikes from one spike table and are sorted together
+
+        Args:
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+
+        Returns:
+            channel_groups (list -> list): channels of every object
+            spike_together_objs (list -> SpikeTogether): sorted objects
+            spike_table (SpikeTable): spikes of the single channels, None for the average
+        """
+        if parameters["is_avg"]:
+            task.report("Detecting spikes")
+            spike_together_objs = [self._create_spiketogether_module(marked_channels, parameters)]
+            channel_groups, spike_table = [marked_channels], None
+        else:
+            spike_table = self._create_spike_controller_spike_table(marked_channels, parameters, task)
+            spike_together_objs = [self._create_spiketogether_module([ch], parameters, spike_table)
+                                   for ch in marked_channels]
+            channel_groups = [[ch] for ch in marked_channels]
+        task.report("Sorting spikes")
+        SpikeTogether.sort_together(spike_together_objs)
+        return channel_groups, spike_together_objs, spike_table
+
+    def _read_parameters(self) -> dict:
+        """
+        Reads the view's parameters and "is_burst", whether bursts are checked, on the GUI thread
+        """
+        parameters = super()._read_parameters()
+        parameters["is_burst"] = self.view.burst_group_box.isChecked()
+        return parameters
+
+    def _create_spike_controller_spike_table(self, channels: list, parameters: dict,
+                                             task: BackgroundTask = None) -> SpikeTable:
+        """
+        Detects spikes of all channels at once with the spike parameters
+        """
+        return self._create_spike_table(channels, parameters, parameters["spike_dead_time"],
+                                        parameters["spike_threshold_from"], parameters["spike_threshold_to"], task)
+
+    def _create_bursts(self, spike_together_obj: SpikeTogether, parameters: dict) -> Bursts:
+        """
+        Creates bursts class object
+        """
+        return Bursts(spike_together_obj, parameters["burst_max_start"], parameters["burst_max_end"],
+                      parameters["burst_between"], parameters["burst_duration"], parameters["burst_number"])
+
+    def _create_spiketogether_module(self, marked_channels: list, parameters: dict,
+                                     spike_table: SpikeTable = None) -> SpikeTogether:
         """
         Creates spiketogether class object
         """
-        return SpikeTogether(self.view.pre.text(), self.view.post.text(), self.view.component_number.text(),
-                             self.view.spike_dead_time.text(), self.view.spike_threshold_from.text(), self.view.spike_threshold_to.text(),
-                             self.file.recordings[0].analog_streams[0], marked_channels, self.view.from_s.text(),
-                             self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(SpikeTogether, marked_channels, parameters, pre=parameters["pre"],
+                              post=parameters["post"], component_number=parameters["component_number"],
+                              dead_time=parameters["spike_dead_time"],
+                              threshold_from=parameters["spike_threshold_from"],
+                              threshold_to=parameters["spike_threshold_to"], spike_table=spike_table)
 
-    def _create_stimulus(self, channels: list) -> Stimulus:
+    def _create_stimulus(self, channels: list, parameters: dict) -> Stimulus:
         """
         Creates stimulus class object
         """
-        return Stimulus(self.view.stimulus_dead_time.text(), self.view.stimulus_threshold_from.text(),
-                        self.view.stimulus_threshold_to.text(), self.file.recordings[0].analog_streams[0], channels,
-                        self.view.from_s.text(), self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(Stimulus, channels, parameters, dead_time=parameters["stimulus_dead_time"],
+                              threshold_from=parameters["stimulus_threshold_from"],
+                              threshold_to=parameters["stimulus_threshold_to"])
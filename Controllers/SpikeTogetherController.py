@@ -1,5 +1,9 @@
+from functools import partial
+from Controllers.BackgroundTask import BackgroundTask
 from Controllers.Controller import Controller
 from Controllers.utils import catch_exception
+from Modules.Pipeline import pipeline
+from Modules.SpikeTable import SpikeTable
 from Modules.SpikeTogether import SpikeTogether
 from Modules.utils import plot_spikes_together
 from Widgets.SpikeTogetherWidget import SpikeTogetherWidget
@@ -14,6 +18,9 @@ class SpikeTogetherController(Controller):
 
     Note that, Arguments are documented in parent class
     """
+    parameter_names = Controller.parameter_names + ("pre", "post", "component_number", "dead_time", "threshold_from",
+                                                    "threshold_to")
+
     def __init__(self, *args):
         self.view = SpikeTogetherWidget("Description\n On the given tab we are observing the shape of signal around "
                                         "spikes. which helps to analyse unit or multi-neural activities. you can "
@@ -25,49 +32,71 @@ class SpikeTogetherController(Controller):
     @catch_exception
     def plot_clicked(self):
         """
-        This function firstly makes the spiketogether module object, preprocesses signal and then
-        uses plot function from utils to plot the calculated waveforms of spikes.
+        This function firstly makes the spiketogether module object, preprocesses signal and sorts spikes
+        in background and then uses plot function from utils to plot the calculated waveforms of spikes.
         """
         marked_channels = self.view.channel_widget.marked_spike_channels
         if len(marked_channels) == 0:
             raise ValueError("At least one channel should be marked")
 
-        if self._dialog:
-            self._dialog.accept()
-            self._dialog = None
+        self._accept_dialog()
+        self._run_in_background("Spike together",
+                                partial(self._calculate_spikes_together, marked_channels, self._read_parameters()),
+                                self._plot_spikes_together)
+
+    def _calculate_spikes_together(self, marked_channels: list, parameters: dict, task: BackgroundTask) -> list:
+        """
+        Detects and sorts spikes of the average or of every channel, it runs on a worker thread
+
+        Args:
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+
+        Returns:
+            axes (list -> tuple): (sorted spiketogether object, title) of every axis
+        """
+        if parameters["is_avg"]:
+            task.report("Detecting spikes")
+            spike_objs, titles = [self._create_spiketogether_module(marked_channels, parameters)], [marked_channels]
+        else:
+            spike_table = self._create_spike_table(marked_channels, parameters, parameters["dead_time"],
+                                                   parameters["threshold_from"], parameters["threshold_to"], task)
+            spike_objs = [self._create_spiketogether_module([ch], parameters, spike_table) for ch in marked_channels]
+            titles = marked_channels
+        task.report("Sorting spikes")
+        SpikeTogether.sort_together(spike_objs)
+        return list(zip(spike_objs, titles))
+
+    def _plot_spikes_together(self, axes: list) -> None:
+        """
+        Plots the sorted waveforms of spikes, every channel (or average) on its own axis
 
+        Args:
+            axes (list -> tuple): (spiketogether object, title) of every axis
+        """
         self.view.create_plot_window("Spike together", "icons/spike_together.png")
         self.mdi.addSubWindow(self.view.plot_window)
-
-        if self.view.channel_widget.is_avg:
-            spike_obj = self._create_spiketogether_module(marked_channels)
+        for i, (spike_obj, title) in enumerate(axes):
             plot_spikes_together(spike_obj.cutouts, spike_obj.labels, spike_obj.fs,
-                                 spike_obj.component_number, spike_obj.pre, spike_obj.post, number_spikes=None,
-                                 canvas=self.view.canvas, title=marked_channels, ax_idx=0)
-        else:
-            for i, ch in enumerate(marked_channels):
-                spike_obj = self._create_spiketogether_module([ch])
-                plot_spikes_together(spike_obj.cutouts, spike_obj.labels, spike_obj.fs,
-                                     spike_obj.component_number, spike_obj.pre, spike_obj.post, number_spikes=None,
-                                     canvas=self.view.canvas, title=ch, ax_idx=i)
-        self.view.plot_window.show()
-        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.plot_window.closeEvent = lambda x: self._remove_me()
-        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.canvas.figure.tight_layout()
+                                 spike_obj.units_number, spike_obj.pre, spike_obj.post, number_spikes=None,
+                                 canvas=self.view.canvas, title=title, ax_idx=i)
+        self._show_plot_window()
 
-    def _create_spiketogether_module(self, marked_channels: list) -> SpikeTogether:
+    def _create_spiketogether_module(self, marked_channels: list, parameters: dict,
+                                     spike_table: SpikeTable = None) -> SpikeTogether:
         """
         Creates spiketogether object
         """
-        return SpikeTogether(self.view.pre.text(), self.view.post.text(), self.view.component_number.text(),
-                             self.view.dead_time.text(), self.view.threshold_from.text(), self.view.threshold_to.text(),
-                             self.file.recordings[0].analog_streams[0], marked_channels, self.view.from_s.text(),
-                             self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(SpikeTogether, marked_channels, parameters, pre=parameters["pre"],
+                              post=parameters["post"], component_number=parameters["component_number"],
+                              dead_time=parameters["dead_time"], threshold_from=parameters["threshold_from"],
+                              threshold_to=parameters["threshold_to"], spike_table=spike_table)
 
     def _remove_me(self) -> None:
         """
         Removes the desired window from open_window_dict
         """
         del self.open_window_dict[self._key]
+        pipeline.release(self)
         self.parameters_dock.setWidget(get_default_widget())
\ No newline at end of file
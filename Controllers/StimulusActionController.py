@@ -1,7 +1,10 @@
 import numpy as np
 import pandas as pd
+from functools import partial
+from Controllers.BackgroundTask import BackgroundTask
 from Controllers.Controller import Controller
 from Controllers.utils import catch_exception
+from Modules.SpikeTable import SpikeTable
 from Modules.stimulus import Stimulus
 from Modules.utils import plot_bins, plot_stimulus
 from Widgets.StimulusActionWidget import StimulusActionWidget
@@ -16,6 +19,11 @@ class StimulusActionController(Controller):
 
     Note that, Arguments are documented in parent class
     """
+    parameter_names = Controller.parameter_names + ("pre", "post", "bin_width", "spike_dead_time",
+                                                    "spike_threshold_from", "spike_threshold_to",
+                                                    "stimulus_dead_time", "stimulus_threshold_from",
+                                                    "stimulus_threshold_to", "useless_stimulus_ranges")
+
     def __init__(self, *args):
         self.view = StimulusActionWidget("Description\n On the given tab we are observing the distribution of spikes "
                                          "around stimulus. choose time range so that there is the same type of "
@@ -30,55 +38,75 @@ class StimulusActionController(Controller):
     @catch_exception
     def plot_clicked(self) -> None:
         """
-        This function firstly makes the stimulus action module object, which makes calculations
-        based on the users desired inputs. After that it plots the appropriate graphs
+        This function firstly makes the stimulus action module objects, which make calculations
+        based on the users desired inputs in background. After that it plots the appropriate graphs
         """
         marked_channels = self.view.channel_widget.marked_spike_channels
-        stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
-        if len(stimulus_marked_channels):
-            stimulus = self._create_stimulus(stimulus_marked_channels)
-            stimulus_indexes = stimulus.indexes
-        else:
-            stimulus_indexes = []
-
         if len(marked_channels) == 0:
             raise ValueError("At least one channel should be marked")
 
-        if self._dialog:
-            self._dialog.accept()
-            self._dialog = None
+        self._accept_dialog()
+        stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
+        self._run_in_background("Stimulus Action", partial(self._calculate_stimulus_actions, marked_channels,
+                                                           stimulus_marked_channels, self._read_parameters()),
+                                self._plot_stimulus_actions)
 
-        self.view.create_plot_window("Stimulus Action", "icons/stimulus_action.png")
-        self.mdi.addSubWindow(self.view.plot_window)
+    def _calculate_stimulus_actions(self, marked_channels: list, stimulus_marked_channels: list, parameters: dict,
+                                    task: BackgroundTask) -> list:
+        """
+        Detects stimulus and calculates stimulus action bins of the average or of every channel,
+        single channels take their spikes from one spike table. it runs on a worker thread
 
-        if self.view.channel_widget.is_avg:
-            self.plt_bin_in_channel(marked_channels, stimulus_indexes, 0)
-        else:
-            for i, ch in enumerate(marked_channels):
-                self.plt_bin_in_channel([ch], stimulus_indexes, i)
+        Args:
+            marked_channels (list): user's chosen channels list
+            stimulus_marked_channels (list): user's chosen stimulus channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
 
-        self.view.plot_window.show()
-        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.plot_window.closeEvent = lambda x: self._remove_me()
-        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.canvas.figure.tight_layout()
+        Returns:
+            axes (list -> tuple): (channels, bins) of every axis, where bins are
+                                  (bin_list, bin_list_x, bin_list_stde, bin_width) or None if there is no stimulus
+        """
+        task.report("Detecting stimulus")
+        if len(stimulus_marked_channels):
+            stimulus_indexes = self._create_stimulus(stimulus_marked_channels, parameters).indexes
+        else:
+            stimulus_indexes = []
 
-    def plt_bin_in_channel(self, ch: list, stimulus_indexes: list, i: int) -> None:
+        if parameters["is_avg"]:
+            channel_groups, spike_table = [marked_channels], None
+        else:
+            channel_groups = [[ch] for ch in marked_channels]
+            spike_table = None
+            if len(stimulus_indexes):
+                spike_table = self._create_stimulus_action_spike_table(marked_channels, parameters, task)
+
+        axes = []
+        for i, channels in enumerate(channel_groups):
+            task.report("Calculating stimulus action", i, len(channel_groups))
+            if not len(stimulus_indexes):
+                axes.append((channels, None))
+                continue
+            _stimulusAction_obj = self._create_stimulus_action(channels, stimulus_indexes, parameters, spike_table)
+            axes.append((channels, (*self.get_bin_df(_stimulusAction_obj), _stimulusAction_obj.bin_width)))
+        return axes
+
+    def _plot_stimulus_actions(self, axes: list) -> None:
         """
-        This function draws one particular channels stimulus action
-        if the ch contains more than one channel, it will average the signal
+        Plots the calculated stimulus actions, every channel (or average) on its own axis
 
         Args:
-            ch (list): user chosen channels
-            stimulus_indexes (list): indexes of user chosen stimulus
-            i (int): index to draw in axes
+            axes (list -> tuple): calculated axes of _calculate_stimulus_actions
         """
-        if len(stimulus_indexes):
-            _stimulusAction_obj = self._create_stimulus_action(ch, stimulus_indexes)
-            bin_list, bin_list_x, bin_list_stde = self.get_bin_df(_stimulusAction_obj)
-            plot_bins(bin_list, bin_list_x, _stimulusAction_obj.bin_width, self.view.canvas, ch, "Bin Timestamp (s)",
-                    "Bin Freq (hz)", ax_idx=i, yerr=bin_list_stde)
-        plot_stimulus([0], self.view.canvas, ax_idx=i)
+        self.view.create_plot_window("Stimulus Action", "icons/stimulus_action.png")
+        self.mdi.addSubWindow(self.view.plot_window)
+        for i, (channels, bins) in enumerate(axes):
+            if bins is not None:
+                bin_list, bin_list_x, bin_list_stde, bin_width = bins
+                plot_bins(bin_list, bin_list_x, bin_width, self.view.canvas, channels, "Bin Timestamp (s)",
+                          "Bin Freq (hz)", ax_idx=i, yerr=bin_list_stde)
+            plot_stimulus([0], self.view.canvas, ax_idx=i)
+        self._show_plot_window()
     
     def get_bin_df(self, _stimulusAction_obj: StimulusAction) -> (list, list, list):
         """
@@ -105,65 +133,93 @@ class StimulusActionController(Controller):
         path = self.view.get_path_for_save()
         if path:
             marked_channels = self.view.channel_widget.marked_spike_channels
-            stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
-            if len(stimulus_marked_channels):
-                stimulus = self._create_stimulus(stimulus_marked_channels)
-                stimulus_indexes = stimulus.indexes
-            else:
-                stimulus_indexes = []
-
             if len(marked_channels) == 0:
                 raise ValueError("At least one channel should be marked")
 
-            if self._dialog:
-                self._dialog.accept()
-                self._dialog = None
+            self._accept_dialog()
+            stimulus_marked_channels = self.view.channel_widget.marked_stimulus_channels
+            self._run_in_background("Stimulus Action extract",
+                                    partial(self._extract_stimulus_actions, path, marked_channels,
+                                            stimulus_marked_channels, self._read_parameters()),
+                                    lambda result: self.popup_handler.info_popup("Success", "Data Created successfully"))
+
+    def _extract_stimulus_actions(self, path: str, marked_channels: list, stimulus_marked_channels: list,
+                                  parameters: dict, task: BackgroundTask) -> None:
+        """
+        Calculates stimulus action bins of the average or of every channel and writes them into one csv file,
+        it runs on a worker thread
 
-            if self.view.channel_widget.is_avg:
-                _stimulusAction_obj = self._create_stimulus_action(marked_channels, stimulus_indexes)
+        Args:
+            path (str): path to save the dataframe
+            marked_channels (list): user's chosen channels list
+            stimulus_marked_channels (list): user's chosen stimulus channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+        """
+        task.report("Detecting stimulus")
+        if len(stimulus_marked_channels):
+            stimulus = self._create_stimulus(stimulus_marked_channels, parameters)
+            stimulus_indexes = stimulus.indexes
+        else:
+            stimulus_indexes = []
+
+        if parameters["is_avg"]:
+            task.report("Calculating stimulus action")
+            _stimulusAction_obj = self._create_stimulus_action(marked_channels, stimulus_indexes, parameters)
+            bin_list, bin_list_x, bin_list_stde = self.get_bin_df(_stimulusAction_obj)
+            stimulus_action_df = pd.DataFrame()
+            stimulus_action_df["range"] = bin_list_x
+            stimulus_action_df["bin_freq f{marked_channels}"] = bin_list
+            stimulus_action_df["bin_freq_std f{marked_channels}"] = bin_list_stde
+            stimulus_action_df.to_csv(path + "_stimulus_action.csv", index=False)
+
+        else:
+            stimulus_action_df = pd.DataFrame()
+            spike_table = self._create_stimulus_action_spike_table(marked_channels, parameters, task)
+            for i, ch in enumerate(marked_channels):
+                task.report("Calculating stimulus action", i, len(marked_channels))
+                _stimulusAction_obj = self._create_stimulus_action([ch], stimulus_indexes, parameters, spike_table)
                 bin_list, bin_list_x, bin_list_stde = self.get_bin_df(_stimulusAction_obj)
-                stimulus_action_df = pd.DataFrame()
-                stimulus_action_df["range"] = bin_list_x
-                stimulus_action_df["bin_freq f{marked_channels}"] = bin_list
-                stimulus_action_df["bin_freq_std f{marked_channels}"] = bin_list_stde
-                stimulus_action_df.to_csv(path + "_stimulus_action.csv", index=False)
-
-            else:
-                stimulus_action_df = pd.DataFrame()
-                for i, ch in enumerate(marked_channels):
-                    _stimulusAction_obj = self._create_stimulus_action(marked_channels, stimulus_indexes)
-                    bin_list, bin_list_x, bin_list_stde = self.get_bin_df(_stimulusAction_obj)
-                    if i == 0:
-                        stimulus_action_df["range"] = bin_list_x
-                    stimulus_action_df[f"bin_freq {ch}"] = bin_list
-                    stimulus_action_df[f"bin_freq_std {ch}"] = bin_list_stde
-                stimulus_action_df.to_csv(path + "_stimulus_action.csv", index=False)
-
-            self.popup_handler.info_popup("Success", "Data Created successfully")
-
-    def _create_stimulus(self, channels: list) -> Stimulus:
+                if i == 0:
+                    stimulus_action_df["range"] = bin_list_x
+                stimulus_action_df[f"bin_freq {ch}"] = bin_list
+                stimulus_action_df[f"bin_freq_std {ch}"] = bin_list_stde
+            stimulus_action_df.to_csv(path + "_stimulus_action.csv", index=False)
+
+    def _create_stimulus(self, channels: list, parameters: dict) -> Stimulus:
         """
         firstly changes the users input useless stimulus ranges' format.
         Creates stimulus class object
 
         Args:
             channels (list): chosen channels
+            parameters (dict): view's parameters read by _read_parameters
 
         Returns:
 
         """
-        useless_stimulus_ranges = list(map(lambda x: x.split("-"), self.view.useless_stimulus_ranges.text().split(",")))
+        useless_stimulus_ranges = list(map(lambda x: x.split("-"), parameters["useless_stimulus_ranges"].split(",")))
         useless_stimulus_ranges = "" if not useless_stimulus_ranges[0][0] else useless_stimulus_ranges
-        return Stimulus(self.view.stimulus_dead_time.text(), self.view.stimulus_threshold_from.text(),
-                        self.view.stimulus_threshold_to.text(),useless_stimulus_ranges, self.file.recordings[0].analog_streams[0], channels,
-                        self.view.from_s.text(), self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(Stimulus, channels, parameters, dead_time=parameters["stimulus_dead_time"],
+                              threshold_from=parameters["stimulus_threshold_from"],
+                              threshold_to=parameters["stimulus_threshold_to"],
+                              useless_stimulus=useless_stimulus_ranges)
     
-    def _create_stimulus_action(self, channels: list, stimulus_indexes: list) -> StimulusAction:
+    def _create_stimulus_action_spike_table(self, channels: list, parameters: dict,
+                                            task: BackgroundTask = None) -> SpikeTable:
+        """
+        Detects spikes of all channels at once with the stimulus action's spike parameters
+        """
+        return self._create_spike_table(channels, parameters, parameters["spike_dead_time"],
+                                        parameters["spike_threshold_from"], parameters["spike_threshold_to"], task)
+
+    def _create_stimulus_action(self, channels: list, stimulus_indexes: list, parameters: dict,
+                                spike_table: SpikeTable = None) -> StimulusAction:
         """
         Creates stimulus action class object
         """
-        return StimulusAction(self.view.pre.text(), self.view.post.text(), self.view.bin_width.text(), stimulus_indexes,
-                              self.view.spike_dead_time.text(), self.view.spike_threshold_from.text(),
-                              self.view.spike_threshold_to.text(), self.file.recordings[0].analog_streams[0], channels,
-                              self.view.from_s.text(), self.view.to_s.text(), self.view.high_pass.text(),
-                              self.view.low_pass.text())
+        return self._get_node(StimulusAction, channels, parameters, pre=parameters["pre"], post=parameters["post"],
+                              bin_width=parameters["bin_width"], stimulus_indexes=stimulus_indexes,
+                              dead_time=parameters["spike_dead_time"],
+                              threshold_from=parameters["spike_threshold_from"],
+                              threshold_to=parameters["spike_threshold_to"], spike_table=spike_table)
@@ -1,4 +1,7 @@
+import numpy as np
 import pandas as pd
+from functools import partial
+from Controllers.BackgroundTask import BackgroundTask
 from Controllers.Controller import Controller
 from Controllers.utils import catch_exception
 from Modules.Waveform import Waveform
@@ -11,8 +14,13 @@ class WaveformController(Controller):
     WaveformController class is for UI and module relationship while displaying the waveform widget
     On the given widget we are observing the behavior of the selected signals.
 
+    Attributes:
+        export_chunk_size (int): number of samples which are written into the file at once while extracting
+
     Note that, Arguments are documented in parent class
     """
+    export_chunk_size = 1_000_000
+
     def __init__(self, *args):
         self.view = WaveformWidget("Description\n On the given tab we are observing the behavior of the selected "
                                    "signals. You can analyze several channels or an average of them by selecting "
@@ -25,43 +33,60 @@ class WaveformController(Controller):
     @catch_exception
     def plot_clicked(self) -> None:
         """
-        This function firstly makes the waveform module object, preprocesses signal and then uses
+        This function firstly makes the waveform module object, preprocesses signal in background and then uses
         waveform plot function from utils to plot the desired signal.
         """
         marked_channels = self.view.channel_widget.marked_spike_channels
         if len(marked_channels) == 0:
             raise ValueError("At least one channel should be marked")
 
-        if self._dialog:
-            self._dialog.accept()
-            self._dialog = None
+        self._accept_dialog()
+        self._run_in_background("Waveform", partial(self._calculate_signals, marked_channels, self._read_parameters()),
+                                self._plot_signals)
 
-        self.view.create_plot_window("Waveform", "icons/waveform.png")
-        self.mdi.addSubWindow(self.view.plot_window)
+    def _calculate_signals(self, marked_channels: list, parameters: dict, task: BackgroundTask) -> list:
+        """
+        Reads and filters the signal of every axis, it runs on a worker thread
 
-        if self.view.channel_widget.is_avg:
-            waveform = self._create_waveform(marked_channels)
-            filtered_signal = waveform.signal
-            plot_signal(filtered_signal, waveform.time, self.view.canvas,
-                        marked_channels, "Time (seconds)", "Signal (uV)", ax_idx=0)
+        Args:
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+
+        Returns:
+            signals (list -> tuple): (filtered signal, time, title) of every axis
+        """
+        if parameters["is_avg"]:
+            channel_groups, titles = [marked_channels], [marked_channels]
         else:
-            for i, ch in enumerate(marked_channels):
-                waveform = self._create_waveform([ch])
-                filtered_signal = waveform.signal
-                plot_signal(filtered_signal, waveform.time, self.view.canvas,
-                            ch, "Time (seconds)", "Signal (uV)", ax_idx=i)
-
-        self.view.plot_window.show()
-        self.view.plot_widget.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.plot_window.closeEvent = lambda x: self._remove_me()
-        self.view.canvas.mousePressEvent = lambda x: self.parameters_dock.setWidget(self.view)
-        self.view.canvas.figure.tight_layout()
+            channel_groups, titles = [[ch] for ch in marked_channels], marked_channels
+
+        signals = []
+        for i, (channels, title) in enumerate(zip(channel_groups, titles)):
+            task.report("Reading and filtering signals", i, len(channel_groups))
+            waveform = self._create_waveform(channels, parameters)
+            signals.append((waveform.signal, waveform.time, title))
+        return signals
+
+    def _plot_signals(self, signals: list) -> None:
+        """
+        Plots the calculated signals, every signal on its own axis
+
+        Args:
+            signals (list -> tuple): (filtered signal, time, title) of every axis
+        """
+        self.view.create_plot_window("Waveform", "icons/waveform.png")
+        self.mdi.addSubWindow(self.view.plot_window)
+        for i, (filtered_signal, time, title) in enumerate(signals):
+            plot_signal(filtered_signal, time, self.view.canvas, title, "Time (seconds)", "Signal (uV)", ax_idx=i)
+        self._show_plot_window()
 
     @catch_exception
     def extract_clicked(self):
         """
         This function firstly makes the waveform module object, preprocesses signal and then uses
-        extracts that desired signal into the user's desired input path
+        extracts that desired signal into the user's desired input path.
+        signals are streamed chunk by chunk into the file, so long recordings don't need to fit in memory
         """
         path = self.view.get_path_for_save()
         if path:
@@ -69,27 +94,41 @@ class WaveformController(Controller):
             if len(marked_channels) == 0:
                 raise ValueError("At least one channel should be marked")
 
-            if self.view.channel_widget.is_avg:
-                waveform_dataframe = pd.DataFrame()
-                waveform = self._create_waveform(marked_channels)
-                waveform_dataframe["time"] = waveform.time
-                waveform_dataframe[f"Signal_{marked_channels}"] = waveform.signal
-                waveform_dataframe.to_csv(path + ".csv", index=False)
-
-            else:
-                waveform_dataframe = pd.DataFrame()
-                for i, ch in enumerate(marked_channels):
-                    waveform = self._create_waveform([ch])
-                    if i == 0:
-                        waveform_dataframe["time"] = waveform.time
-                    waveform_dataframe[f"signal_{ch}"] = waveform.signal
-                waveform_dataframe.to_csv(path + ".csv", index=False)
-
-            self.popup_handler.info_popup("Success", "Data Created successfully")
-
-    def _create_waveform(self, channels: list) -> Waveform:
+            self._run_in_background("Waveform extract",
+                                    partial(self._extract_signals, path, marked_channels, self._read_parameters()),
+                                    lambda result: self.popup_handler.info_popup("Success", "Data Created successfully"))
+
+    def _extract_signals(self, path: str, marked_channels: list, parameters: dict, task: BackgroundTask) -> None:
+        """
+        Writes signals into the csv file chunk by chunk, it runs on a worker thread
+
+        Args:
+            path (str): path to save the dataframe
+            marked_channels (list): user's chosen channels list
+            parameters (dict): view's parameters read by _read_parameters
+            task (Controllers.BackgroundTask.BackgroundTask): the running task
+        """
+        if parameters["is_avg"]:
+            waveforms = [self._create_waveform(marked_channels, parameters)]
+            column_names = [f"Signal_{marked_channels}"]
+        else:
+            waveforms = [self._create_waveform([ch], parameters) for ch in marked_channels]
+            column_names = [f"signal_{ch}" for ch in marked_channels]
+
+        start_idx = int(waveforms[0].from_s * waveforms[0].fs)
+        samples_number = waveforms[0]._to_idx - waveforms[0]._from_idx + 1
+        chunks_per_waveform = [waveform.iter_chunks(self.export_chunk_size) for waveform in waveforms]
+        for i, chunks in enumerate(zip(*chunks_per_waveform)):
+            task.report("Writing signals", i * self.export_chunk_size, samples_number)
+            waveform_dataframe = pd.DataFrame()
+            waveform_dataframe["time"] = np.arange(start_idx, start_idx + len(chunks[0])) / waveforms[0].fs
+            for column_name, chunk in zip(column_names, chunks):
+                waveform_dataframe[column_name] = chunk
+            waveform_dataframe.to_csv(path + ".csv", index=False, mode="w" if i == 0 else "a", header=i == 0)
+            start_idx += len(chunks[0])
+
+    def _create_waveform(self, channels: list, parameters: dict) -> Waveform:
         """
         Creates waveform class object
         """
-        return Waveform(self.file.recordings[0].analog_streams[0], channels, self.view.from_s.text(),
-                        self.view.to_s.text(), self.view.high_pass.text(), self.view.low_pass.text())
+        return self._get_node(Waveform, channels, parameters)
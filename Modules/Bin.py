@@ -1,3 +1,5 @@
+import numpy as np
+
 from Modules.ParamChecker import ParamChecker
 from Modules.Spikes import Spikes
 from Modules.utils import calculate_bins
@@ -10,7 +12,8 @@ class Bin(Spikes):
 
     Attributes:
         bin_width (float): the desired length (in seconds) for one bin
-        bins (list): the list where every element contains the quantity of spikes
+        bins (numpy.ndarray -> numpy.float64): spikes per second in every bin
+        bin_range (numpy.ndarray -> numpy.float64): the start second of every bin
 
     Args:
         bin_width (str): the desired length (in seconds) for one bin
@@ -25,7 +28,11 @@ class Bin(Spikes):
 
     @property
     def bins(self):
-        return self._bins
+        return self._memoize("bins", self._calculate_bins, ("time_range", "to_s", "bin_width"))
+
+    @property
+    def bin_range(self):
+        return np.arange(self.from_s, self.to_s, self.bin_width)
 
     @property
     def bin_width(self):
@@ -34,7 +41,7 @@ class Bin(Spikes):
     @bin_width.setter
     def bin_width(self, width: str) -> None:
         self._bin_width = ParamChecker(width, "Bin range").not_empty.number.positive.value
-        self._bins = self._calculate_bins()
+        self._invalidate("bin_width")
 
-    def _calculate_bins(self) -> list:
-        return calculate_bins(self.time_range, self.from_s, self.bin_width)
+    def _calculate_bins(self) -> np.ndarray:
+        return calculate_bins(self.time_range, self.from_s, self.to_s, self.bin_width)
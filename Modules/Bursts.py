@@ -1,3 +1,5 @@
+import numpy as np
+
 from Modules.ParamChecker import ParamChecker
 from Modules.utils import calculate_bursts
 
@@ -42,8 +44,8 @@ class Bursts:
         bursts_indexes = []
         for burst, color in colored_bursts:
             burst_start, burst_end = burst
-            burst_start = [int(temp_start*self.spike_together_obj.fs) for temp_start in burst_start]
-            burst_end = [int(temp_end*self.spike_together_obj.fs) for temp_end in burst_end]
+            burst_start = (burst_start * self.spike_together_obj.fs).astype(np.int64)
+            burst_end = (burst_end * self.spike_together_obj.fs).astype(np.int64)
             bursts_indexes.append(([burst_start, burst_end], color))
         return bursts_indexes
 
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+from typing import List, Optional
+
+import sklearn
+
+from Modules.SpikeSorting import SpikeSortingModel
+
+DEFAULT_STORE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".neurospace", "models")
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+_MODEL_EXTENSION = ".model"
+_NAMED_PREFIX = "named_"
+
+
+def get_model_key(*parts) -> str:
+    """
+    get_model_key turns everything, which the fitted model depends on (file, channels, parameters),
+    into a short name for the model file
+
+    Args:
+        parts: hashable description of the model, e.g. stream key, channels and spike sorting parameters
+
+    Returns:
+        key (str): sha1 hex digest of the parts
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+class SortingModelStore:
+    """
+    SortingModelStore keeps fitted spike sorting models (scaler, pca and gaussian mixture) in a local directory.
+    Models are saved under the key of (file, channels, filters, detection and sorting parameters), so spikes
+    of any time range of the file are labeled with predict, without fitting. Models can also be saved under
+    a user's name (e.g. the culture), then a model trained on one recording classifies spikes of later recordings
+    with predict only. Files are written atomically. Every file starts with the scikit-learn version,
+    which the model was pickled with, models of another version and unreadable files are treated as missing.
+    Models saved under keys are removed in least recently used order when they exceed max_bytes,
+    models saved under the user's names are kept until they are removed.
+
+    Attributes:
+        directory (str): the directory where model files are stored
+        max_bytes (int): size budget of the models saved under keys
+
+    Args:
+        directory (str): the directory where model files are stored, it is created on the first save
+        max_bytes (int): size budget of the models saved under keys
+    """
+    def __init__(self, directory: str = DEFAULT_STORE_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(self._get_path(key))
+
+    def load(self, key: str) -> Optional[SpikeSortingModel]:
+        """
+        loads the model saved under the key
+
+        Args:
+            key (str): model key, see get_model_key
+
+        Returns:
+            model (SpikeSortingModel / None): saved model, None if there is no readable model
+        """
+        try:
+            with open(self._get_path(key), "rb") as f:
+                # scikit-learn objects of another version unpickle with a warning only, but may predict wrongly
+                if pickle.load(f) != sklearn.__version__:
+                    return None
+                model = pickle.load(f)
+            # the modification time orders models for eviction
+            os.utime(self._get_path(key))
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        return model if isinstance(model, SpikeSortingModel) else None
+
+    def save(self, key: str, model: SpikeSortingModel) -> None:
+        """
+        saves the fitted model under the key, replacing the previous one
+
+        Args:
+            key (str): model key, see get_model_key
+            model (SpikeSortingModel): fitted model
+        """
+        if model.gmm is None:
+            raise ValueError("Only fitted spike sorting models can be saved")
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(sklearn.__version__, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._get_path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def try_save(self, key: str, model: SpikeSortingModel) -> bool:
+        """
+        saves the model like save, but an unwritable store is ignored, see Modules.ResultStore.ResultStore.try_save
+
+        Args:
+            key (str): model key, see get_model_key
+            model (SpikeSortingModel): fitted model
+
+        Returns:
+            saved (bool): whether the model was saved
+        """
+        try:
+            self.save(key, model)
+        except OSError:
+            return False
+        return True
+
+    def load_named(self, name: str) -> Optional[SpikeSortingModel]:
+        """
+        loads the model which was saved under the user's name
+
+        Args:
+            name (str): name of the model, e.g. the culture
+
+        Returns:
+            model (SpikeSortingModel / None): saved model, None if there is no readable model
+        """
+        return self.load(self._get_named_key(name))
+
+    def save_named(self, name: str, model: SpikeSortingModel) -> None:
+        """
+        saves the fitted model under the user's name, so later recordings can be labeled with it
+
+        Args:
+            name (str): name of the model, e.g. the culture
+            model (SpikeSortingModel): fitted model
+        """
+        self.save(self._get_named_key(name), model)
+
+    def names(self) -> List[str]:
+        """
+        Returns:
+            names (list -> str): names of the models, which were saved with save_named
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(file_name[len(_NAMED_PREFIX):-len(_MODEL_EXTENSION)] for file_name in os.listdir(self.directory)
+                      if file_name.startswith(_NAMED_PREFIX) and file_name.endswith(_MODEL_EXTENSION))
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        Returns:
+            size (int): total size of the models saved under keys in bytes
+        """
+        return sum(os.path.getsize(path) for path in self._get_keyed_paths())
+
+    def remove(self, key: str) -> None:
+        """
+        removes the model saved under the key, if there is one
+
+        Args:
+            key (str): model key
+        """
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self, keep_named: bool = False) -> None:
+        """
+        removes every saved model
+
+        Args:
+            keep_named (bool): keeps the models saved under the user's names
+        """
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith(_MODEL_EXTENSION) and not (keep_named and file_name.startswith(_NAMED_PREFIX)):
+                    os.remove(os.path.join(self.directory, file_name))
+
+    def _evict(self) -> None:
+        paths = []
+        for path in self._get_keyed_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            paths.append((stat.st_mtime, stat.st_size, path))
+        size_bytes = sum(size for _, size, _ in paths)
+        for _, size, path in sorted(paths):
+            if size_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size_bytes -= size
+
+    def _get_keyed_paths(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                if file_name.endswith(_MODEL_EXTENSION) and not file_name.startswith(_NAMED_PREFIX)]
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _MODEL_EXTENSION)
+
+    @staticmethod
+    def _get_named_key(name: str) -> str:
+        name = name.strip()
+        if not name or re.search(r'[\\/:*?"<>|]', name):
+            raise ValueError(f'"{name}" is not a valid model name')
+        return _NAMED_PREFIX + name
+
+
+model_store = SortingModelStore()
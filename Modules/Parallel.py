@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+import numpy as np
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """
+    returns the process pool of the app, which is shared by spike sorting and per-channel spike detection.
+    it is created on the first use (from any thread) and sized to the machine's cores
+
+    Returns:
+        executor (concurrent.futures.ProcessPoolExecutor): shared process pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # workers inherit the running resource tracker, so shared arrays they attach
+            # are not reported (and unlinked) as leaked by their own trackers
+            resource_tracker.ensure_running()
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _executor
+
+
+class SharedArray:
+    """
+    SharedArray is a numpy array placed in multiprocessing.shared_memory, so worker processes can read and write
+    it in place. Only its spec (name, shape, dtype) is sent to the workers, the data itself is never pickled.
+    The creator owns the memory: it is released when the with block ends or close is called.
+
+    Attributes:
+        array (numpy.ndarray): the shared array
+        spec (tuple): (shared memory name, shape, dtype) to attach the array in a worker
+
+    Args:
+        shape (tuple -> int): shape of the array
+        dtype (numpy.dtype): type of the array elements
+    """
+    def __init__(self, shape: tuple, dtype=np.float64):
+        dtype = np.dtype(dtype)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        self.spec = (self._shm.name, tuple(shape), dtype.str)
+
+    @staticmethod
+    def attach(spec: tuple) -> (shared_memory.SharedMemory, numpy.ndarray):
+        """
+        attaches the shared array in a worker process, the returned shared memory should be closed
+        (not unlinked) by the worker after the array is not used anymore
+
+        Args:
+            spec (tuple): SharedArray.spec of the creator
+
+        Returns:
+            shm (multiprocessing.shared_memory.SharedMemory): attached shared memory
+            array (numpy.ndarray): the shared array
+        """
+        name, shape, dtype = spec
+        shm = shared_memory.SharedMemory(name=name)
+        return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    def close(self) -> None:
+        if self._shm is None:
+            return
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self) -> "SharedArray":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
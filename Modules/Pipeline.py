@@ -0,0 +1,300 @@
+import inspect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+
+from Modules.SpikeSorting import TemplateClassifier
+from Modules.SpikeTable import SpikeTable, detect_spike_table
+from Modules.SpikeTogether import SpikeTogether
+from Modules.Waveform import Waveform
+
+# spike tables are compact, but every parameter set of every window adds one, the oldest are dropped
+MAX_SPIKE_TABLES = 16
+# seconds, which the detection of a missing edge of a spike table overlaps with the detected range,
+# detections are joined in the first half of the overlap, where both are complete (see SpikeTable.join)
+DETECTION_OVERLAP_S = 1
+# parameters, which change only the time range of a node (a new range can come with another spike table),
+# sorted nodes, which only they changed for, label spikes of the new range with the templates of their last sort
+TIME_RANGE_PARAMETERS = ("from_s", "to_s", "spike_table")
+
+
+class Pipeline:
+    """
+    Pipeline is the analysis graph shared by all controllers:
+    raw read -> filtered signal -> spikes -> cutouts -> labels -> bins / bursts / stimulus actions.
+    Its nodes are module objects (Waveform and its child classes), which already memoize every stage
+    by the parameters it depends on. The pipeline keeps the nodes between requests of the same owner (window)
+    and passes only the changed parameters to their setters, so changing bin width recomputes only bins
+    and changing component number only the spike sorting. Changing only the time range of a sorted node
+    doesn't sort again, spikes of the new range are labeled with the unit templates of the last sort. Stages, which don't belong to one window,
+    are shared: read and filtered signals through the signal cache and spike tables of many channels here.
+    Nodes, which the owner's last request didn't use (e.g. unmarked channels), are dropped after it.
+
+    Attributes:
+        max_spike_tables (int): how many spike tables are kept, the least recently used are dropped
+    """
+    def __init__(self, max_spike_tables: int = MAX_SPIKE_TABLES):
+        self._nodes = {}
+        self._parameters = {}
+        self._requested = {}
+        self._spike_tables = OrderedDict()
+        self._lock = threading.RLock()
+        self.max_spike_tables = max_spike_tables
+
+    def node(self, owner: Hashable, module_class: type, electrode_stream, channels: list, **parameters) -> Waveform:
+        """
+        returns the owner's module object of the class and channels with the given parameters.
+        An existing object gets only the changed parameters (and every parameter after them, so they are checked
+        against each other like in the constructor), its memoized stages, which don't depend on them, stay
+
+        Args:
+            owner (hashable): the window (controller), which the object belongs to
+            module_class (type): Waveform or one of its child classes
+            electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
+            channels (list -> str): user's chosen channels
+            parameters: constructor parameters of the class, e.g. from_s="1", bin_width="0.1"
+
+        Returns:
+            module object (Modules.Waveform.Waveform): object of the class with the given parameters
+        """
+        key = (owner, module_class, tuple(channels))
+        with self._lock:
+            if self._requested.get(owner) is not None:
+                self._requested[owner].add(key)
+            node, old_parameters = self._nodes.get(key), self._parameters.get(key)
+
+        try:
+            if node is None or node._electrode_stream is not electrode_stream:
+                node = module_class(electrode_stream=electrode_stream, channels=channels, **parameters)
+            else:
+                templates = self._get_range_templates(node, old_parameters, parameters)
+                self._update(node, old_parameters, parameters)
+                if isinstance(node, SpikeTogether) and node.reference_templates is not templates:
+                    node.reference_templates = templates
+        except Exception:
+            self._drop(key)
+            raise
+
+        with self._lock:
+            self._nodes[key], self._parameters[key] = node, parameters
+        return node
+
+    def spike_table(self, waveform: Waveform, dead_time: str, threshold_from: str = "", threshold_to: str = "",
+                    progress: Optional[Callable[[int, int], None]] = None) -> SpikeTable:
+        """
+        returns spikes of every channel of the waveform object, they are detected once per signal and
+        detection parameters and then shared by every window, see Modules.SpikeTable.detect_spike_table.
+        With both thresholds given, spikes don't depend on the time range, so one table is kept per channels,
+        filters and detection parameters: ranges inside its range are served by it (Spikes objects take their
+        spikes with searchsorted) and overlapping ranges detect only the missing edges (with DETECTION_OVERLAP_S).
+        Empty thresholds are calculated from the signal of the range, then the table belongs to the range.
+        Tables are also saved in the result store, so the next session loads them instead of detecting
+
+        Args:
+            waveform (Modules.Waveform.Waveform): recording, channels, time range and filters to detect in
+            dead_time (str): after we find spike, during DEAD_TIME, we shouldn't search for next one
+            threshold_from (str): the pre-defined max/min value of signal to detect spike, empty calculates it
+            threshold_to (str): the pre-defined max/min value of signal to detect spike, empty calculates it
+            progress (function): called with (detected channels, all channels) while detecting
+
+        Returns:
+            spike table (Modules.SpikeTable.SpikeTable): spikes of every channel
+        """
+        detection_parameters = (dead_time, threshold_from, threshold_to)
+        if threshold_from == "" or threshold_to == "":
+            key = waveform._signal_cache_key + detection_parameters
+        else:
+            key = waveform._signal_span_key + detection_parameters
+        from_idx, to_idx = waveform._from_idx, waveform._to_idx
+        with self._lock:
+            entry = self._spike_tables.get(key)
+            if entry is not None:
+                self._spike_tables.move_to_end(key)
+        result_key = _get_spike_table_result_key(waveform, detection_parameters)
+        stored = entry is None
+        if stored:
+            entry = _load_spike_table(waveform, result_key)
+
+        overlap = int(DETECTION_OVERLAP_S * waveform.fs)
+        if entry is not None and entry[1] <= to_idx + 1 and from_idx <= entry[2] + 1:
+            spike_table, table_from, table_to = entry
+            if table_from <= from_idx and to_idx <= table_to:
+                if stored:
+                    self._keep_spike_table(key, entry)
+                return spike_table
+            from_idx, to_idx = min(from_idx, table_from), max(to_idx, table_to)
+        else:
+            entry = None
+
+        # the edges of a short table would be detected again in the overlaps, so then all of it is detected
+        if entry is not None and table_to - table_from >= 2 * overlap:
+            dead_time_idx = int(float(dead_time) * waveform.fs)
+            if from_idx < table_from:
+                spike_table = detect_spike_table(waveform, *detection_parameters, progress, from_idx,
+                                                 table_from - 1 + overlap).join(
+                    spike_table, table_from, table_from + overlap // 2, dead_time_idx)
+            if to_idx > table_to:
+                spike_table = spike_table.join(detect_spike_table(waveform, *detection_parameters, progress,
+                                                                  table_to + 1 - overlap, to_idx),
+                                               table_to + 1 - overlap, table_to + 1 - overlap // 2, dead_time_idx)
+        else:
+            spike_table = detect_spike_table(waveform, *detection_parameters, progress, from_idx, to_idx)
+
+        self._keep_spike_table(key, (spike_table, from_idx, to_idx))
+        _save_spike_table(waveform, result_key, spike_table, from_idx, to_idx)
+        return spike_table
+
+    def _keep_spike_table(self, key: tuple, entry: tuple) -> None:
+        with self._lock:
+            self._spike_tables[key] = entry
+            while len(self._spike_tables) > self.max_spike_tables:
+                self._spike_tables.popitem(last=False)
+
+    @contextmanager
+    def request(self, owner: Hashable):
+        """
+        marks one request (e.g. one plot) of the owner, nodes of the owner, which weren't used in it, are dropped
+        at the end, so the pipeline keeps only the objects of the last analysis of every window
+
+        Args:
+            owner (hashable): the window (controller), which requests the nodes
+        """
+        with self._lock:
+            self._requested[owner] = set()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                requested = self._requested.pop(owner) or set()
+                for key in [key for key in self._nodes if key[0] == owner and key not in requested]:
+                    self._drop(key)
+
+    def release(self, owner: Hashable) -> None:
+        """
+        drops every node of the owner, e.g. when its window is closed,
+        nodes of the owner's running request are dropped when it ends
+
+        Args:
+            owner (hashable): the window (controller), which the nodes belong to
+        """
+        with self._lock:
+            if owner in self._requested:
+                self._requested[owner] = None
+            for key in [key for key in self._nodes if key[0] == owner]:
+                self._drop(key)
+
+    def clear(self) -> None:
+        """
+        drops every node and spike table
+        """
+        with self._lock:
+            self._nodes.clear()
+            self._parameters.clear()
+            self._spike_tables.clear()
+
+    def _drop(self, key: tuple) -> None:
+        with self._lock:
+            self._nodes.pop(key, None)
+            self._parameters.pop(key, None)
+
+    @staticmethod
+    def _get_range_templates(node: Waveform, old_parameters: dict, parameters: dict) -> Optional[TemplateClassifier]:
+        """
+        returns the templates, which label spikes of the sorted node after the update: if only its time range
+        changes, the templates of its last sort (the same ones again, if it was already labeled with templates).
+        None if it isn't a sorted node or any other parameter changes, then its spikes are sorted again
+        """
+        if not isinstance(node, SpikeTogether):
+            return None
+        changed = {name for name, default in _get_constructor_parameters(type(node))
+                   if not _is_same_parameter(old_parameters.get(name, default), parameters.get(name, default))}
+        if not changed:
+            return node.reference_templates
+        if not changed <= set(TIME_RANGE_PARAMETERS):
+            return None
+        if node.reference_templates is not None:
+            return node.reference_templates
+        return node.templates if node._memo.get("sorting_model") is not None else None
+
+    @staticmethod
+    def _update(node: Waveform, old_parameters: dict, parameters: dict) -> None:
+        """
+        sets the changed parameters in the order the constructor sets them, after the first changed one every
+        parameter is set again, because setters check parameters against earlier ones (e.g. "To" against "From")
+        and empty thresholds are calculated from the signal
+        """
+        changed = False
+        for name, default in _get_constructor_parameters(type(node)):
+            value = parameters.get(name, default)
+            changed = changed or not _is_same_parameter(old_parameters.get(name, default), value)
+            if changed:
+                setattr(node, name, value)
+
+
+def _get_constructor_parameters(module_class: type) -> list:
+    """
+    returns constructor parameters of the class and its parents as (name, default) in the order
+    the constructors set them: the parent's parameters first.
+    electrode stream and channels are left out, they identify the node
+    """
+    parameters = []
+    for cls in reversed(module_class.__mro__):
+        if not issubclass(cls, Waveform) or "__init__" not in vars(cls):
+            continue
+        for parameter in inspect.signature(vars(cls)["__init__"]).parameters.values():
+            if parameter.name not in ("self", "electrode_stream", "channels") and parameter.kind not in (
+                    parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+                parameters.append((parameter.name, parameter.default))
+    return parameters
+
+
+def _is_same_parameter(old, new) -> bool:
+    # user's inputs (and lists of them) are compared by value, objects (spike tables, stimulus indexes, models)
+    # by identity
+    if isinstance(old, (str, int, float, list, tuple)) and type(old) is type(new):
+        return old == new
+    return old is new
+
+
+def _get_spike_table_result_key(waveform: Waveform, detection_parameters: tuple) -> Optional[str]:
+    """
+    returns the result store key of the spike table, like the pipeline's key it leaves the time range out
+    if both thresholds are given. None if tables aren't saved or a parameter isn't a number,
+    the detection reports such parameters
+    """
+    try:
+        parameters = tuple(value if value == "" else float(value) for value in detection_parameters)
+    except ValueError:
+        return None
+    return waveform._get_result_key("spike_table", *parameters, in_range="" in parameters)
+
+
+def _load_spike_table(waveform: Waveform, result_key: Optional[str]) -> Optional[tuple]:
+    """
+    returns (spike table, the first and the last detected sample index) saved in the result store,
+    None if there is no saved table
+    """
+    if result_key is None:
+        return None
+    arrays = waveform.result_store.load(result_key, ("channels", "indexes", "amplitudes", "range"))
+    if arrays is None:
+        return None
+    table_from, table_to = arrays["range"].tolist()
+    return (SpikeTable(arrays["channels"], arrays["indexes"], amplitudes=arrays["amplitudes"], fs=waveform.fs),
+            table_from, table_to)
+
+
+def _save_spike_table(waveform: Waveform, result_key: Optional[str], spike_table: SpikeTable, table_from: int,
+                      table_to: int) -> None:
+    # labels are left out, they belong to the sorting, which labels the table again
+    if result_key is None:
+        return
+    waveform.result_store.try_save(result_key, {"channels": spike_table.channels, "indexes": spike_table.indexes,
+                                                "amplitudes": spike_table.amplitudes,
+                                                "range": np.array([table_from, table_to])})
+
+
+pipeline = Pipeline()
@@ -0,0 +1,283 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+import numpy
+import numpy as np
+
+DEFAULT_STORE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".neurospace", "results")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# saved results of older versions are ignored, it should be increased when an algorithm changes its results
+RESULT_VERSION = 1
+# bytes of the recording, which are hashed at its start, middle and end for the fingerprint
+_FINGERPRINT_SAMPLE_BYTES = 1024 ** 2
+_RESULT_EXTENSION = ".npz"
+_INDEX_FILE_NAME = "index.sqlite"
+_fingerprints = {}
+
+
+def get_file_fingerprint(path: str) -> str:
+    """
+    get_file_fingerprint identifies the content of the recording file, so results are found again after the file
+    is moved or renamed, and aren't used for a changed file. The size and three samples of the file are hashed
+    instead of the whole file, which would take as long as reading the recording. Fingerprints are kept
+    per path, size and modification time, so every file is hashed once per session
+
+    Args:
+        path (str): path of the recording file
+
+    Returns:
+        fingerprint (str): blake2b hex digest of the size and the sampled bytes
+    """
+    stat = os.stat(path)
+    stat_key = os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+    if stat_key not in _fingerprints:
+        digest = hashlib.blake2b(str(stat.st_size).encode("utf-8"), digest_size=16)
+        with open(path, "rb") as f:
+            for offset in (0, (stat.st_size - _FINGERPRINT_SAMPLE_BYTES) // 2,
+                           stat.st_size - _FINGERPRINT_SAMPLE_BYTES):
+                f.seek(max(offset, 0))
+                digest.update(f.read(_FINGERPRINT_SAMPLE_BYTES))
+        _fingerprints[stat_key] = digest.hexdigest()
+    return _fingerprints[stat_key]
+
+
+def get_recording_key(electrode_stream) -> Optional[tuple]:
+    """
+    get_recording_key is the persistent version of Modules.SignalCache.get_stream_key, it identifies
+    the stream by the content of its file instead of the file name
+
+    Args:
+        electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
+
+    Returns:
+        recording key (tuple / None): fingerprint of the file and dataset name of the stream's channel data,
+                                      None if the stream isn't read from a file
+    """
+    channel_data = electrode_stream.channel_data
+    try:
+        return get_file_fingerprint(channel_data.file.filename), channel_data.name
+    except (AttributeError, OSError):
+        return None
+
+
+def get_result_key(*parts) -> str:
+    """
+    get_result_key turns everything, which the result depends on (recording, channels, parameters),
+    into a short name for the result file. Parameters are made canonical first, so e.g. 1 and 1.0 or
+    a list and a tuple of the same values give the same key
+
+    Args:
+        parts: description of the result, e.g. its name, recording key, channels and parameters
+
+    Returns:
+        key (str): sha1 hex digest of the canonical parts
+    """
+    return hashlib.sha1(repr((RESULT_VERSION, _get_canonical(parts))).encode("utf-8")).hexdigest()
+
+
+def get_array_digest(*arrays: numpy.ndarray) -> str:
+    """
+    Returns:
+        digest (str): short hash of the arrays' values, which can be a part of the result key
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.dtype.str, array.shape)).encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _get_canonical(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_get_canonical(item) for item in value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class ResultStore:
+    """
+    ResultStore keeps results of analyses (detected spikes, cutouts, stimulus, bursts) in a local directory,
+    so the next session, which opens the same recording with the same parameters, loads them instead of
+    filtering, detecting and sorting again. Every result is a .npz file of named arrays, a small SQLite index
+    keeps their sizes and last use, the least recently used results are removed when the store exceeds max_bytes.
+    Files are written atomically, unreadable files are treated as missing.
+
+    Attributes:
+        directory (str): the directory where result files and the index are stored
+        max_bytes (int): size budget of the result files
+
+    Args:
+        directory (str): the directory where result files and the index are stored, it is created on the first save
+        max_bytes (int): size budget of the result files
+    """
+    def __init__(self, directory: str = DEFAULT_STORE_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(self._get_path(key))
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        Returns:
+            size (int): total size of the saved results in bytes
+        """
+        if not os.path.isfile(self._index_path):
+            return 0
+        with self._index() as connection:
+            return connection.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+
+    def load(self, key: str, names: Iterable[str] = ()) -> Optional[Dict[str, numpy.ndarray]]:
+        """
+        loads the result saved under the key and marks it as recently used.
+        an unreadable result (e.g. a truncated file) or a result without one of the names is removed
+
+        Args:
+            key (str): result key, see get_result_key
+            names (list -> str): names of the arrays, which the result should have
+
+        Returns:
+            arrays (dict / None): name and array of every saved array, None if there is no readable result
+        """
+        try:
+            with np.load(self._get_path(key), allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            if not set(names) <= arrays.keys():
+                raise KeyError(f"Result {key} has no {set(names) - arrays.keys()}")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+            try:
+                self.remove(key)
+            except (OSError, sqlite3.Error):
+                pass
+            return None
+        try:
+            with self._index() as connection:
+                connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            pass
+        return arrays
+
+    def save(self, key: str, arrays: Dict[str, numpy.ndarray]) -> None:
+        """
+        saves the result under the key, replacing the previous one, then removes the least recently used results
+        while the store exceeds max_bytes
+
+        Args:
+            key (str): result key, see get_result_key
+            arrays (dict): name and array of every array of the result
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            size_bytes = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._get_path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        try:
+            with self._index() as connection:
+                connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, size_bytes, time.time()))
+                self._evict(connection)
+        except sqlite3.Error as error:
+            raise OSError(f"Result index can't be written: {error}") from error
+
+    def try_save(self, key: str, arrays: Dict[str, numpy.ndarray]) -> bool:
+        """
+        saves the result like save, but an unwritable store is ignored: analyses don't depend on the store,
+        so a result which can't be saved only costs a recalculation in the next session
+
+        Args:
+            key (str): result key, see get_result_key
+            arrays (dict): name and array of every array of the result
+
+        Returns:
+            saved (bool): whether the result was saved
+        """
+        try:
+            self.save(key, arrays)
+        except OSError:
+            return False
+        return True
+
+    def remove(self, key: str) -> None:
+        """
+        removes the result saved under the key, if there is one
+
+        Args:
+            key (str): result key
+        """
+        if os.path.isfile(self._index_path):
+            with self._index() as connection:
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        """
+        removes every saved result and the index
+        """
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith(_RESULT_EXTENSION) or file_name.startswith(_INDEX_FILE_NAME):
+                    os.remove(os.path.join(self.directory, file_name))
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        size_bytes = connection.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+        for key, result_bytes in connection.execute("SELECT key, size_bytes FROM results ORDER BY used").fetchall():
+            if size_bytes <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            try:
+                os.remove(self._get_path(key))
+            except FileNotFoundError:
+                pass
+            size_bytes -= result_bytes
+
+    @contextmanager
+    def _index(self):
+        """
+        opens the index for one transaction, every operation opens its own connection,
+        because analyses run in several threads
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(self._index_path, timeout=10)
+            try:
+                with connection:
+                    connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                       "(key TEXT PRIMARY KEY, size_bytes INTEGER NOT NULL, used REAL NOT NULL)")
+                    yield connection
+            finally:
+                connection.close()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, _INDEX_FILE_NAME)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _RESULT_EXTENSION)
+
+
+result_store = ResultStore()
@@ -0,0 +1,195 @@
+import threading
+import numpy
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+def get_stream_key(electrode_stream) -> tuple:
+    """
+    get_stream_key identifies the recording which electrode_stream belongs to,
+    so different controllers (and different objects for the same file) share the same cache entries
+
+    Args:
+        electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
+
+    Returns:
+        stream key (tuple): file name and dataset name of the stream's channel data
+    """
+    channel_data = electrode_stream.channel_data
+    try:
+        return channel_data.file.filename, channel_data.name
+    except AttributeError:
+        return id(electrode_stream),
+
+
+class SignalCache:
+    """
+    SignalCache is a process-wide LRU cache for the read and filtered signals.
+    Every controller builds its own module objects, so without this cache opening
+    Spike, Bin and Stimulus Action windows on the same channels reads and filters the same data several times.
+    Entries are evicted in least recently used order when the total size exceeds the byte budget.
+    Stored arrays are read-only, because the same array is shared by every module object.
+    Signals can be cached as spans (see get_range), then every time range inside the span is served by slicing.
+
+    Attributes:
+        max_bytes (int): the byte budget of the cache
+        size_bytes (int): the current size of the cached arrays in bytes
+        hits (int): the number of lookups which were served from the cache
+        misses (int): the number of lookups which needed computation
+
+    Args:
+        max_bytes (int): the byte budget of the cache
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._entries = OrderedDict()
+        self._span_starts = {}
+        self._lock = threading.RLock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.max_bytes = max_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int) -> None:
+        if max_bytes < 0:
+            raise ValueError("Cache size should be positive")
+        with self._lock:
+            self._max_bytes = int(max_bytes)
+            self._evict()
+
+    def get(self, key: Hashable) -> Optional[numpy.ndarray]:
+        """
+        returns the cached array and marks it as the most recently used one
+
+        Args:
+            key (tuple): cache key
+
+        Returns:
+            value (numpy.ndarray / None): cached array, None if there is no such entry
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: numpy.ndarray) -> numpy.ndarray:
+        """
+        stores the array in cache, arrays which are bigger than the whole budget are not stored
+
+        Args:
+            key (tuple): cache key
+            value (numpy.ndarray): array to store
+
+        Returns:
+            value (numpy.ndarray): the same array, marked as read-only
+        """
+        value.setflags(write=False)
+        with self._lock:
+            self._span_starts.pop(key, None)
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key).nbytes
+            if value.nbytes <= self.max_bytes:
+                self._entries[key] = value
+                self.size_bytes += value.nbytes
+                self._evict()
+        return value
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], numpy.ndarray]) -> numpy.ndarray:
+        """
+        returns the cached array or computes and caches it
+
+        Args:
+            key (tuple): cache key
+            compute (function): function without arguments which calculates the array
+
+        Returns:
+            value (numpy.ndarray): cached or calculated array
+        """
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def get_range(self, key: Hashable, from_idx: int, to_idx: int,
+                  compute: Callable[[int, int], numpy.ndarray]) -> numpy.ndarray:
+        """
+        returns samples [from_idx, to_idx] of the signal, which is cached under the key as one span.
+        a range inside the span is sliced from it, a range which overlaps (or touches) the span computes
+        only its missing edges and extends the span, a range apart from the span replaces it
+
+        Args:
+            key (tuple): cache key of the signal without its time range, e.g. stream, channels and filters
+            from_idx (int): the first sample index
+            to_idx (int): the last sample index (included)
+            compute (function): calculates samples [from, to] (to included) of the signal, called with (from, to)
+
+        Returns:
+            value (numpy.ndarray): read-only samples of the range
+        """
+        with self._lock:
+            span, span_from = self.get(key), self._span_starts.get(key)
+        if span is not None and span_from is not None and span_from <= to_idx + 1 and from_idx <= span_from + len(span):
+            span_to = span_from + len(span) - 1
+            if span_from <= from_idx and to_idx <= span_to:
+                return span[from_idx - span_from:to_idx - span_from + 1]
+            parts = [span]
+            if from_idx < span_from:
+                parts.insert(0, compute(from_idx, span_from - 1))
+            if to_idx > span_to:
+                parts.append(compute(span_to + 1, to_idx))
+            span, span_from = np.concatenate(parts), min(from_idx, span_from)
+        else:
+            span, span_from = compute(from_idx, to_idx), from_idx
+
+        with self._lock:
+            self.put(key, span)
+            if key in self._entries:
+                self._span_starts[key] = span_from
+        return span[from_idx - span_from:to_idx - span_from + 1]
+
+    def covers(self, key: Hashable, from_idx: int, to_idx: int) -> bool:
+        """
+        Returns:
+            covers (bool): whether samples [from_idx, to_idx] are in the span cached under the key
+        """
+        with self._lock:
+            span, span_from = self._entries.get(key), self._span_starts.get(key)
+            return span is not None and span_from is not None and span_from <= from_idx and \
+                to_idx < span_from + len(span)
+
+    def clear(self) -> None:
+        """
+        removes every entry and resets the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self._span_starts.clear()
+            self.size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self) -> None:
+        while self.size_bytes > self.max_bytes and self._entries:
+            key, value = self._entries.popitem(last=False)
+            self._span_starts.pop(key, None)
+            self.size_bytes -= value.nbytes
+
+
+signal_cache = SignalCache()
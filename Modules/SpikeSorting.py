@@ -0,0 +1,307 @@
+import copy
+import os
+from typing import List
+
+import numpy
+from sklearn.decomposition import PCA
+from sklearn.mixture import GaussianMixture
+from sklearn.preprocessing import StandardScaler
+
+from Modules.Parallel import get_process_executor
+
+DEFAULT_RANDOM_STATE = 0
+DEFAULT_SUBSAMPLE_SIZE = 20_000
+PREDICT_BATCH_SIZE = 50_000
+AUTO_COMPONENTS = "auto"
+MAX_AUTO_COMPONENTS = 6
+# initializations per components number while the automatic mode sweeps over it
+SWEEP_N_INIT = 2
+UNSORTED_LABEL = -1
+# below this quantity of fitted feature rows (all channels and initializations together)
+# the process pool costs more than it saves, so mixtures are fitted in this process
+PARALLEL_MIN_ROWS = 50_000
+
+
+def get_init_seeds(random_state: int, n_init: int) -> List[int]:
+    """
+    derives the seeds of gaussian mixture initializations from the random state,
+    the same random state always gives the same seeds
+
+    Args:
+        random_state (int): seed of the spike sorting
+        n_init (int): the number of gaussian mixture initializations
+
+    Returns:
+        seeds (list -> int): seed of every initialization
+    """
+    return [int(seed) for seed in numpy.random.SeedSequence(random_state).generate_state(n_init)]
+
+
+def fit_sorting_models(models: list, cutouts_list: list) -> list:
+    """
+    fits several spike sorting models (e.g. one per channel) at once.
+    features of every channel are calculated here, then each gaussian mixture initialization of each channel
+    is fitted as a separate task on the process pool. For each channel the initialization with the best
+    lower bound is kept, the same way GaussianMixture does it with n_init.
+    models with automatic component number reuse their single feature matrix for a sweep over k = 1..max_components
+    with only SWEEP_N_INIT initializations per k, keep the k with the lowest information criterion,
+    and only that k gets the rest of its initializations.
+    seeds come from the random state of each model, so labels don't depend on the scheduling
+
+    Args:
+        models (list -> SpikeSortingModel): models to fit
+        cutouts_list (list -> numpy.ndarray -> numpy.float64): cutouts of every model
+
+    Returns:
+        models (list -> SpikeSortingModel): the same models, fitted
+    """
+    features_list = [model._fit_features(cutouts) for model, cutouts in zip(models, cutouts_list)]
+    seeds_list = [get_init_seeds(model.random_state, model.n_init) for model in models]
+
+    # fixed models get all initializations at once, automatic ones a short sweep over k
+    tasks = [(i, k, seed) for i, model in enumerate(models) for k in model._get_candidate_components(len(features_list[i]))
+             for seed in (seeds_list[i][:SWEEP_N_INIT] if model.auto else seeds_list[i])]
+    best_mixtures = _fit_mixtures(tasks, features_list)
+    for i, model in enumerate(models):
+        if model.auto:
+            model._select_components(best_mixtures[i], features_list[i])
+
+    tasks = [(i, model.n_components, seed) for i, model in enumerate(models) if model.auto
+             for seed in seeds_list[i][SWEEP_N_INIT:]]
+    for i, mixtures_by_k in enumerate(_fit_mixtures(tasks, features_list, best_mixtures)):
+        models[i]._set_mixture(mixtures_by_k[models[i].n_components], features_list[i], cutouts_list[i])
+    return models
+
+
+def _fit_mixtures(tasks: list, features_list: list, best_mixtures: list = None) -> list:
+    """
+    fits (model index, components number, seed) tasks and keeps the mixture with the best lower bound
+    for every model and components number, on the process pool if there is enough work for it
+    """
+    if best_mixtures is None:
+        best_mixtures = [{} for _ in features_list]
+    task_args = ([features_list[i] for i, _, _ in tasks], [k for _, k, _ in tasks], [seed for _, _, seed in tasks])
+    if sum(len(features) for features in task_args[0]) < PARALLEL_MIN_ROWS or os.cpu_count() == 1:
+        mixtures = map(_fit_mixture, *task_args)
+    else:
+        mixtures = get_process_executor().map(_fit_mixture, *task_args)
+
+    for (i, k, _), mixture in zip(tasks, mixtures):
+        if k not in best_mixtures[i] or mixture.lower_bound_ > best_mixtures[i][k].lower_bound_:
+            best_mixtures[i][k] = mixture
+    return best_mixtures
+
+
+def _fit_mixture(features: numpy.ndarray, n_components: int, seed: int) -> GaussianMixture:
+    return GaussianMixture(n_components=n_components, random_state=seed).fit(features)
+
+
+class SpikeSortingModel:
+    """
+    SpikeSortingModel keeps the fitted scaler, pca and gaussian mixture of the spike cutouts.
+    once it is fitted, new spikes are labeled with predict, without fitting everything again.
+    the random state is fixed, so the same cutouts always give the same labels.
+    with subsample_size the model is fitted on that many randomly chosen cutouts only,
+    and all cutouts are labeled afterwards with batched predict, which keeps big channels fast
+
+
+    Attributes:
+        n_components (int): the number of neuron groups, which gaussian mixture was fitted with
+                            ("auto" until an automatic model is fitted)
+        auto (bool): whether the number of neuron groups is selected automatically
+        max_components (int): the biggest number of neuron groups tried in automatic mode
+        criterion (str): "bic" or "aic", information criterion of automatic selection
+        scores (dict -> float): criterion value of every tried number of neuron groups, empty if not automatic
+        scaler (sklearn.preprocessing.StandardScaler): fitted scaler of the cutouts
+        pca (sklearn.decomposition.PCA): fitted pca of the scaled cutouts
+        gmm (sklearn.mixture.GaussianMixture): fitted gaussian mixture of pca features
+        labels (numpy.ndarray -> numpy.int64): labels of the cutouts, which model was fitted on
+        subsample_size (int): the maximum number of cutouts to fit on, None fits on all of them
+
+    Args:
+        n_components (int): this is the number of groups, if we think here are 3 neuron's spikes,
+                            n_components should be 3. "auto" selects it by the information criterion
+        random_state (int): seed of pca and gaussian mixture initializations
+        n_init (int): the number of gaussian mixture initializations, the best one is kept
+        subsample_size (int): the maximum number of cutouts to fit on, None fits on all of them
+        max_components (int): the biggest number of neuron groups tried in automatic mode
+        criterion (str): "bic" or "aic", information criterion of automatic selection
+    """
+    def __init__(self, n_components, random_state: int = DEFAULT_RANDOM_STATE, n_init: int = 10,
+                 subsample_size: int = None, max_components: int = MAX_AUTO_COMPONENTS, criterion: str = "bic"):
+        if criterion not in ("bic", "aic"):
+            raise ValueError(f'Unknown information criterion "{criterion}"')
+        self.auto = n_components == AUTO_COMPONENTS
+        self.n_components = AUTO_COMPONENTS if self.auto else int(n_components)
+        self.max_components = max_components
+        self.criterion = criterion
+        self.scores = {}
+        self.random_state = random_state
+        self.n_init = n_init
+        self.subsample_size = subsample_size
+        self.scaler = None
+        self.pca = None
+        self.gmm = None
+        self.labels = None
+
+    def fit(self, cutouts: numpy.ndarray) -> "SpikeSortingModel":
+        """
+        fits the scaler, pca and gaussian mixture on the cutouts (or on their random subsample),
+        gaussian mixture initializations are spread across the process pool by fit_sorting_models
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+
+        Returns:
+            self (SpikeSortingModel): fitted model
+        """
+        fit_sorting_models([self], [cutouts])
+        return self
+
+    def _fit_features(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        if not self.auto and self.n_components >= len(cutouts):
+            self.n_components = 1
+        fit_cutouts = self._get_fit_cutouts(cutouts)
+        self.scaler = StandardScaler()
+        self.pca = PCA(n_components=2, random_state=self.random_state)
+        return self.pca.fit_transform(self.scaler.fit_transform(abs(fit_cutouts)) * 2)
+
+    def _get_candidate_components(self, samples_number: int) -> range:
+        if not self.auto:
+            return range(self.n_components, self.n_components + 1)
+        return range(1, max(min(self.max_components, samples_number - 1), 1) + 1)
+
+    def _select_components(self, mixtures_by_k: dict, features: numpy.ndarray) -> None:
+        self.scores = {k: getattr(mixture, self.criterion)(features) for k, mixture in mixtures_by_k.items()}
+        self.n_components = min(self.scores, key=self.scores.get)
+
+    def _set_mixture(self, gmm: GaussianMixture, features: numpy.ndarray, cutouts: numpy.ndarray) -> None:
+        self.gmm = gmm
+        if len(features) == len(cutouts):
+            self.labels = self.gmm.predict(features)
+        else:
+            self.labels = self.predict(cutouts)
+
+    def _get_fit_cutouts(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        if self.subsample_size is None or len(cutouts) <= self.subsample_size:
+            return cutouts
+        rng = numpy.random.default_rng(self.random_state)
+        return cutouts[numpy.sort(rng.choice(len(cutouts), self.subsample_size, replace=False))]
+
+    def transform(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        """
+        transforms the cutouts into the features, which gaussian mixture works with
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+
+        Returns:
+            features (numpy.ndarray -> numpy.float64): pca features of the cutouts
+        """
+        return self.pca.transform(self.scaler.transform(abs(cutouts)) * 2)
+
+    def predict(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        """
+        labels the cutouts with the already fitted model, in batches of PREDICT_BATCH_SIZE cutouts
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+
+        Returns:
+            labels (numpy.ndarray -> numpy.int64): the len of this should be the len of cutouts
+        """
+        if self.gmm is None:
+            raise ValueError("Spike sorting model should be fitted before predict")
+        if len(cutouts) <= PREDICT_BATCH_SIZE:
+            return self.gmm.predict(self.transform(cutouts))
+        return numpy.concatenate([self.gmm.predict(self.transform(cutouts[i:i + PREDICT_BATCH_SIZE]))
+                                  for i in range(0, len(cutouts), PREDICT_BATCH_SIZE)])
+
+    def relabel(self, cutouts: numpy.ndarray) -> "SpikeSortingModel":
+        """
+        labels new cutouts (e.g. from a later recording) without fitting anything again
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+
+        Returns:
+            model (SpikeSortingModel): copy of this model, which labels are the labels of the new cutouts
+        """
+        model = copy.copy(self)
+        model.labels = self.predict(cutouts)
+        return model
+
+
+class TemplateClassifier:
+    """
+    TemplateClassifier describes every sorted unit with its template (mean cutout) and labels new spikes
+    with the nearest template, which is much faster than the pca and gaussian mixture pipeline.
+    Squared distances to all templates come from one matrix multiply: |x|^2 - 2 x.T + |T|^2.
+    Spikes, which don't look like any template, can be flagged as unsorted with the residual threshold
+
+    Attributes:
+        units (numpy.ndarray -> numpy.int64): label of every template
+        templates (numpy.ndarray -> numpy.float64): units x window mean cutouts
+        residual_threshold (float): maximum root mean square difference between a cutout and its template,
+                                    cutouts over it get UNSORTED_LABEL. None labels every cutout
+
+    Args:
+        residual_threshold (float): maximum root mean square difference between a cutout and its template
+    """
+    def __init__(self, residual_threshold: float = None):
+        self.residual_threshold = residual_threshold
+        self.units = None
+        self.templates = None
+        self._templates_sq_norm = None
+
+    def fit(self, cutouts: numpy.ndarray, labels: numpy.ndarray) -> "TemplateClassifier":
+        """
+        calculates the template of every unit, unsorted cutouts are skipped
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+            labels (numpy.ndarray -> numpy.int64): labels of the cutouts
+
+        Returns:
+            self (TemplateClassifier): fitted classifier
+        """
+        cutouts, labels = numpy.asarray(cutouts, dtype=numpy.float64), numpy.asarray(labels)
+        sorted_mask = labels != UNSORTED_LABEL
+        self.units, unit_idx, counts = numpy.unique(labels[sorted_mask], return_inverse=True, return_counts=True)
+        if not len(self.units):
+            raise ValueError("At least one sorted spike is needed for templates")
+        sums = numpy.zeros((len(self.units), cutouts.shape[1]))
+        numpy.add.at(sums, unit_idx, cutouts[sorted_mask])
+        self.templates = sums / counts[:, None]
+        self._templates_sq_norm = numpy.einsum("ij,ij->i", self.templates, self.templates)
+        return self
+
+    def predict(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        """
+        labels the cutouts with their nearest templates, in batches of PREDICT_BATCH_SIZE cutouts
+
+        Args:
+            cutouts (numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
+
+        Returns:
+            labels (numpy.ndarray -> numpy.int64): the len of this should be the len of cutouts,
+                                                   UNSORTED_LABEL marks cutouts over the residual threshold
+        """
+        if self.templates is None:
+            raise ValueError("Template classifier should be fitted before predict")
+        if not len(cutouts):
+            return numpy.array([], dtype=numpy.int64)
+        cutouts = numpy.asarray(cutouts, dtype=numpy.float64)
+        return numpy.concatenate([self._predict_batch(cutouts[i:i + PREDICT_BATCH_SIZE])
+                                  for i in range(0, len(cutouts), PREDICT_BATCH_SIZE)])
+
+    def _predict_batch(self, cutouts: numpy.ndarray) -> numpy.ndarray:
+        sq_distances = self._templates_sq_norm - 2 * (cutouts @ self.templates.T)
+        nearest = numpy.argmin(sq_distances, axis=1)
+        labels = self.units[nearest].astype(numpy.int64)
+        if self.residual_threshold is not None:
+            min_sq_distances = sq_distances[numpy.arange(len(cutouts)), nearest]
+            min_sq_distances += numpy.einsum("ij,ij->i", cutouts, cutouts)
+            residual = numpy.sqrt(numpy.maximum(min_sq_distances, 0) / cutouts.shape[1])
+            labels[residual > self.residual_threshold] = UNSORTED_LABEL
+        return labels
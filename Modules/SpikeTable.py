@@ -0,0 +1,283 @@
+import os
+from itertools import repeat
+from typing import Callable, Optional
+
+import numpy
+import numpy as np
+import pandas as pd
+
+from Modules.ParamChecker import ParamChecker
+from Modules.Parallel import SharedArray, get_process_executor
+from Modules.utils import calculate_spikes_in_block, filter_base_frequency, get_filter_warm_up, get_signal_block
+from Modules.Waveform import Waveform
+
+# budget of one signal block read, channels are detected in groups which fit into it
+BLOCK_MAX_BYTES = 256 * 1024 ** 2
+# detections are joined after this many common spikes, one common spike can be aligned from different crossings
+JOIN_MIN_COMMON_SPIKES = 3
+# below this quantity of block samples filtering and detection run in this process,
+# bigger blocks are shared with the process pool and their rows are split between the workers
+PARALLEL_MIN_SAMPLES = 4_000_000
+
+
+class SpikeTable:
+    """
+    SpikeTable is a compact struct-of-arrays table of spikes of many channels.
+    Every spike is one row: channel id (int16), sample index in the recording (int64), unit label (int8)
+    and amplitude in volts (float32). Rows are sorted by time, and a channel grouped copy with offsets
+    gives any channel's spikes with slicing, without masking the whole table.
+
+    Attributes:
+        channels (numpy.ndarray -> numpy.int16): channel id of every spike
+        indexes (numpy.ndarray -> numpy.int64): sample index of every spike in the recording
+        labels (numpy.ndarray -> numpy.int8): unit label of every spike
+        amplitudes (numpy.ndarray -> numpy.float32): signal value of every spike in volts
+        channel_ids (numpy.ndarray -> numpy.int16): sorted ids of channels, which have spikes
+        fs (int): hertz, sampling frequency of the recording
+        time_range (numpy.ndarray -> numpy.float64): time of every spike in seconds
+
+    Args:
+        channels (numpy.ndarray -> int): channel id of every spike
+        indexes (numpy.ndarray -> int): sample index of every spike in the recording
+        labels (numpy.ndarray -> int): unit label of every spike, None labels every spike 0
+        amplitudes (numpy.ndarray -> float): signal value of every spike in volts, None fills zeros
+        fs (int): hertz, sampling frequency of the recording
+    """
+    def __init__(self, channels, indexes, labels=None, amplitudes=None, fs: int = 1):
+        channels = np.asarray(channels, dtype=np.int16)
+        indexes = np.asarray(indexes, dtype=np.int64)
+        labels = np.zeros(len(indexes), dtype=np.int8) if labels is None else np.asarray(labels, dtype=np.int8)
+        amplitudes = (np.zeros(len(indexes), dtype=np.float32) if amplitudes is None
+                      else np.asarray(amplitudes, dtype=np.float32))
+        if not len(channels) == len(indexes) == len(labels) == len(amplitudes):
+            raise ValueError("Spike table columns should have the same length")
+
+        order = np.lexsort((channels, indexes))
+        self.channels, self.indexes = channels[order], indexes[order]
+        self.labels, self.amplitudes = labels[order], amplitudes[order]
+        self.fs = fs
+
+        # channel grouped copy, time order is kept inside every channel
+        self._by_channel = np.argsort(self.channels, kind="stable")
+        grouped_channels = self.channels[self._by_channel]
+        self._grouped_indexes = self.indexes[self._by_channel]
+        self._grouped_labels = self.labels[self._by_channel]
+        self._grouped_amplitudes = self.amplitudes[self._by_channel]
+        self.channel_ids = np.unique(grouped_channels)
+        starts = np.searchsorted(grouped_channels, self.channel_ids, side="left")
+        stops = np.searchsorted(grouped_channels, self.channel_ids, side="right")
+        self._offsets = {int(ch): (int(start), int(stop)) for ch, start, stop in zip(self.channel_ids, starts, stops)}
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    @property
+    def time_range(self) -> numpy.ndarray:
+        return self.indexes / self.fs
+
+    def channel(self, channel_id: int) -> "SpikeTable":
+        """
+        returns spikes of one channel, sliced from the channel grouped copy
+
+        Args:
+            channel_id (int): id of the channel
+
+        Returns:
+            spike table (SpikeTable): spikes of the channel, sorted by time
+        """
+        start, stop = self._offsets.get(int(channel_id), (0, 0))
+        return SpikeTable(np.full(stop - start, channel_id, dtype=np.int16), self._grouped_indexes[start:stop],
+                          self._grouped_labels[start:stop], self._grouped_amplitudes[start:stop], self.fs)
+
+    def channel_indexes(self, channel_id: int, from_idx: int = None, to_idx: int = None) -> numpy.ndarray:
+        """
+        returns sample indexes of one channel's spikes in [from_idx, to_idx] without copying the table
+
+        Args:
+            channel_id (int): id of the channel
+            from_idx (int): the first sample index, None means the beginning of the recording
+            to_idx (int): the last sample index (included), None means the end of the recording
+
+        Returns:
+            indexes (numpy.ndarray -> numpy.int64): sorted sample indexes in the recording
+        """
+        start, stop = self._get_channel_rows(channel_id, from_idx, to_idx)
+        return self._grouped_indexes[start:stop]
+
+    def get_labeled(self, channel_labels: dict, from_idx: int = None, to_idx: int = None) -> "SpikeTable":
+        """
+        returns spikes of the given channels in [from_idx, to_idx] with their unit labels (e.g. from spike sorting).
+        the table itself isn't changed, it is shared between windows, which sort its spikes with their own parameters
+
+        Args:
+            channel_labels (dict): channel id and the label of every spike of the channel in the range in time order
+            from_idx (int): the first sample index, None means the beginning of the recording
+            to_idx (int): the last sample index (included), None means the end of the recording
+
+        Returns:
+            spike table (SpikeTable): labeled spikes of the channels
+        """
+        rows, labels = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int8)]
+        for channel_id, unit_labels in channel_labels.items():
+            start, stop = self._get_channel_rows(channel_id, from_idx, to_idx)
+            if len(unit_labels) != stop - start:
+                raise ValueError("Labels should be given for every spike of the channel")
+            rows.append(np.arange(start, stop))
+            labels.append(unit_labels)
+        rows = np.concatenate(rows)
+        return SpikeTable(self.channels[self._by_channel[rows]], self._grouped_indexes[rows], np.concatenate(labels),
+                          self._grouped_amplitudes[rows], self.fs)
+
+    def _get_channel_rows(self, channel_id: int, from_idx: int = None, to_idx: int = None) -> (int, int):
+        """
+        returns [start, stop) rows of the channel grouped copy, which are the channel's spikes in [from_idx, to_idx]
+        """
+        start, stop = self._offsets.get(int(channel_id), (0, 0))
+        indexes = self._grouped_indexes[start:stop]
+        lo = 0 if from_idx is None else int(np.searchsorted(indexes, from_idx, side="left"))
+        hi = len(indexes) if to_idx is None else int(np.searchsorted(indexes, to_idx, side="right"))
+        return start + lo, start + hi
+
+    def join(self, later: "SpikeTable", overlap_from: int, overlap_to: int, dead_time_idx: int = 0) -> "SpikeTable":
+        """
+        joins spikes of a later detection, which overlaps this one. the dead time makes every detection depend
+        on where it started, but once two detections of the same signal take the same crossing they stay the same.
+        so every channel switches to the later detection, where the spikes of both detections in
+        [overlap_from, overlap_to] become the same until its end. a channel, whose detections differ at the end
+        of the overlap, switches after it, and later spikes closer than dead_time_idx to its last spike are dropped
+
+        Args:
+            later (SpikeTable): spikes detected from overlap_from (or earlier) on
+            overlap_from (int): the first sample index of the overlap, which both detections cover completely
+            overlap_to (int): the last sample index of the overlap
+            dead_time_idx (int): after we find spike, during dead_time_idx samples, we shouldn't search for next one
+
+        Returns:
+            spike table (SpikeTable): spikes of both detections
+        """
+        keep, keep_later = np.ones(len(self), dtype=bool), np.ones(len(later), dtype=bool)
+        for channel_id in np.union1d(self.channel_ids, later.channel_ids):
+            rows, later_rows = np.flatnonzero(self.channels == channel_id), np.flatnonzero(later.channels == channel_id)
+            indexes, later_indexes = self.indexes[rows], later.indexes[later_rows]
+            overlap = indexes[(indexes >= overlap_from) & (indexes <= overlap_to)]
+            later_overlap = later_indexes[(later_indexes >= overlap_from) & (later_indexes <= overlap_to)]
+
+            size = min(len(overlap), len(later_overlap))
+            differs = overlap[::-1][:size] != later_overlap[::-1][:size]
+            same_suffix_size = int(np.argmax(differs)) if differs.any() else size
+            if same_suffix_size >= JOIN_MIN_COMMON_SPIKES:
+                switch = overlap[len(overlap) - same_suffix_size]
+            elif not len(overlap) and not len(later_overlap):
+                switch = overlap_from
+            else:
+                switch = overlap_to + 1
+                earlier = indexes[indexes < switch]
+                later_switch = switch if not len(earlier) else max(switch, earlier[-1] + dead_time_idx)
+                keep[rows[indexes >= switch]] = False
+                keep_later[later_rows[later_indexes < later_switch]] = False
+                continue
+            keep[rows[indexes >= switch]] = False
+            keep_later[later_rows[later_indexes < switch]] = False
+        return SpikeTable(np.concatenate((self.channels[keep], later.channels[keep_later])),
+                          np.concatenate((self.indexes[keep], later.indexes[keep_later])),
+                          np.concatenate((self.labels[keep], later.labels[keep_later])),
+                          np.concatenate((self.amplitudes[keep], later.amplitudes[keep_later])), self.fs)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns:
+            dataframe (pandas.DataFrame): one row per spike with channel, index, time, label and amplitude columns
+        """
+        return pd.DataFrame({"channel": self.channels, "index": self.indexes, "time": self.time_range,
+                             "label": self.labels, "amplitude": self.amplitudes})
+
+
+def detect_spike_table(waveform: Waveform, dead_time: str, threshold_from: str = "", threshold_to: str = "",
+                       progress: Optional[Callable[[int, int], None]] = None, from_idx: int = None,
+                       to_idx: int = None) -> SpikeTable:
+    """
+    detect_spike_table detects spikes of every channel of the waveform object at once. Channels are read with one
+    hyperslab read per group of channels, which fits into BLOCK_MAX_BYTES. Big groups are placed in shared memory
+    and their rows are filtered and detected on the process pool, only the detected spikes come back.
+    every channel is detected on its own signal, which is filtered with the same warm up as Waveform's signal,
+    and empty thresholds are calculated per channel, so the result is the same as separate single channel
+    Spikes objects
+
+    Args:
+        waveform (Modules.Waveform.Waveform): recording, channels, time range and filters to detect in
+        dead_time (str): after we find spike, during DEAD_TIME, we shouldn't search for next one
+        threshold_from (str): the pre-defined max/min value of signal to detect spike, empty calculates it
+        threshold_to (str): the pre-defined max/min value of signal to detect spike, empty calculates it
+        progress (function): called with (detected channels, all channels) after every group of channels
+        from_idx (int): the first sample index to detect in, None takes the waveform's range
+        to_idx (int): the last sample index (included) to detect in, None takes the waveform's range
+
+    Returns:
+        spike table (SpikeTable): spikes of every channel
+    """
+    dead_time = ParamChecker(dead_time, "Spike dead time").not_empty.number.positive.value
+    threshold_from = np.nan if threshold_from == "" else ParamChecker(threshold_from, "Spike threshold from").number.value
+    threshold_to = np.nan if threshold_to == "" else ParamChecker(threshold_to, "Spike threshold to").number.value
+
+    channel_ids = list(dict.fromkeys(waveform._channels))
+    from_idx = waveform._from_idx if from_idx is None else from_idx
+    to_idx = waveform._to_idx if to_idx is None else to_idx
+    warm_up = from_idx - max(from_idx - get_filter_warm_up(waveform.fs, waveform.high_pass, waveform.low_pass), 0)
+    samples_number = min(to_idx + 1, waveform._electrode_stream.channel_data.shape[1]) - from_idx + warm_up
+    group_size = max(BLOCK_MAX_BYTES // max(samples_number * 8, 1), 1)
+
+    detection_args = (warm_up, waveform.fs, waveform.high_pass, waveform.low_pass, threshold_from, threshold_to,
+                      int(dead_time * waveform.fs))
+    channels, indexes, amplitudes = [], [], []
+    for group_start in range(0, len(channel_ids), group_size):
+        group = channel_ids[group_start:group_start + group_size]
+        block = get_signal_block(waveform._electrode_stream, group, from_idx - warm_up, to_idx)
+        if block.size < PARALLEL_MIN_SAMPLES or len(group) == 1 or os.cpu_count() == 1:
+            rows, spikes, spike_amplitudes = _filter_and_detect(block, *detection_args)
+        else:
+            with SharedArray(block.shape) as shared:
+                shared.array[:] = block
+                del block
+                bounds = np.linspace(0, len(group), min(os.cpu_count(), len(group)) + 1).astype(int)
+                results = get_process_executor().map(_filter_and_detect_shared, repeat(shared.spec), bounds[:-1],
+                                                     bounds[1:], *map(repeat, detection_args))
+                rows, spikes, spike_amplitudes = (np.concatenate(column) for column in zip(*results))
+        channels.append(np.asarray(group, dtype=np.int16)[rows])
+        indexes.append(spikes + from_idx)
+        amplitudes.append(spike_amplitudes)
+        if progress is not None:
+            progress(group_start + len(group), len(channel_ids))
+    return SpikeTable(np.concatenate(channels), np.concatenate(indexes), amplitudes=np.concatenate(amplitudes),
+                      fs=waveform.fs)
+
+
+def _filter_and_detect(block: numpy.ndarray, warm_up: int, fs: int, high_pass: int, low_pass: int,
+                       threshold_from: float, threshold_to: float, dead_time_idx: int) \
+        -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+    """
+    filters the (channels x samples) block in place and detects spikes after its first warm_up samples
+
+    Returns:
+        rows (numpy.ndarray -> numpy.int64): block row of every spike
+        indexes (numpy.ndarray -> numpy.int64): index of every spike in its row, counted after the warm up
+        amplitudes (numpy.ndarray -> numpy.float64): filtered signal value of every spike in volts
+    """
+    block[:] = filter_base_frequency(block, fs, high_pass, low_pass)
+    signal = block[:, warm_up:]
+    rows, spikes = calculate_spikes_in_block(signal, threshold_from, threshold_to, fs, dead_time_idx)
+    return rows, spikes, signal[rows, spikes]
+
+
+def _filter_and_detect_shared(spec: tuple, row_from: int, row_to: int, *detection_args) \
+        -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+    """
+    worker side of detect_spike_table, filters and detects rows [row_from, row_to) of the shared block
+    and returns only the detected spikes, rows are numbered in the whole block
+    """
+    shm, block = SharedArray.attach(spec)
+    try:
+        rows, spikes, amplitudes = _filter_and_detect(block[row_from:row_to], *detection_args)
+        return rows + row_from, spikes, amplitudes
+    finally:
+        del block
+        shm.close()
@@ -1,8 +1,13 @@
 import numpy
 
+from Modules.ModelStore import SortingModelStore, get_model_key, model_store
 from Modules.ParamChecker import ParamChecker
+from Modules.ResultStore import get_array_digest, get_recording_key
+from Modules.SignalCache import get_stream_key
 from Modules.Spikes import Spikes
-from Modules.utils import get_signal_cutouts, get_pca_labels, get_spikes_with_labels
+from Modules.SpikeSorting import (AUTO_COMPONENTS, DEFAULT_RANDOM_STATE, DEFAULT_SUBSAMPLE_SIZE, UNSORTED_LABEL,
+                                  SpikeSortingModel, TemplateClassifier, fit_sorting_models)
+from Modules.utils import get_signal_cutouts, get_spikes_with_labels
 
 
 class SpikeTogether(Spikes):
@@ -13,25 +18,48 @@ class SpikeTogether(Spikes):
     Attributes:
         pre (float): time before spike for cutouts
         post (float): time after spike for cutouts
-        component_number (int): the possible quantity of neurons who spike
+        component_number (int): the possible quantity of neurons who spike, "auto" selects it with BIC
+        units_number (int): the quantity of neurons, which spikes were sorted into
         cutouts (list -> numpy.ndarray -> numpy.float64): signal parts arnd spikes, len of cutouts is len of spikes_idx
         labels (numpy.ndarray -> numpy.int64): the labels of spikes, the len of this should be the len of spikes
+        unit_labels (numpy.ndarray -> numpy.int64): the label of every spike of indexes, spikes without a cutout
+                                                    get UNSORTED_LABEL
+        sorting_model (Modules.SpikeSorting.SpikeSortingModel): fitted scaler, pca and gaussian mixture of cutouts
+        random_state (int): seed of the spike sorting, the same seed gives the same labels
+        subsample_size (int): the maximum number of cutouts the sorting is fitted on, None fits on all of them
+        model_store (Modules.ModelStore.SortingModelStore): store of fitted models, None doesn't save or load them
+        reference_model (Modules.SpikeSorting.SpikeSortingModel): already fitted model (e.g. of the same culture),
+                                                                  which labels spikes without fitting
+        templates (Modules.SpikeSorting.TemplateClassifier): templates (mean cutouts) of the sorted units
+        reference_templates (Modules.SpikeSorting.TemplateClassifier): already fitted templates, which label spikes
+                                                                       by the nearest template instead of sorting
         spike_labels_indexes (list -> tuple): color and the corresponding spike indices
         spike_labels (list -> tuple): color and the corresponding spike times
 
     Args:
         pre (str): time before spike for cutouts
         post (str): time after spike for cutouts
-        component_number (str): the possible quantity of neurons who spike
+        component_number (str): the possible quantity of neurons who spike, or "auto"
+        random_state (int): seed of the spike sorting, the same seed gives the same labels
+        subsample_size (int): the maximum number of cutouts the sorting is fitted on, None fits on all of them
+        model_store (Modules.ModelStore.SortingModelStore): store of fitted models, None doesn't save or load them
+        reference_model (Modules.SpikeSorting.SpikeSortingModel): already fitted model, which labels spikes
+        reference_templates (Modules.SpikeSorting.TemplateClassifier): already fitted templates, which label spikes
 
     Note that *args and **kwargs are defined in the parent class
     """
-    def __init__(self,  pre, post, component_number, *args, **kwargs):
+    def __init__(self,  pre, post, component_number, *args, random_state: int = DEFAULT_RANDOM_STATE,
+                 subsample_size: int = DEFAULT_SUBSAMPLE_SIZE, model_store: SortingModelStore = model_store,
+                 reference_model: SpikeSortingModel = None, reference_templates: TemplateClassifier = None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.random_state = random_state
+        self.subsample_size = subsample_size
+        self.model_store = model_store
+        self.reference_model = reference_model
+        self.reference_templates = reference_templates
         self.pre = pre
         self.post = post
         self.component_number = component_number
-        self._cutouts = get_signal_cutouts(self.signal * 1000_000, self.fs, self.indexes, self.pre, self.post)
 
     @property
     def pre(self) -> float:
@@ -40,6 +68,7 @@ class SpikeTogether(Spikes):
     @pre.setter
     def pre(self, value: str) -> None:
         self._pre = ParamChecker(value, "Pre").not_empty.number.positive.value
+        self._invalidate("pre")
 
     @property
     def post(self) -> float:
@@ -48,6 +77,7 @@ class SpikeTogether(Spikes):
     @post.setter
     def post(self, value: str) -> None:
         self._post = ParamChecker(value, "Post").not_empty.number.positive.value
+        self._invalidate("post")
 
     @property
     def component_number(self) -> int:
@@ -55,29 +85,201 @@ class SpikeTogether(Spikes):
 
     @component_number.setter
     def component_number(self, value: str) -> None:
-        self._component_number = int(ParamChecker(value, "Component number").not_empty.number.positive.value)
+        if str(value).strip().lower() == AUTO_COMPONENTS:
+            self._component_number = AUTO_COMPONENTS
+        else:
+            self._component_number = int(ParamChecker(value, "Component number").not_empty.number.positive.value)
+        self._invalidate("component_number")
+
+    @property
+    def subsample_size(self) -> int:
+        return self._subsample_size
+
+    @subsample_size.setter
+    def subsample_size(self, value) -> None:
+        if value is None or value == "":
+            self._subsample_size = None
+        else:
+            self._subsample_size = int(ParamChecker(value, "Subsample size").number.positive.value)
+        self._invalidate("subsample_size")
+
+    @property
+    def reference_model(self) -> SpikeSortingModel:
+        return self._reference_model
+
+    @reference_model.setter
+    def reference_model(self, model: SpikeSortingModel) -> None:
+        if model is not None and model.gmm is None:
+            raise ValueError("Reference spike sorting model should be fitted")
+        self._reference_model = model
+        self._invalidate("reference_model")
+
+    @property
+    def reference_templates(self) -> TemplateClassifier:
+        return self._reference_templates
+
+    @reference_templates.setter
+    def reference_templates(self, templates: TemplateClassifier) -> None:
+        if templates is not None and templates.templates is None:
+            raise ValueError("Reference templates should be fitted")
+        self._reference_templates = templates
+        self._invalidate("reference_templates")
 
     @property
     def cutouts(self) -> list:
-        return self._cutouts
+        return self._memoize("cutouts", self._calculate_cutouts, ("indexes", "pre", "post"))
+
+    def _calculate_cutouts(self) -> list:
+        """
+        cuts the signal around the spikes, cutouts are saved per spike indexes, so with the stored spikes and
+        cutouts sorting doesn't read and filter the signal at all
+        """
+        cutouts = self._load_or_compute("cutouts", self._cut_signal, get_array_digest(self.indexes), self.pre,
+                                        self.post)
+        return cutouts if len(cutouts) else []
+
+    def _cut_signal(self) -> numpy.ndarray:
+        return numpy.asarray(get_signal_cutouts(self.signal, self.fs, self.indexes, self.pre, self.post,
+                                                scale=1000_000))
+
+    @property
+    def sorting_model(self) -> SpikeSortingModel:
+        """
+        this function fits the spike sorting model (scaler, pca and gaussian mixture) on the cutouts.
+        the model is fitted once and kept until cutouts or component number change
+
+        Returns:
+            sorting_model (Modules.SpikeSorting.SpikeSortingModel): fitted model, None if there are less than 2 cutouts
+        """
+        return self._memoize("sorting_model", self._fit_sorting_model, self._sorting_model_dependencies)
+
+    @staticmethod
+    def sort_together(spike_together_objs: list) -> None:
+        """
+        fits the spike sorting of several objects (e.g. one per channel) at once, so channels and their
+        gaussian mixture initializations are spread across the process pool together.
+        objects, which are already sorted, have a stored or reference model or have less than 2 cutouts, aren't fitted
+
+        Args:
+            spike_together_objs (list -> SpikeTogether): objects to sort
+        """
+        pending = []
+        for obj in spike_together_objs:
+            if "sorting_model" in obj._memo or obj.reference_templates is not None or len(obj.cutouts) < 2:
+                continue
+            model = obj._get_ready_sorting_model()
+            if model is None:
+                pending.append(obj)
+            else:
+                obj._memoize("sorting_model", lambda: model, obj._sorting_model_dependencies)
+
+        models = fit_sorting_models([obj._new_sorting_model() for obj in pending], [obj.cutouts for obj in pending])
+        for obj, model in zip(pending, models):
+            obj._store_sorting_model(model)
+            obj._memoize("sorting_model", lambda: model, obj._sorting_model_dependencies)
+
+    @property
+    def units_number(self) -> int:
+        """
+        Returns:
+            units_number (int): the quantity of neurons, which spikes were sorted into,
+                                with "auto" component number it is the number selected by BIC
+        """
+        if self.reference_templates is not None:
+            return int(self.reference_templates.units.max()) + 1
+        if self.sorting_model is not None:
+            return self.sorting_model.n_components
+        return min(len(self.cutouts), 1)
+
+    @property
+    def templates(self) -> TemplateClassifier:
+        """
+        this function calculates templates (mean cutouts) of the units, which spikes were labeled with,
+        they can label spikes of other time ranges or recordings as reference_templates without sorting
+
+        Returns:
+            templates (Modules.SpikeSorting.TemplateClassifier): fitted templates, None if there are no spikes
+        """
+        if not len(self.cutouts):
+            return None
+        return self._memoize("templates", lambda: TemplateClassifier().fit(self.cutouts, self.labels),
+                             ("cutouts", "sorting_model", "reference_templates"))
 
-    # TODO:
     @property
     def labels(self) -> numpy.ndarray:
         """
-        this function calls the pca function from utils.py which predicts labels for spikes with the waveform features
-        it returns [0] if there is only one cutout because pca can't predict the labels for only one example
+        this function returns labels, which the spike sorting model predicted for spikes with the waveform features
+        it returns [0] if there is only one cutout because pca can't predict the labels for only one example.
+        with reference templates, spikes are labeled by the nearest template and nothing is sorted
 
         Returns:
             labels (numpy.ndarray -> numpy.int64): the labels of spikes, len of this should be the len of spikes
 
         """
         if not len(self.cutouts):
-            return numpy.array()
+            return numpy.array([], dtype=numpy.int64)
+        elif self.reference_templates is not None:
+            return self._memoize("template_labels", lambda: self.reference_templates.predict(self.cutouts),
+                                 ("cutouts", "reference_templates"))
         elif len(self.cutouts) == 1:
             return numpy.array([0])
-        labels = get_pca_labels(self.cutouts, self.component_number)
-        return labels
+        return self.sorting_model.labels
+
+    @property
+    def unit_labels(self) -> numpy.ndarray:
+        """
+        this function returns the label of every spike of indexes. spikes too close to the signal borders
+        have no cutout, so they aren't sorted and get UNSORTED_LABEL
+
+        Returns:
+            unit_labels (numpy.ndarray -> numpy.int64): the len of this is the len of indexes
+        """
+        indexes = numpy.asarray(self.indexes, dtype=numpy.int64)
+        unit_labels = numpy.full(len(indexes), UNSORTED_LABEL, dtype=numpy.int64)
+        if len(self.cutouts):
+            pre_idx, post_idx = int(self.pre * self.fs), int(self.post * self.fs)
+            unit_labels[(indexes - pre_idx >= 0) & (indexes + post_idx <= len(self.signal))] = self.labels
+        return unit_labels
+
+    _sorting_model_dependencies = ("cutouts", "component_number", "subsample_size", "reference_model")
+
+    def _fit_sorting_model(self):
+        if len(self.cutouts) < 2:
+            return None
+        model = self._get_ready_sorting_model()
+        if model is None:
+            model = self._new_sorting_model().fit(self.cutouts)
+            self._store_sorting_model(model)
+        return model
+
+    @property
+    def _sorting_model_key(self) -> str:
+        """
+        the recording is identified by the content of its file, so a model is never used for another recording
+        saved under the same path. the time range is left out, units of a channel don't depend on it
+        """
+        recording_key = get_recording_key(self._electrode_stream) or get_stream_key(self._electrode_stream)
+        return get_model_key(recording_key, tuple(sorted(self._channels)), self.high_pass, self.low_pass,
+                             self.dead_time, self.threshold_from, self.threshold_to, self.pre, self.post,
+                             self.component_number, self.random_state, self.subsample_size)
+
+    def _get_ready_sorting_model(self):
+        """
+        returns the model which labels the cutouts with predict, without fitting: the reference model or
+        the stored model of the same recording, channels and parameters. None if the model should be fitted
+        """
+        model = self.reference_model
+        if model is None and self.model_store is not None:
+            model = self.model_store.load(self._sorting_model_key)
+        return None if model is None else model.relabel(self.cutouts)
+
+    def _store_sorting_model(self, model: SpikeSortingModel) -> None:
+        # a model, which got one component because of too few cutouts, would label other time ranges wrongly
+        if self.model_store is not None and (model.auto or model.n_components == self.component_number):
+            self.model_store.try_save(self._sorting_model_key, model)
+
+    def _new_sorting_model(self) -> SpikeSortingModel:
+        return SpikeSortingModel(self.component_number, self.random_state, subsample_size=self.subsample_size)
 
     @property
     def spike_labels_indexes(self) -> list:
@@ -90,7 +292,8 @@ class SpikeTogether(Spikes):
         """
         if not len(self.cutouts):
             return []
-        return get_spikes_with_labels(self.labels, self.indexes)
+        return self._memoize("spike_labels_indexes", lambda: get_spikes_with_labels(self.labels, self.indexes),
+                             ("sorting_model", "template_labels", "reference_templates", "indexes"))
 
     @property
     def spike_labels(self) -> list:
@@ -104,8 +307,7 @@ class SpikeTogether(Spikes):
         if not len(self.cutouts):
             return []
         spikes_times_labels = []
-        spikes_with_labels = get_spikes_with_labels(self.labels, self.indexes)
-        for spikes, color in spikes_with_labels:
+        for spikes, color in self.spike_labels_indexes:
             spikes = [i/self.fs for i in spikes]
             spikes_times_labels.append((spikes, color))
         return spikes_times_labels
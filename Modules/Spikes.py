@@ -1,6 +1,8 @@
 from Modules.ParamChecker import ParamChecker
+import numpy as np
 from Modules.utils import (calculate_min_voltage_of_signal,
                            calculate_spikes,
+                           calculate_spikes_in_chunks,
                            calculate_threshold_based_on_signal)
 from Modules.Waveform import Waveform
 
@@ -21,6 +23,8 @@ class Spikes(Waveform):
         indexes (list): the indices of calculated spikes
         time_range (list): the corresponding times of calculated spikes
         dead_time_idx (int): corresponding index of dead_time
+        spike_table (Modules.SpikeTable.SpikeTable): already detected spikes of many channels,
+                                                     single channel objects take their spikes from it
 
 
     Args:
@@ -29,22 +33,51 @@ class Spikes(Waveform):
                               to detect spike
         threshold_to (str): the pre-defined max/min(depends on if signal is negative or not) value of signal
                             to detect spike
+        spike_table (Modules.SpikeTable.SpikeTable): already detected spikes of many channels
 
     Note that *args and **kwargs are defined in the parent class
     """
 
-    def __init__(self, dead_time, threshold_from="", threshold_to="", *args, **kwargs):
+    def __init__(self, dead_time, threshold_from="", threshold_to="", *args, spike_table=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.spike_table = spike_table
         self.dead_time = dead_time
         self.threshold_from = threshold_from
         self.threshold_to = threshold_to
     
     @property
     def indexes(self) -> list:
-        return calculate_spikes(self.signal, self.threshold_from, self.threshold_to, self.fs, self.dead_time_idx)
+        return self._memoize("indexes", self._calculate_indexes,
+                             ("signal", "from_s", "to_s", "high_pass", "low_pass", "chunk_size", "dead_time",
+                              "threshold_from", "threshold_to", "spike_table"))
 
     @property
     def time_range(self) -> list:
+        return self._memoize("time_range", self._calculate_time_range, ("indexes", "from_s"))
+
+    @property
+    def spike_table(self):
+        return self._spike_table
+
+    @spike_table.setter
+    def spike_table(self, spike_table) -> None:
+        self._spike_table = spike_table
+        self._invalidate("spike_table")
+
+    def _calculate_indexes(self) -> list:
+        if self.spike_table is not None and len(self._channels) == 1:
+            return self.spike_table.channel_indexes(self._channels[0], self._from_idx, self._to_idx) - self._from_idx
+        return self._load_or_compute("spikes", self._detect_indexes, self.dead_time, self.threshold_from,
+                                     self.threshold_to)
+
+    def _detect_indexes(self) -> list:
+        if self.chunk_size:
+            spikes = calculate_spikes_in_chunks(self.iter_chunks(), self.threshold_from, self.threshold_to,
+                                                self.fs, self.dead_time_idx)
+            return np.concatenate(list(spikes))
+        return calculate_spikes(self.signal, self.threshold_from, self.threshold_to, self.fs, self.dead_time_idx)
+
+    def _calculate_time_range(self) -> list:
         indexes = self.indexes
         if len(indexes) > 0:
             time_range = indexes/self.fs + self.from_s
@@ -63,6 +96,7 @@ class Spikes(Waveform):
             raise ValueError('"Spikes dead time" should be positive')
         self._dead_time = float(dead_time)
         self._dead_time_idx = int(self.dead_time * self.fs)
+        self._invalidate("dead_time")
 
     @property
     def threshold_from(self) -> float:
@@ -71,11 +105,14 @@ class Spikes(Waveform):
     @threshold_from.setter
     def threshold_from(self, threshold_from: str) -> float:
         if threshold_from == "":
+            if self.chunk_size:
+                raise ValueError('Parameter "Spike threshold from" should be set in streaming mode')
             self._threshold_from = calculate_threshold_based_on_signal(self.signal)
         else:
             _ = ParamChecker(threshold_from, "Spike threshold from").number
             
             self._threshold_from = float(threshold_from)
+        self._invalidate("threshold_from")
 
     @property
     def threshold_to(self) -> float:
@@ -84,13 +121,17 @@ class Spikes(Waveform):
     @threshold_to.setter
     def threshold_to(self, threshold_to: str) -> None:
         if threshold_to == "":
-            min_signal_voltage = calculate_min_voltage_of_signal(self.signal)
+            if self.chunk_size:
+                min_signal_voltage = min(calculate_min_voltage_of_signal(chunk) for chunk in self.iter_chunks())
+            else:
+                min_signal_voltage = calculate_min_voltage_of_signal(self.signal)
             if self.threshold_from > 0 :
                 self.threshold_to = min_signal_voltage * (-1)
             else:
                 self._threshold_to = min_signal_voltage
         else:
             self._threshold_to = float(ParamChecker(threshold_to, "Spike threshold to").number.value)
+        self._invalidate("threshold_to")
 
     @property
     def dead_time_idx(self) -> int:
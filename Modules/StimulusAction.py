@@ -1,8 +1,7 @@
 import numpy as np
 from Modules.ParamChecker import ParamChecker
 from Modules.Spikes import Spikes
-from Modules.utils import calculate_bins
-from functools import reduce
+from Modules.utils import calculate_peri_stimulus_counts
 
 
 class StimulusAction(Spikes):
@@ -18,22 +17,22 @@ class StimulusAction(Spikes):
         stimulus_indexes (numpy.ndarray): already detected stimulus from the signal
         stimulus_bins (pre_bin_list: numpy.ndarray, post_bin_list: numpy.ndarray, pre_bin_list_stde: numpy.ndarray
                         ,post_bin_list_stde: numpy.ndarray): contains main calculated stimulus analysis
+        pre_counts (numpy.ndarray): stimuli x bins matrix with spike quantity in every pre bin
+        post_counts (numpy.ndarray): stimuli x bins matrix with spike quantity in every post bin
     Args:
         pre (str): user's defined time before stimulus for spike calculations
         post (str): user's defined time after stimulus for spike calculations
         bin_width (str): width of the bin in pre and post's signals (there will be pre/bin_width + post/bin_width bins)
-        stimulus (numpy.ndarray): already detected stimulus from the signal
+        stimulus_indexes (numpy.ndarray): already detected stimulus from the signal
 
     Note that *args and **kwargs are defined in the parent class
     """
-    def __init__(self, pre: str, post: str, bin_width: str, stimulus, *args, **kwargs):
+    def __init__(self, pre: str, post: str, bin_width: str, stimulus_indexes, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.pre = pre
         self.post = post 
         self.bin_width = bin_width
-        self.stimulus_indexes = stimulus
-        self.stimulus_bins = [], [], [], []
-        self.get_stimulus_bins()
+        self.stimulus_indexes = stimulus_indexes
 
     @property
     def pre(self) -> float:
@@ -42,6 +41,7 @@ class StimulusAction(Spikes):
     @pre.setter
     def pre(self, value: str) -> None:
         self._pre = ParamChecker(value, "Pre").not_empty.number.positive.value
+        self._invalidate("pre")
 
     @property
     def post(self) -> float:
@@ -50,6 +50,7 @@ class StimulusAction(Spikes):
     @post.setter
     def post(self, value: str) -> None:
         self._post = ParamChecker(value, "Post").not_empty.number.positive.value
+        self._invalidate("post")
 
     @property
     def bin_width(self) -> float:
@@ -58,60 +59,75 @@ class StimulusAction(Spikes):
     @bin_width.setter
     def bin_width(self, width: str) -> None:
         self._bin_width = ParamChecker(width, "Bin width").not_empty.number.positive.value
-    
-    def get_stimulus_bins(self) -> None:
-        """
-        get_stimulus_bins is the function which makes a complex calculations.
-        it firstly calculates spikes (with help of parent class).
-        after that, we need to get those spikes, which are in the pre or post of one of the stimulus index
-        then, we split those pre and post's intervals by bin_width-es and calculate spike quantity in each bin
-        if there is more than one stimulus, we average spikes into bins.
-        We also calculate standard deviation error for those spike quantities.
-        All of those above mentioned calculations are class attributes.
+        self._invalidate("bin_width")
 
-        TODO: Code needs to be simplified
-        """
-        spikes = self.indexes  # This spikes are just indexes, from_in_s IS NOT added here
-        # here are stimulus indexes which also DOES NOT include from_in_s here
-        stimulus_starts = [y for x, y in enumerate(self.stimulus_indexes) if x % 2 != 0]
-        stimulus_ends = [y for x, y in enumerate(self.stimulus_indexes) if x % 2 == 0]
+    @property
+    def stimulus_indexes(self):
+        return self._stimulus_indexes
 
-        # in case stimulus lists have no equal size
-        stimulus_len = len(stimulus_starts) if len(stimulus_starts) <= len(stimulus_ends) else len(stimulus_ends)
-        pre_bin_list_size = int(self.pre/self.bin_width)
-        post_bin_list_size = int(self.post/self.bin_width)
-        pre_bin_list, post_bin_list = [], []
-        for i in range(0, stimulus_len):
-            start = stimulus_starts[i]  # index
-            end = stimulus_ends[i]  # index
-            from_ = start - int(self.pre * self.fs)
-            to_ = end + int(self.post * self.fs)
+    @stimulus_indexes.setter
+    def stimulus_indexes(self, stimulus_indexes) -> None:
+        self._stimulus_indexes = stimulus_indexes
+        self._invalidate("stimulus_indexes")
 
-            pre_spikes = spikes[(spikes > from_) & (spikes < start)]
-            pre_spikes = [sp/self.fs + self.from_s for sp in pre_spikes]
-            pre_bins = calculate_bins(pre_spikes, start/self.fs-self.pre+self.from_s, self.bin_width)
-            pad_len = pre_bin_list_size - len(pre_bins)
-            pre_bins = np.concatenate((pre_bins, [0] * pad_len))
+    @property
+    def stimulus_bins(self) -> tuple:
+        return self._memoize("stimulus_bins", self._calculate_stimulus_bins, ("peri_stimulus_counts",))
 
-            post_spikes = spikes[(spikes > end) & (spikes < to_)]
-            post_spikes = [sp/self.fs + self.from_s for sp in post_spikes]
-            post_bins = calculate_bins(post_spikes, end/self.fs+self.from_s, self.bin_width)
-            pad_len = post_bin_list_size - len(post_bins)
-            post_bins = np.concatenate((post_bins, [0] * pad_len))
+    @property
+    def pre_counts(self) -> np.ndarray:
+        return self._peri_stimulus_counts[0]
 
-            pre_bin_list.append(list(pre_bins))
-            post_bin_list.append(list(post_bins))
+    @property
+    def post_counts(self) -> np.ndarray:
+        return self._peri_stimulus_counts[1]
 
-        pre_bin_list, post_bin_list = np.array(pre_bin_list), np.array(post_bin_list)
-        pre_bin_list_sum, pre_bin_list_std = np.sum(pre_bin_list, axis=0), np.std(pre_bin_list, axis=0)
+    @property
+    def _peri_stimulus_counts(self) -> (np.ndarray, np.ndarray):
+        return self._memoize("peri_stimulus_counts", self._calculate_peri_stimulus_counts,
+                             ("indexes", "pre", "post", "bin_width", "stimulus_indexes"))
 
-        pre_bin_list_stde = pre_bin_list_std / np.sqrt(pre_bin_list.shape[0])
+    def _calculate_peri_stimulus_counts(self) -> (np.ndarray, np.ndarray):
+        """
+        _calculate_peri_stimulus_counts is the function which makes a complex calculations.
+        it firstly calculates spikes (with help of parent class).
+        after that, we need to get those spikes, which are in the pre or post of one of the stimulus index
+        then, we split those pre and post's intervals by bin_width-es and calculate spike quantity in each bin.
+        All stimuli are binned at once into stimuli x bins matrices (pre_counts, post_counts).
 
-        post_bin_list_sum, post_bin_list_std = np.sum(post_bin_list, axis=0), np.std(post_bin_list, axis=0)
-        post_bin_list_stde = post_bin_list_std / np.sqrt(post_bin_list.shape[0])
+        Returns:
+            pre_counts (numpy.ndarray): stimuli x bins matrix with spike quantity in every pre bin
+            post_counts (numpy.ndarray): stimuli x bins matrix with spike quantity in every post bin
+        """
+        # spikes and stimulus are indexes, from_in_s IS NOT added here
+        spikes = np.asarray(self.indexes)
+        stimulus_indexes = np.asarray(self.stimulus_indexes, dtype=np.int64)
+        stimulus_starts, stimulus_ends = stimulus_indexes[1::2], stimulus_indexes[0::2]
 
-        pre_bin_list = pre_bin_list_sum / stimulus_len 
-        post_bin_list = post_bin_list_sum / stimulus_len
-        self.stimulus_bins = pre_bin_list, post_bin_list, pre_bin_list_stde, post_bin_list_stde
+        # in case stimulus lists have no equal size
+        stimulus_len = min(len(stimulus_starts), len(stimulus_ends))
+        stimulus_starts, stimulus_ends = stimulus_starts[:stimulus_len], stimulus_ends[:stimulus_len]
+        pre_bin_list_size = int(self.pre/self.bin_width)
+        post_bin_list_size = int(self.post/self.bin_width)
 
+        bin_width_idx = self.bin_width * self.fs
+        pre_counts = calculate_peri_stimulus_counts(spikes, stimulus_starts - int(self.pre * self.fs),
+                                                    stimulus_starts, stimulus_starts - self.pre * self.fs,
+                                                    bin_width_idx, pre_bin_list_size)
+        post_counts = calculate_peri_stimulus_counts(spikes, stimulus_ends, stimulus_ends + int(self.post * self.fs),
+                                                     stimulus_ends, bin_width_idx, post_bin_list_size)
+        return pre_counts, post_counts
 
+    def _calculate_stimulus_bins(self) -> tuple:
+        """
+        the spike frequency is averaged over stimuli and the standard deviation error is calculated
+        """
+        pre_bin_list, pre_bin_list_stde = self._get_mean_and_stde(self.pre_counts / self.bin_width)
+        post_bin_list, post_bin_list_stde = self._get_mean_and_stde(self.post_counts / self.bin_width)
+        return pre_bin_list, post_bin_list, pre_bin_list_stde, post_bin_list_stde
+
+    @staticmethod
+    def _get_mean_and_stde(bin_matrix: np.ndarray) -> (np.ndarray, np.ndarray):
+        if not bin_matrix.shape[0]:
+            return np.zeros(bin_matrix.shape[1]), np.zeros(bin_matrix.shape[1])
+        return bin_matrix.mean(axis=0), bin_matrix.std(axis=0) / np.sqrt(bin_matrix.shape[0])
@@ -1,10 +1,15 @@
 import numpy
 import numpy as np
-from typing import List
+from itertools import chain, islice
+from typing import Callable, Iterator, List, Optional
 from Modules.ParamChecker import ParamChecker
+from Modules.ResultStore import ResultStore, get_recording_key, get_result_key, result_store
+from Modules.SignalCache import get_stream_key, signal_cache
 from Modules.utils import (convert_channel_label_to_id
-                           , filter_base_frequency
+                           , filter_signal_chunks
+                           , get_filter_warm_up
                            , get_signal
+                           , read_filtered_signal
                            , round_to_closest)
 
 
@@ -13,6 +18,14 @@ class Waveform:
     Waveform class is to make signal's main, waveform object usable
     It firstly reads the signal (if there is more than one channel, averages it)
     and in case of high_pass and low_pass filters, gives us filtered one.
+    The signal is read on the first access, for recordings which don't fit in memory
+    use iter_chunks (streaming mode) instead of signal.
+    The filter starts before from_s (see Modules.utils.get_filter_warm_up), so the filtered signal of a time range
+    is the same as that range of the filtered whole recording, it doesn't depend on where the range starts.
+    Derived values (signal and everything child classes calculate from it) are memoized,
+    they are calculated once and dropped only when a parameter they depend on changes through its setter.
+    Results, which are expensive to calculate (e.g. detected spikes), are also saved in the result store,
+    so the next session loads them for the same recording and parameters.
 
     Attributes:
         signal_time (float): recording's time in seconds
@@ -20,6 +33,8 @@ class Waveform:
         to_s (float): user's chosen end time in seconds (None indicates the length of signal)
         high_pass (int): user's chosen filter (every frequency higher than that number will remain)
         low_pass (int): user's chosen filter (every frequency lower than that number will remain)
+        chunk_size (int): number of samples in one chunk, None means the whole signal is processed at once
+        result_store (Modules.ResultStore.ResultStore): store of calculated results, None doesn't save or load them
 
     Args:
         electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
@@ -28,9 +43,14 @@ class Waveform:
         to_s (str): user's chosen end time in seconds (None indicates the length of signal)
         high_pass (str): user's chosen filter (every frequency higher than that number will remain)
         low_pass (str): user's chosen filter (every frequency lower than that number will remain)
+        chunk_size (str): number of samples in one chunk for streaming mode, empty string turns streaming off
+        result_store (Modules.ResultStore.ResultStore): store of calculated results, None doesn't save or load them
     """
     def __init__(self, electrode_stream,
-                 channels: List[str], from_s: str = "", to_s: str = "", high_pass: str = "", low_pass: str = ""):
+                 channels: List[str], from_s: str = "", to_s: str = "", high_pass: str = "", low_pass: str = "",
+                 chunk_size: str = "", result_store: ResultStore = result_store):
+        self._memo, self._memo_dependencies = {}, {}
+        self.result_store = result_store
         self._electrode_stream = electrode_stream
         self._channels = list(map(lambda ch: convert_channel_label_to_id(electrode_stream, ch), channels))
         self._fs = int(self._electrode_stream.channel_infos[0].sampling_frequency.magnitude)
@@ -39,20 +59,60 @@ class Waveform:
         self.from_s, self.to_s = from_s, to_s
         self.high_pass = high_pass
         self.low_pass = low_pass
-
-        self._signal = self._get_filtered_signal()
+        self.chunk_size = chunk_size
 
     @property
     def signal(self) -> numpy.ndarray:
-        return self._signal
+        return self._memoize("signal", self._get_filtered_signal, ("from_s", "to_s", "high_pass", "low_pass"))
 
     @property
-    def _signal_in_range(self) -> numpy.ndarray:
-        return get_signal(self._electrode_stream, self._channels, self._from_idx, self._to_idx)
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, chunk_size: str) -> None:
+        if chunk_size == "" or chunk_size is None:
+            self._chunk_size = None
+        else:
+            chunk_size = int(ParamChecker(chunk_size, "Chunk size").number.positive.value)
+            if chunk_size == 0:
+                raise ValueError('Parameter "Chunk size" should be greater than zero')
+            self._chunk_size = chunk_size
+        self._invalidate("chunk_size")
+
+    def iter_chunks(self, chunk_size: int = None) -> Iterator[numpy.ndarray]:
+        """
+        Streaming mode of the signal, it reads and filters the signal chunk by chunk. The filter is warmed up
+        before the first chunk and its state is carried across chunk boundaries, so concatenated chunks
+        are the same as the signal property, but only one chunk is in memory at once.
+
+        Args:
+            chunk_size (int): number of samples in one chunk, if None, the object's chunk_size is used
+
+        Returns:
+            chunks (iterator -> numpy.ndarray -> numpy.float64): consecutive filtered parts of the signal
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if not chunk_size:
+            raise ValueError('Parameter "Chunk size" should be set for streaming mode')
+
+        if "signal" in self._memo or signal_cache.covers(self._signal_span_key, self._from_idx, self._to_idx):
+            signal = self.signal
+            return (signal[start:start + chunk_size] for start in range(0, len(signal), chunk_size))
+
+        end_idx = min(self._to_idx + 1, self._electrode_stream.channel_data.shape[1])
+        raw_chunks = (get_signal(self._electrode_stream, self._channels, start, min(start + chunk_size, end_idx) - 1)
+                      for start in range(self._from_idx, end_idx, chunk_size))
+        warm_up_from = max(self._from_idx - get_filter_warm_up(self.fs, self.high_pass, self.low_pass), 0)
+        if warm_up_from == self._from_idx:
+            return filter_signal_chunks(raw_chunks, self.fs, self.high_pass, self.low_pass)
+        warm_up = get_signal(self._electrode_stream, self._channels, warm_up_from, self._from_idx - 1)
+        return islice(filter_signal_chunks(chain([warm_up], raw_chunks), self.fs, self.high_pass, self.low_pass),
+                      1, None)
 
     @property
     def time(self) -> numpy.ndarray:
-        return np.array(range(self._from_idx, self._to_idx + 1)) / self._fs
+        return self._memoize("time", lambda: np.arange(self._from_idx, self._to_idx + 1) / self._fs, ("from_s", "to_s"))
 
     @property
     def fs(self) -> int:
@@ -77,6 +137,7 @@ class Waveform:
             raise ValueError('Parameter "From" should be less than length of signal')
         self._from_s = from_s
         self._from_idx = int(self.from_s * self.fs)
+        self._invalidate("from_s")
 
     @property
     def to_s(self) -> float:
@@ -101,6 +162,7 @@ class Waveform:
 
         self._to_s = to_s
         self._to_idx = int(self.to_s * self.fs)
+        self._invalidate("to_s")
 
     @property
     def high_pass(self) -> int:
@@ -118,6 +180,7 @@ class Waveform:
             self._high_pass = None
         else:
             self._high_pass = int(ParamChecker(high_pass, "High pass").number.positive.value)
+        self._invalidate("high_pass")
 
     @property
     def low_pass(self) -> int:
@@ -141,6 +204,7 @@ class Waveform:
                 raise ValueError('Parameter "Low pass" should be greater than parameter "High pass"')
 
             self._low_pass = int(low_pass_checked)
+        self._invalidate("low_pass")
 
     @property
     def _from_idx(self) -> int:
@@ -158,14 +222,92 @@ class Waveform:
     def _to_idx(self, to_idx: int) -> None:
         self.__to_idx = to_idx
 
+    def _memoize(self, name: str, compute: Callable, depends_on: tuple = ()):
+        """
+        Returns the memoized value or calculates and memoizes it
+
+        Args:
+            name (str): name of the derived value
+            compute (function): function without arguments which calculates the value
+            depends_on (tuple -> str): parameters and derived values, which change the value
+
+        Returns:
+            value: memoized or calculated value
+        """
+        if name not in self._memo:
+            self._memo[name] = compute()
+            self._memo_dependencies[name] = depends_on
+        return self._memo[name]
+
+    def _invalidate(self, *names: str) -> None:
+        """
+        Drops memoized values, which depend on one of the names directly or through other memoized values
+
+        Args:
+            names (str): changed parameters or derived values
+        """
+        for name in names:
+            self._memo.pop(name, None)
+            dependents = [key for key, depends_on in self._memo_dependencies.items() if name in depends_on]
+            for key in dependents:
+                del self._memo_dependencies[key]
+            self._invalidate(*dependents)
+
+    @property
+    def _signal_cache_key(self) -> tuple:
+        return (get_stream_key(self._electrode_stream), tuple(sorted(self._channels)),
+                self._from_idx, self._to_idx, self.high_pass, self.low_pass)
+
+    @property
+    def _signal_span_key(self) -> tuple:
+        return get_stream_key(self._electrode_stream), tuple(sorted(self._channels)), self.high_pass, self.low_pass
+
+    def _get_result_key(self, *parts, in_range: bool = True) -> Optional[str]:
+        """
+        Returns the key of a result of the recording, channels, filters and (if in_range) the time range,
+        which depends on the parts too. None if results aren't saved or the recording isn't read from a file
+        """
+        recording_key = None if self.result_store is None else get_recording_key(self._electrode_stream)
+        if recording_key is None:
+            return None
+        time_range = (self._from_idx, self._to_idx) if in_range else ()
+        return get_result_key(recording_key, tuple(sorted(self._channels)), time_range, self.high_pass,
+                              self.low_pass, *parts)
+
+    def _load_or_compute(self, name: str, compute: Callable[[], numpy.ndarray], *parameters) -> numpy.ndarray:
+        """
+        Returns the result saved in the result store for the recording, channels, time range, filters and
+        parameters, or calculates and saves it
+
+        Args:
+            name (str): name of the result, e.g. "spikes"
+            compute (function): calculates the result array
+            parameters: other parameters the result depends on
+
+        Returns:
+            value (numpy.ndarray): saved or calculated result
+        """
+        key = self._get_result_key(name, *parameters)
+        arrays = None if key is None else self.result_store.load(key, ("value",))
+        if arrays is not None:
+            return arrays["value"]
+        value = compute()
+        if key is not None:
+            self.result_store.try_save(key, {"value": value})
+        return value
+
     def _get_filtered_signal(self) -> numpy.ndarray:
         """
-        Firstly checks the user's input and then casts it as an integer, it also checks if the
-        low_pass number is greater than high pass or not. it is important because,
-        if that condition is not satisfied, zero frequency will remain in the signal.
+        Reads and filters the signal. Filtered signals are kept in the shared signal cache per channels and filters
+        as one span of the recording, so if any module object already filtered a range around this one,
+        the signal is sliced from it, and if it filtered an overlapping range, only the missing edges are read
+        and filtered.
 
         Returns:
             filtered_signal (numpy.ndarray): filtered signal, if high_pass and low_pass is none, signal will remain same
         """
-        filtered_signal = filter_base_frequency(self._signal_in_range, self.fs, self.high_pass, self.low_pass)
-        return filtered_signal
+        return signal_cache.get_range(self._signal_span_key, self._from_idx, self._to_idx, self._read_filtered_signal)
+
+    def _read_filtered_signal(self, from_idx: int, to_idx: int) -> numpy.ndarray:
+        return read_filtered_signal(self._electrode_stream, self._channels, from_idx, to_idx, self.fs,
+                                    self.high_pass, self.low_pass)
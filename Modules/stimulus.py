@@ -52,9 +52,18 @@ class Stimulus(Waveform):
             stimulus (numpy.ndarray): filtered detected stimulus times
 
         """
-        if not(self.useless_stimulus and len(self.useless_stimulus) >0):
-            return calculate_stimulus(self.signal, self.threshold_from, self.dead_time_idx)
+        return self._memoize("indexes", self._calculate_indexes,
+                             ("signal", "from_s", "to_s", "high_pass", "low_pass", "dead_time", "threshold_from",
+                              "useless_stimulus"))
+
+    def _calculate_indexes(self) -> numpy.ndarray:
+        return self._load_or_compute("stimulus", self._detect_indexes, self.dead_time, self.threshold_from,
+                                     self.useless_stimulus)
+
+    def _detect_indexes(self) -> numpy.ndarray:
         stimulus = calculate_stimulus(self.signal, self.threshold_from, self.dead_time_idx)
+        if not self.useless_stimulus:
+            return stimulus
         return filter_stimulus(stimulus, self.useless_stimulus, self.from_s, self.fs)
 
     @property
@@ -65,6 +74,9 @@ class Stimulus(Waveform):
         Returns:
             indexes (numpy.ndarray): corresponding indexes for detected stimulus times
         """
+        return self._memoize("time_range", self._calculate_time_range, ("indexes", "from_s"))
+
+    def _calculate_time_range(self) -> numpy.ndarray:
         indexes = self.indexes
         if len(indexes) > 1:
             time_range = indexes/self.fs + self.from_s
@@ -88,6 +100,7 @@ class Stimulus(Waveform):
 
         self._dead_time = float(dead_time)
         self._dead_time_idx = int(self.dead_time * self.fs)
+        self._invalidate("dead_time")
 
     @property
     def useless_stimulus(self) -> list:
@@ -105,6 +118,7 @@ class Stimulus(Waveform):
         """
         if useless_stimulus == "":
             self._useless_stimulus = "" 
+            self._invalidate("useless_stimulus")
             return
         useless_stimulus_int = []
         for i in range(0,len(useless_stimulus)):
@@ -117,6 +131,7 @@ class Stimulus(Waveform):
                 raise ValueError('"useless stimulus times" should be less than signal time')
             useless_stimulus_int.append((temp_from, temp_to))
         self._useless_stimulus = useless_stimulus_int
+        self._invalidate("useless_stimulus")
 
     @property
     def threshold_from(self) -> float:
@@ -139,6 +154,7 @@ class Stimulus(Waveform):
             _ = ParamChecker(threshold_from, "Stimulus threshold from").number
 
         self._threshold_from = float(threshold_from)
+        self._invalidate("threshold_from")
 
     @property
     def threshold_to(self) -> float:
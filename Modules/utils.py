@@ -2,14 +2,19 @@ import matplotlib.backends.backend_qt5agg
 import numpy
 from McsPy import McsData
 from matplotlib import pyplot as plt
-from scipy.signal import butter, sosfilt
-from functools import reduce
-from typing import List
+from scipy.signal import butter, sos2zpk, sosfilt
+from typing import Iterable, Iterator, List, Optional
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from matplotlib.collections import LineCollection
 from matplotlib.lines import Line2D
-from sklearn.mixture import GaussianMixture
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
+from Modules.SpikeSorting import DEFAULT_RANDOM_STATE, UNSORTED_LABEL, SpikeSortingModel
+
+_ALIGN_BATCH_SIZE = 65536
+# signals are drawn with at least this many min/max pairs, wider figures get one pair per pixel column
+DECIMATION_MIN_BUCKETS = 2048
+# the filter's response to its zero initial state should decay below this part of the signal during warm up
+FILTER_WARM_UP_TOLERANCE = 1e-6
 
 
 def convert_channel_label_to_id(electrode_stream, channel_label: str) -> int:
@@ -43,7 +48,7 @@ def convert_channel_label_to_id(electrode_stream, channel_label: str) -> int:
 def get_signal(electrode_stream: McsData.AnalogStream, channels: List[int], from_idx: int,
                to_idx: int) -> numpy.ndarray:
     """
-    get_signal uses Mcspy's method for getting signal in particular range and averaging if it's needed
+    get_signal reads the signal in particular range and averages it if it's needed
 
     Args:
             electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
@@ -56,11 +61,64 @@ def get_signal(electrode_stream: McsData.AnalogStream, channels: List[int], from
                                                          (if multiple channels averaged, else signal itself)
 
     """
-    signal_summed = reduce(lambda a, b: a + b,
-                           map(lambda ch: np.array(electrode_stream.get_channel_in_range(ch, from_idx, to_idx)[0]),
-                               channels))
-    signal_avg = signal_summed / len(channels)
-    return signal_avg
+    return get_signal_block(electrode_stream, channels, from_idx, to_idx, aggregate="mean")
+
+
+def get_signal_block(electrode_stream: McsData.AnalogStream, channels: List[int], from_idx: int,
+                     to_idx: int, aggregate: Optional[str] = None) -> numpy.ndarray:
+    """
+    get_signal_block reads all of the chosen channels from the channel_data with one hyperslab read
+    (channels x samples) instead of reading them one by one, and applies ADC scaling on the whole block.
+    indexes behave the same way as Mcspy's get_channel_in_range, so to_idx is included.
+
+    Args:
+            electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
+            channels (list -> int): user's chosen channels to get signal
+            from_idx (int): user's chosen start time translated into indexes, if None, we consider 0
+            to_idx (int): user's chosen end time translated into indexes, if None, max length of recording list
+            aggregate (str): "mean" or "sum" to combine the channels, None to keep every channel separately
+
+    Returns:
+            signal (numpy.ndarray -> numpy.float64): signal in volts, 1-D if aggregated, else (channels x samples)
+    """
+    if aggregate not in ("mean", "sum", None):
+        raise ValueError(f'Unknown signal aggregation "{aggregate}"')
+    if not len(channels):
+        raise ValueError("At least one channel should be marked")
+
+    channel_data = electrode_stream.channel_data
+    from_idx = 0 if (from_idx is None or from_idx < 0) else from_idx
+    to_idx = channel_data.shape[1] if (to_idx is None or to_idx >= channel_data.shape[1]) else to_idx + 1
+
+    channel_infos = electrode_stream.channel_infos
+    rows = np.array([channel_infos[ch].row_index for ch in channels])
+    # hdf5 selection needs increasing and unique rows, duplicated channels are weighted back later
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    unique_channels = [channels[i] for i in np.unique(inverse, return_index=True)[1]]
+    scales = np.array([channel_infos[ch].adc_step.magnitude for ch in unique_channels], dtype=np.float64)
+    ad_zeros = np.array([channel_infos[ch].get_field('ADZero') for ch in unique_channels], dtype=np.float64)
+
+    if len(unique_rows) == unique_rows[-1] - unique_rows[0] + 1:
+        block = channel_data[unique_rows[0]:unique_rows[-1] + 1, from_idx:to_idx]
+    else:
+        block = channel_data[unique_rows.tolist(), from_idx:to_idx]
+
+    if aggregate is None:
+        # raw * scale - ad_zero * scale, the same operations as the aggregated path, so one channel's row
+        # is exactly the signal get_signal returns for that channel
+        block = np.asarray(block, dtype=np.float64)
+        block *= scales[:, None]
+        block -= (scales * ad_zeros)[:, None]
+        if np.array_equal(inverse, np.arange(len(rows))):
+            return block
+        return block[inverse]
+
+    # sum((raw - ad_zero) * scale) is folded into one weighted sum over the raw block,
+    # so neither a float copy nor a scaled copy of the block is made
+    weights = np.bincount(inverse).astype(np.float64) * scales
+    if aggregate == "mean":
+        weights /= len(channels)
+    return np.einsum('c,cs->s', weights, block) - np.dot(weights, ad_zeros)
 
 
 def filter_base_frequency(signal: numpy.ndarray, fs: int, high_pass: int, low_pass: int) -> numpy.ndarray:
@@ -77,21 +135,118 @@ def filter_base_frequency(signal: numpy.ndarray, fs: int, high_pass: int, low_pa
             filtered (numpy.ndarray -> numpy.float64): the filtered signal in volts
 
     """
+    if _filter_removes_everything(fs, high_pass, low_pass):
+        return signal * 0
+    sos = get_sos_filter(fs, high_pass, low_pass)
+    if sos is None:
+        return signal
+
+    filtered = sosfilt(sos, signal)
+    return filtered
+
+
+def filter_signal_chunks(chunks: Iterable[numpy.ndarray], fs: int, high_pass: int, low_pass: int) \
+        -> Iterator[numpy.ndarray]:
+    """
+    filter_signal_chunks filters the signal which comes chunk by chunk, the filter state is carried
+    across chunk boundaries, so concatenated result is the same as filter_base_frequency of the whole signal
+
+    Args:
+            chunks (iterable -> numpy.ndarray -> numpy.float64): consecutive parts of the signal in volts
+            fs (int): hertz, sampling frequency of the signal
+            high_pass (int): hertz, everything lower than this frequency will be removed from signal
+            low_pass (int): hertz, everything higher than this frequency will be removed from signal
+
+    Returns:
+            filtered chunks (iterator -> numpy.ndarray -> numpy.float64): the filtered chunks in volts
+    """
+    removes_everything = _filter_removes_everything(fs, high_pass, low_pass)
+    sos = None if removes_everything else get_sos_filter(fs, high_pass, low_pass)
+    zi = None
+    for chunk in chunks:
+        if removes_everything:
+            yield chunk * 0
+        elif sos is None:
+            yield chunk
+        else:
+            if zi is None:
+                zi = np.zeros((sos.shape[0],) + chunk.shape[:-1] + (2,))
+            filtered, zi = sosfilt(sos, chunk, zi=zi)
+            yield filtered
+
+
+def get_sos_filter(fs: int, high_pass: int, low_pass: int) -> Optional[numpy.ndarray]:
+    """
+    get_sos_filter designs butterworth filter for the given frequencies in second-order sections
+
+    Args:
+            fs (int): hertz, sampling frequency of the signal
+            high_pass (int): hertz, everything lower than this frequency will be removed from signal
+            low_pass (int): hertz, everything higher than this frequency will be removed from signal
+
+    Returns:
+            sos (numpy.ndarray / None): second-order sections of the filter, None if there is nothing to filter
+    """
     butter_range = 2
 
-    if (high_pass and high_pass >= fs / 2) or (low_pass and low_pass >= fs / 2):
-        return signal * 0
     if high_pass and low_pass:
-        sos = butter(N=butter_range, Wn=[high_pass, low_pass], fs=fs, btype='band', output='sos')
+        return butter(N=butter_range, Wn=[high_pass, low_pass], fs=fs, btype='band', output='sos')
     elif high_pass:
-        sos = butter(N=butter_range, Wn=high_pass, btype='hp', fs=fs, output='sos')
+        return butter(N=butter_range, Wn=high_pass, btype='hp', fs=fs, output='sos')
     elif low_pass:
-        sos = butter(N=butter_range, Wn=low_pass, btype='lp', fs=fs, output='sos')
-    else:
-        return signal
+        return butter(N=butter_range, Wn=low_pass, btype='lp', fs=fs, output='sos')
+    return None
 
-    filtered = sosfilt(sos, signal)
-    return filtered
+
+def _filter_removes_everything(fs: int, high_pass: int, low_pass: int) -> bool:
+    return bool((high_pass and high_pass >= fs / 2) or (low_pass and low_pass >= fs / 2))
+
+
+def get_filter_warm_up(fs: int, high_pass: int, low_pass: int) -> int:
+    """
+    get_filter_warm_up calculates how many samples the filter needs to forget its initial (zero) state,
+    it is the decay time of the slowest pole of the filter to FILTER_WARM_UP_TOLERANCE.
+    filtering, which starts that many samples before a range, gives the range of the filtered whole recording
+
+    Args:
+            fs (int): hertz, sampling frequency of the signal
+            high_pass (int): hertz, everything lower than this frequency will be removed from signal
+            low_pass (int): hertz, everything higher than this frequency will be removed from signal
+
+    Returns:
+            warm up (int): quantity of samples, zero if nothing is filtered
+    """
+    if _filter_removes_everything(fs, high_pass, low_pass):
+        return 0
+    sos = get_sos_filter(fs, high_pass, low_pass)
+    if sos is None:
+        return 0
+    pole_radius = np.abs(sos2zpk(sos)[1]).max()
+    return int(np.ceil(np.log(FILTER_WARM_UP_TOLERANCE) / np.log(pole_radius)))
+
+
+def read_filtered_signal(electrode_stream: McsData.AnalogStream, channels: List[int], from_idx: int, to_idx: int,
+                         fs: int, high_pass: int, low_pass: int) -> numpy.ndarray:
+    """
+    read_filtered_signal reads the (averaged) signal in particular range and filters it. the filter starts
+    get_filter_warm_up samples before from_idx, so the result doesn't depend on where the range starts,
+    and separately filtered ranges can be joined into one signal
+
+    Args:
+            electrode_stream (McsPy.McsData.AnalogStream): the main data object of the recording
+            channels (list -> int): user's chosen channels to get signal
+            from_idx (int): the first sample index
+            to_idx (int): the last sample index (included)
+            fs (int): hertz, sampling frequency of the signal
+            high_pass (int): hertz, everything lower than this frequency will be removed from signal
+            low_pass (int): hertz, everything higher than this frequency will be removed from signal
+
+    Returns:
+            filtered (numpy.ndarray -> numpy.float64): the filtered signal of the range in volts
+    """
+    warm_up_from = max(from_idx - get_filter_warm_up(fs, high_pass, low_pass), 0)
+    signal = get_signal(electrode_stream, channels, warm_up_from, to_idx)
+    return filter_base_frequency(signal, fs, high_pass, low_pass)[from_idx - warm_up_from:]
 
 
 def round_to_closest(value: float, time_stamp: float) -> float:
@@ -117,96 +272,117 @@ def round_to_closest(value: float, time_stamp: float) -> float:
     return value
 
 
-def _get_next_minimum(signal: numpy.ndarray, index: int, max_samples_to_search: int) -> float:
+def _align_to_minimum(signal: numpy.ndarray, threshold_crossings: List[int], fs: int) \
+        -> numpy.ndarray:
     """
-    _get_next_minimum searches for next minimum value in the corresponding indexes
+
+    _align_to_minimum aligns the detected threshold crossings to minimum value in the search range to get spikes
 
     Args:
             signal (numpy.ndarray -> numpy.float64): signal in volts
-            index (int): the index, where from we need to start search
-            max_samples_to_search(int): max number of values in which we need minimum
+            threshold_crossings (list -> int): indexes of crossed thresholds
+            fs (int): hertz, sampling frequency of the signal
 
     Returns:
-            index (float): the index of the found minimum value
+            aligned_spikes (numpy.ndarray -> numpy.int64): indexes of aligned spikes
     """
-    search_end_idx = min(index + max_samples_to_search, signal.shape[0])
-    min_idx = np.argmin(signal[index:search_end_idx])
-    return index + min_idx
+    return _align_to_peak(signal, threshold_crossings, fs, "min")
 
 
-def _align_to_minimum(signal: numpy.ndarray, threshold_crossings: List[int], fs: int) \
+def _align_to_peak(signal: numpy.ndarray, threshold_crossings: List[int], fs: int, peak: str = "min") \
         -> numpy.ndarray:
     """
-
-    _align_to_minimum aligns the detected threshold crossings to minimum value in the search range to get spikes
+    _align_to_peak aligns the detected threshold crossings to the peak in the search range to get spikes.
+    search windows of all crossings are built at once with fancy indexing, windows which go over the end
+    of the signal are padded with values which can't be the peak, so one argmin/argmax finds all of the peaks
 
     Args:
             signal (numpy.ndarray -> numpy.float64): signal in volts
             threshold_crossings (list -> int): indexes of crossed thresholds
             fs (int): hertz, sampling frequency of the signal
+            peak (str): "min" for negative spikes, "max" for positive spikes, "abs" for the largest absolute value
 
     Returns:
             aligned_spikes (numpy.ndarray -> numpy.int64): indexes of aligned spikes
     """
+    if peak not in ("min", "max", "abs"):
+        raise ValueError(f'Unknown spike peak "{peak}"')
+
     search_range = 0.002
-    search_end = int(search_range * fs)
-    aligned_spikes = np.array([_get_next_minimum(signal, t, search_end) for t in threshold_crossings])
+    search_end = max(int(search_range * fs), 1)
+    threshold_crossings = np.asarray(threshold_crossings, dtype=np.int64)
+    aligned_spikes = np.empty(len(threshold_crossings), dtype=np.int64)
+
+    # windows are built batch by batch, so memory doesn't grow with the quantity of spikes
+    for start in range(0, len(threshold_crossings), _ALIGN_BATCH_SIZE):
+        crossings = threshold_crossings[start:start + _ALIGN_BATCH_SIZE]
+        windows_idx = crossings[:, None] + np.arange(search_end)
+        outside = windows_idx >= signal.shape[0]
+        windows = signal[np.minimum(windows_idx, signal.shape[0] - 1)]
+        if peak == "min":
+            windows[outside] = np.inf
+            peak_idx = np.argmin(windows, axis=1)
+        else:
+            if peak == "abs":
+                windows = np.abs(windows)
+            windows[outside] = -np.inf
+            peak_idx = np.argmax(windows, axis=1)
+        aligned_spikes[start:start + _ALIGN_BATCH_SIZE] = crossings + peak_idx
     return aligned_spikes
 
 
 def get_signal_cutouts(signal: numpy.ndarray, fs: int, spikes_idx: numpy.ndarray,
-                       pre: float, post: float) -> List:
+                       pre: float, post: float, scale: float = 1) -> numpy.ndarray:
     """
     get_signal_cutouts takes existing spikes, and cuts the signal around each of the spikes (pre-spike, spike-post)
+    all cutouts are gathered at once from a sliding window view of the signal, so only the cutouts are copied.
+    spikes too close to the signal borders are dropped
 
     Args:
-            signal (numpy.ndarray -> numpy.float64): signal in micro volts
+            signal (numpy.ndarray -> numpy.float64): signal
             spikes_idx (numpy.ndarray -> numpy.int64): spike indexes in signals
             pre (float): seconds
             post (float): seconds
             fs (int): hertz, sampling frequency of the signal
+            scale (float): unit scale applied to the cutouts only (1000_000 for volts to micro volts)
 
     Returns:
-            cutouts (list -> numpy.ndarray -> numpy.float64): signal parts arnd spikes, len of cutouts is len of spikes_idx
+            cutouts (numpy.ndarray -> numpy.ndarray -> numpy.float64): spikes x window signal parts arnd spikes,
+                                                                        empty list if there is nothing to cut
     """
-    cutouts = []
     pre_idx = int(pre * fs)
     post_idx = int(post * fs)
-    if pre_idx > 0 and post_idx > 0:
-        for index in spikes_idx:
-            if index - pre_idx >= 0 and index + post_idx <= signal.shape[0]:
-                cutout = signal[(index - pre_idx):(index + post_idx)]
-                cutouts.append(cutout)
-
-        if len(cutouts) > 0:
-            return np.stack(cutouts)
+    if pre_idx <= 0 or post_idx <= 0:
+        return []
+
+    spikes_idx = np.asarray(spikes_idx, dtype=np.int64)
+    in_bounds = (spikes_idx - pre_idx >= 0) & (spikes_idx + post_idx <= signal.shape[0])
+    if not in_bounds.any():
+        return []
+
+    windows = sliding_window_view(signal, pre_idx + post_idx)
+    cutouts = windows[spikes_idx[in_bounds] - pre_idx]
+    if scale != 1:
+        cutouts *= scale
     return cutouts
 
 
-def get_pca_labels(cutouts: List, n_components: int) -> numpy.ndarray:
+def get_pca_labels(cutouts: List, n_components: int, random_state: int = DEFAULT_RANDOM_STATE) -> numpy.ndarray:
     """
-    get_pca_labels uses pca to calculate which cutouts are from the same neuron groups and which aren't
+    get_pca_labels uses pca to calculate which cutouts are from the same neuron groups and which aren't.
+    if the fitted model is needed too, use Modules.SpikeSorting.SpikeSortingModel directly
 
     Args:
             cutouts (list -> numpy.ndarray -> numpy.float64): cutouts made from signals around spikes
             n_components (int): this is the number of groups, if we think here are 3 neuron's spikes,
                                 n_components should be 3
+            random_state (int): seed of pca and gaussian mixture, the same seed gives the same labels
 
     Returns:
             predicted pca labels (numpy.ndarray -> numpy.int64): the len of this should be
                                                                  the len of spikes
     """
-    if n_components >= len(cutouts):
-        n_components = 1
-    pca = PCA()
-    pca.n_components = int(2)
-    scaler = StandardScaler()
-    scaled_cutouts = scaler.fit_transform(abs(cutouts))
-    scaled_cutouts *= 2
-
-    transformed = pca.fit_transform(scaled_cutouts)
-    gmm = GaussianMixture(n_components=int(n_components), n_init=10)
-    return gmm.fit_predict(transformed)
+    return SpikeSortingModel(n_components, random_state).fit(cutouts).labels
 
 
 def get_spikes_with_labels(labels: numpy.ndarray, spikes: numpy.ndarray) -> List[tuple]:
@@ -224,16 +400,19 @@ def get_spikes_with_labels(labels: numpy.ndarray, spikes: numpy.ndarray) -> List
     spikes_with_labels = []
     for i in unique:
         indices = [j for j, x in enumerate(labels) if x == i]
-        spikes_with_labels.append((spikes[indices], plt.rcParams['axes.prop_cycle'].by_key()['color'][i]))
+        color = "gray" if i == UNSORTED_LABEL else plt.rcParams['axes.prop_cycle'].by_key()['color'][i]
+        spikes_with_labels.append((spikes[indices], color))
     return spikes_with_labels
 
 
 def calculate_spikes(signal: numpy.ndarray, threshold_from: float, threshold_to: float, fs: int
-                     , dead_time_idx: int) -> List[int]:
+                     , dead_time_idx: int, peak: str = "min") -> numpy.ndarray:
     """
     spikes are a representation of neural activity, for the calculation methodology,
     we take user's thresholds and dead_time_idx and move on the signal,
-    while the value satisfies the thresholds, we skip the dead_time_idx and continue the searching process
+    while the value satisfies the thresholds, we skip the dead_time_idx and continue the searching process.
+    threshold crossings are found with numpy on the whole signal at once, only the dead time rule
+    runs in python and over the crossings, which are much fewer than the signal values
 
     Args:
             signal (numpy.ndarray -> numpy.float64): signal in volts
@@ -241,25 +420,149 @@ def calculate_spikes(signal: numpy.ndarray, threshold_from: float, threshold_to:
             threshold_to (float): volts
             fs (int): hertz, sampling frequency of the signal
             dead_time_idx (int): the index quantity we need to skip after finding one spike
+            peak (str): where spikes are aligned in the search range, "min", "max" or "abs".
+                        positive thresholds invert the signal, so there "min" is the positive peak
 
     Returns:
-            threshold_crossings (list -> int): indexes of calculated spikes
+            threshold_crossings (numpy.ndarray -> numpy.int64): indexes of calculated spikes
     """
     if threshold_from > 0 and threshold_to > 0:
         threshold_from = threshold_from * (-1)
         threshold_to = threshold_to * (-1)
         signal = signal * (-1)
 
+    threshold_crossings, _ = _get_threshold_crossings(signal, threshold_from, dead_time_idx, -dead_time_idx)
+    return _filter_aligned_spikes(signal, threshold_crossings, threshold_to, fs, peak)
+
+
+def calculate_spikes_in_chunks(chunks: Iterable[numpy.ndarray], threshold_from: float, threshold_to: float,
+                               fs: int, dead_time_idx: int, peak: str = "min") -> Iterator[numpy.ndarray]:
+    """
+    calculate_spikes_in_chunks is the streaming version of calculate_spikes, it consumes consecutive
+    signal chunks and yields spikes as soon as their minimum search range is available.
+    only the unfinished tail of the previous chunk is kept, so peak memory doesn't depend on signal length.
+    concatenated result is the same as calculate_spikes of the whole signal
+
+    Args:
+            chunks (iterable -> numpy.ndarray -> numpy.float64): consecutive parts of the signal in volts
+            threshold_from (float): volts
+            threshold_to (float): volts
+            fs (int): hertz, sampling frequency of the signal
+            dead_time_idx (int): the index quantity we need to skip after finding one spike
+            peak (str): where spikes are aligned in the search range, "min", "max" or "abs"
+
+    Returns:
+            spikes (iterator -> numpy.ndarray -> numpy.int64): indexes of calculated spikes (from the first chunk's start)
+    """
+    flip = threshold_from > 0 and threshold_to > 0
+    if flip:
+        threshold_from = threshold_from * (-1)
+        threshold_to = threshold_to * (-1)
+    search_end = int(0.002 * fs)
+
+    buffer = np.array([])
+    buffer_start = 0  # index of buffer's first value in the whole signal
     last_idx = -dead_time_idx
+    pending = np.array([], dtype=np.int64)  # crossings, which are waiting for the next chunk to be aligned
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        scan_from = len(buffer)
+        buffer = np.concatenate((buffer, chunk * (-1) if flip else chunk))
+        crossings, last_idx = _get_threshold_crossings(buffer, threshold_from, dead_time_idx,
+                                                       last_idx - buffer_start, max(scan_from, 1))
+        last_idx += buffer_start
+        pending = np.concatenate((pending, crossings))
+
+        ready = pending[pending + search_end <= len(buffer)]
+        pending = pending[pending + search_end > len(buffer)]
+        yield _filter_aligned_spikes(buffer, ready, threshold_to, fs, peak) + buffer_start
+
+        keep_from = min(pending.min(), len(buffer) - 1) if len(pending) else len(buffer) - 1
+        buffer = buffer[keep_from:]
+        pending -= keep_from
+        buffer_start += keep_from
+
+    if len(pending):
+        yield _filter_aligned_spikes(buffer, pending, threshold_to, fs, peak) + buffer_start
+
+
+def calculate_spikes_in_block(block: numpy.ndarray, thresholds_from: numpy.ndarray, thresholds_to: numpy.ndarray,
+                              fs: int, dead_time_idx: int, peak: str = "min") -> (numpy.ndarray, numpy.ndarray):
+    """
+    calculate_spikes_in_block detects spikes of every channel of a (channels x samples) signal block.
+    every row is detected with its own thresholds exactly like calculate_spikes of that channel's signal,
+    a missing (nan) threshold is calculated from the row itself, like Spikes does for an empty threshold.
+
+    Args:
+            block (numpy.ndarray -> numpy.float64): channels x samples signal in volts
+            thresholds_from (numpy.ndarray -> numpy.float64): volts, threshold of every row, nan calculates it
+            thresholds_to (numpy.ndarray -> numpy.float64): volts, threshold of every row, nan calculates it
+            fs (int): hertz, sampling frequency of the signal
+            dead_time_idx (int): the index quantity we need to skip after finding one spike
+            peak (str): where spikes are aligned in the search range, "min", "max" or "abs"
+
+    Returns:
+            rows (numpy.ndarray -> numpy.int64): block row of every spike
+            indexes (numpy.ndarray -> numpy.int64): index of every spike in its row, sorted within the row
+    """
+    thresholds_from = np.broadcast_to(np.asarray(thresholds_from, dtype=np.float64), (block.shape[0],))
+    thresholds_to = np.broadcast_to(np.asarray(thresholds_to, dtype=np.float64), (block.shape[0],))
+    rows, indexes = [], []
+    for row, signal in enumerate(block):
+        threshold_from, threshold_to = thresholds_from[row], thresholds_to[row]
+        if np.isnan(threshold_from):
+            threshold_from = calculate_threshold_based_on_signal(signal)
+        if np.isnan(threshold_to):
+            min_signal_voltage = calculate_min_voltage_of_signal(signal)
+            threshold_to = min_signal_voltage * (-1) if threshold_from > 0 else min_signal_voltage
+        spikes = calculate_spikes(signal, threshold_from, threshold_to, fs, dead_time_idx, peak)
+        rows.append(np.full(len(spikes), row, dtype=np.int64))
+        indexes.append(spikes)
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(indexes)
+
+
+def _get_threshold_crossings(signal: numpy.ndarray, threshold_from: float, dead_time_idx: int,
+                             last_idx: int, start_idx: int = 1) -> (List[int], int):
+    """
+    _get_threshold_crossings finds the places where signal goes under the threshold_from,
+    after each crossing, next dead_time_idx indexes are skipped
+
+    Args:
+            signal (numpy.ndarray -> numpy.float64): signal in volts
+            threshold_from (float): volts
+            dead_time_idx (int): the index quantity we need to skip after finding one spike
+            last_idx (int): index of the previous crossing
+            start_idx (int): index where from we need to start search
+
+    Returns:
+            threshold_crossings (numpy.ndarray -> numpy.int64): indexes of crossed thresholds
+            last_idx (int): index of the last crossing
+    """
+    start_idx = max(start_idx, 1)
+    below = signal[start_idx - 1:] <= threshold_from
+    crossings = np.flatnonzero(~below[:-1] & below[1:]) + start_idx
+
+    # every crossing, which is far enough from the previous one is taken, so when nothing is closer
+    # than the dead time, there is no need for the greedy pass
+    if not len(crossings) or (crossings[0] - last_idx > dead_time_idx + 1
+                              and np.all(np.diff(crossings) > dead_time_idx + 1)):
+        return crossings, int(crossings[-1]) if len(crossings) else last_idx
+
     threshold_crossings = []
-    for idx in range(len(signal)):
-        if (idx > 0) and (signal[idx - 1] > threshold_from) and \
-                (signal[idx] <= threshold_from) and (idx - last_idx > dead_time_idx + 1):
+    for idx in crossings.tolist():
+        if idx - last_idx > dead_time_idx + 1:
             threshold_crossings.append(idx)
             last_idx = idx
-    threshold_crossings = _align_to_minimum(signal, threshold_crossings, fs)
-    threshold_crossings = np.array(list(filter(lambda x: signal[x] >= threshold_to, threshold_crossings)))
-    return np.array(threshold_crossings)
+    return np.array(threshold_crossings, dtype=np.int64), last_idx
+
+
+def _filter_aligned_spikes(signal: numpy.ndarray, threshold_crossings: numpy.ndarray, threshold_to: float,
+                           fs: int, peak: str = "min") -> numpy.ndarray:
+    aligned_spikes = _align_to_peak(signal, threshold_crossings, fs, peak)
+    return aligned_spikes[signal[aligned_spikes] >= threshold_to]
 
 
 def calculate_stimulus(signal: numpy.ndarray, threshold: float, dead_time_idx: int) -> List[int]:
@@ -269,88 +572,80 @@ def calculate_stimulus(signal: numpy.ndarray, threshold: float, dead_time_idx: i
     we take user's thresholds and dead_time_idx and move on the signal, while the value
     satisfies the thresholds, we skip the dead_time_idx and continue the searching process
 
+    crossings which are closer than dead_time_idx to both of their neighbours are inner edges of one stimulus,
+    so from every group of close crossings only the first and the last one remain (the last group of the signal
+    keeps only its first crossing). after one such pass every remaining crossing is far enough from
+    one of its neighbours, so it is done in one vectorized pass instead of repeating it until nothing changes
+
     Args:
             signal (numpy.ndarray -> numpy.float64): signal in volts
             threshold (float): volts
             dead_time_idx (int): the index quantity we need to skip after finding one stimulus
 
     Returns:
-            threshold_crossings (list -> int): indexes of calculated stimulus
+            threshold_crossings (numpy.ndarray -> numpy.int64): indexes of calculated stimulus
     """
-    threshold_crossings = np.diff((signal <= threshold)).nonzero()[0]
+    threshold_crossings = np.flatnonzero(np.diff(signal <= threshold))
     if len(threshold_crossings) == 0:
         return np.array([])
 
-    distance_sufficient = np.insert(np.diff(threshold_crossings) >= dead_time_idx, 0, True)
     last_stimulus_index = threshold_crossings[-1]
-    for i in range(1, len(distance_sufficient)):
-        if distance_sufficient[i]:
-            distance_sufficient[i - 1] = True
-
-    while not np.all(distance_sufficient):
-        threshold_crossings = threshold_crossings[distance_sufficient]
-        distance_sufficient = np.insert(np.diff(threshold_crossings) >= dead_time_idx, 0, True)
-        for i in range(1, len(distance_sufficient)):
-            if distance_sufficient[i]:
-                distance_sufficient[i - 1] = True
+    far_from_previous = np.insert(np.diff(threshold_crossings) >= dead_time_idx, 0, True)
+    far_from_next = np.append(far_from_previous[1:], False)
+    threshold_crossings = threshold_crossings[far_from_previous | far_from_next]
 
     if len(threshold_crossings) % 2 == 1:
-        threshold_crossings = np.insert(threshold_crossings, len(threshold_crossings), last_stimulus_index)
+        threshold_crossings = np.append(threshold_crossings, last_stimulus_index)
     return threshold_crossings
 
 
-def calculate_bursts(spikes_in_s: List[numpy.float64], max_start: float
-                     , max_end: float, min_between: float, min_duration: float, min_number_spike: int):
+def calculate_bursts(spikes_in_s: numpy.ndarray, max_start: float
+                     , max_end: float, min_between: float, min_duration: float,
+                     min_number_spike: int) -> (numpy.ndarray, numpy.ndarray):
     """
-    TODO
+    this function detects bursts from the inter-spike intervals (ISI) of sorted spike times.
+    A burst starts at the first spike of a run whose next ISI is not longer than max_start and lasts
+    while ISIs stay shorter than max_end. Bursts closer than min_between are merged, and only bursts
+    lasting at least min_duration with at least min_number_spike spikes are kept.
 
     Args:
-            spikes_in_s (list -> numpy.float64): calculated spikes in second
-            max_start (float):
-            max_end (float):
-            min_between (float):
-            min_duration (float):
-            min_number_spike (int):
+            spikes_in_s (numpy.ndarray -> numpy.float64): sorted calculated spikes in second
+            max_start (float): maximum ISI (in seconds) to start a burst
+            max_end (float): ISI (in seconds) from which the burst ends
+            min_between (float): minimum interval (in seconds) between two bursts, closer bursts are merged
+            min_duration (float): minimum duration (in seconds) of a burst
+            min_number_spike (int): minimum quantity of spikes in a burst
     Returns:
-            bursts_starts ():
-            bursts_starts ():
-    """
-    spikes_in_s = np.array(spikes_in_s)
-    all_burst = []
-    i = 0
-    while i < len(spikes_in_s) - 1:
-        if (spikes_in_s[i + 1] - spikes_in_s[i]) <= max_start:
-            burst_start_in_s = spikes_in_s[i]
-            while (i < len(spikes_in_s) - 1) and ((spikes_in_s[i + 1] - spikes_in_s[i]) < max_end):
-                i += 1
-            burst_end_in_s = spikes_in_s[i]
-            all_burst.append([burst_start_in_s, burst_end_in_s])
-            i += 1
-        else:
-            i += 1
-    if not all_burst:
-        return [], []
-
-    merged_bursts = []
-    temp_burst = all_burst[0]
-    for i in range(1, len(all_burst)):
-        if (all_burst[i][0] - temp_burst[1]) < min_between:
-            temp_burst[1] = all_burst[i][1]
-        else:
-            merged_bursts.append(temp_burst)
-            temp_burst = all_burst[i]
-    merged_bursts.append(temp_burst)
-
-    bursts_starts = []
-    bursts_ends = []
-    for burst in merged_bursts:
-        num_spike_in_burst = len(spikes_in_s[(spikes_in_s >= burst[0]) & (spikes_in_s <= burst[1])])
-        if ((burst[1] - burst[0]) >= min_duration) and (num_spike_in_burst >= min_number_spike):
-            bursts_starts.append(burst[0])
-            bursts_ends.append(burst[1])
-    print("bursts_starts", type(bursts_starts), bursts_starts)
-    print("bursts_ends", type(bursts_ends), bursts_ends)
-    return bursts_starts, bursts_ends
+            bursts_starts (numpy.ndarray -> numpy.float64): start second of every burst
+            bursts_ends (numpy.ndarray -> numpy.float64): end second of every burst
+    """
+    spikes_in_s = np.asarray(spikes_in_s, dtype=np.float64)
+    if len(spikes_in_s) < 2:
+        return np.array([]), np.array([])
+    isi = np.diff(spikes_in_s)
+
+    # runs of spikes split by ISIs of at least max_end, the last run ends with the last spike
+    run_ends = np.append(np.flatnonzero(isi >= max_end), len(spikes_in_s) - 1)
+    run_starts = np.concatenate(([0], run_ends[:-1] + 1))
+    # every run holds at most one burst, from its first spike followed by a short enough ISI to the run end
+    candidates = np.flatnonzero(isi <= max_start)
+    first_candidate = np.searchsorted(candidates, run_starts)
+    has_burst = first_candidate < len(candidates)
+    has_burst[has_burst] = candidates[first_candidate[has_burst]] <= run_ends[has_burst]
+    bursts_starts = spikes_in_s[candidates[first_candidate[has_burst]]]
+    bursts_ends = spikes_in_s[run_ends[has_burst]]
+    if not len(bursts_starts):
+        return np.array([]), np.array([])
+
+    # merge bursts separated by less than min_between
+    far_from_previous = (bursts_starts[1:] - bursts_ends[:-1]) >= min_between
+    bursts_starts = bursts_starts[np.concatenate(([True], far_from_previous))]
+    bursts_ends = bursts_ends[np.concatenate((far_from_previous, [True]))]
+
+    spikes_in_burst = (np.searchsorted(spikes_in_s, bursts_ends, side="right")
+                       - np.searchsorted(spikes_in_s, bursts_starts, side="left"))
+    keep = ((bursts_ends - bursts_starts) >= min_duration) & (spikes_in_burst >= min_number_spike)
+    return bursts_starts[keep], bursts_ends[keep]
 
 
 def calculate_threshold_based_on_signal(signal: numpy.ndarray) -> float:
@@ -384,49 +679,129 @@ def calculate_min_voltage_of_signal(signal: numpy.ndarray) -> numpy.float64:
     return np.min(signal)
 
 
-def calculate_bins(spikes_in_range, from_s: float, bin_width) -> list:
+def calculate_bins(spikes_in_range, from_s: float, to_s: float, bin_width: float) -> np.ndarray:
     """
-    this method counts the spikes in each bin and returns the list with that information
+    this method counts the spikes in each bin of [from_s, to_s] and returns the spike frequency of every bin.
+    Bins are laid out exactly like np.arange(from_s, to_s, bin_width), so the result always has one
+    value per bin start and needs no padding. The last bin is closed, so a spike at to_s is still counted.
 
     Args:
         spikes_in_range (numpy.ndarray -> numpy.float64): spike times in the desired time range
         from_s (float): the start second for bins
+        to_s (float): the end second for bins
         bin_width (float): the desired length (in seconds) for one bin
 
+    Returns:
+        spike_freq_in_bins (numpy.ndarray -> numpy.float64): spikes per second in every bin
+    """
+    bins_number = len(np.arange(from_s, to_s, bin_width))
+    if bins_number == 0:
+        return np.zeros(0)
+
+    counts, _ = np.histogram(np.asarray(spikes_in_range, dtype=np.float64), bins=bins_number,
+                             range=(from_s, from_s + bins_number * bin_width))
+    return counts / bin_width
+
+
+def calculate_peri_stimulus_counts(spikes: np.ndarray, windows_from: np.ndarray, windows_to: np.ndarray,
+                                   bins_from: np.ndarray, bin_width: float, bins_number: int) -> np.ndarray:
+    """
+    this method counts the spikes around every stimulus at once. Spikes strictly inside (windows_from, windows_to)
+    are found with np.searchsorted on the sorted spike indexes, and each of them is put into its bin
+    starting from bins_from of its stimulus. Spikes falling beyond the last bin are dropped.
+    Everything is measured in signal indexes, so spikes on a bin edge fall into the later bin exactly.
+
+    Args:
+        spikes (numpy.ndarray -> numpy.int64): sorted spike indexes
+        windows_from (numpy.ndarray -> numpy.int64): the (exclusive) start index of every stimulus window
+        windows_to (numpy.ndarray -> numpy.int64): the (exclusive) end index of every stimulus window
+        bins_from (numpy.ndarray -> numpy.float64): the index of the first bin for every stimulus window
+        bin_width (float): the length of one bin in indexes (bin width in seconds * sampling frequency)
+        bins_number (int): the quantity of bins in every window
 
     Returns:
-        spike_len_in_bins (list): the list where every element contains the quantity of spikes
-    """
-    spike_len_in_bins = []
-    if not len(spikes_in_range):
-        return [0]
-
-    spikes_last_index = len(spikes_in_range) - 1
-    bin_start_second = from_s
-    counter = 0
-    idx = 0
-
-    while True:
-        if idx > spikes_last_index:
-            spike_len_in_bins.append(counter)
-            break
-        if spikes_in_range[idx] < (bin_start_second + bin_width):
-            counter += 1
-            idx += 1
-        else:
-            spike_len_in_bins.append(counter)
-            bin_start_second += bin_width
-            counter = 0
+        counts (numpy.ndarray -> numpy.int64): stimuli x bins matrix with spike quantity in each bin
+    """
+    windows_number = len(windows_from)
+    lo = np.searchsorted(spikes, windows_from, side="right")
+    hi = np.searchsorted(spikes, windows_to, side="left")
+    spikes_in_window = np.maximum(hi - lo, 0)
+
+    # flatten all (stimulus, spike) pairs: stimulus row and spike position for each of them
+    rows = np.repeat(np.arange(windows_number), spikes_in_window)
+    window_offsets = np.repeat(np.cumsum(spikes_in_window) - spikes_in_window, spikes_in_window)
+    positions = np.repeat(lo, spikes_in_window) + np.arange(len(rows)) - window_offsets
+
+    bin_idx = np.floor((spikes[positions] - np.asarray(bins_from)[rows]) / bin_width).astype(np.int64)
+    valid = (bin_idx >= 0) & (bin_idx < bins_number)
+    counts = np.bincount(rows[valid] * bins_number + bin_idx[valid], minlength=windows_number * bins_number)
+    return counts.reshape(windows_number, bins_number)
 
-    spike_len_in_bins = list(map(lambda x: int(x / bin_width), spike_len_in_bins))
-    return spike_len_in_bins
+
+def decimate_min_max(time_in_sec: numpy.ndarray, signal: numpy.ndarray, buckets: int) \
+        -> (numpy.ndarray, numpy.ndarray):
+    """
+    decimate_min_max divides the signal into buckets (e.g. pixel columns) and keeps only the min and the max
+    of every bucket. the line through them covers the same pixels as the line through every sample, so the plot
+    looks the same at screen resolution, but matplotlib draws 2 * buckets points instead of the whole signal.
+    the kept samples keep their order and times, so spikes stay where they are
+
+    Args:
+            time_in_sec (numpy.ndarray -> numpy.float64): list of seconds
+            signal (numpy.ndarray -> numpy.float64): signal
+            buckets (int): quantity of parts the signal is divided into, at least the width of the axes in pixels
+
+    Returns:
+            time_in_sec (numpy.ndarray -> numpy.float64): seconds of the kept samples
+            signal (numpy.ndarray -> numpy.float64): kept samples, the whole signal if it is shorter than 2 buckets
+    """
+    if len(signal) <= 2 * buckets:
+        return time_in_sec, signal
+    bucket_size = -(-len(signal) // buckets)
+    # the last bucket is padded with the last sample, which doesn't change its min and max
+    padded = np.pad(signal, (0, -len(signal) % bucket_size), mode="edge").reshape(-1, bucket_size)
+    starts = np.arange(padded.shape[0]) * bucket_size
+    min_idx = np.minimum(starts + padded.argmin(axis=1), len(signal) - 1)
+    max_idx = np.minimum(starts + padded.argmax(axis=1), len(signal) - 1)
+    # the first and the last samples keep the x range of the plot
+    kept = np.concatenate(([0], np.sort(np.stack((min_idx, max_idx), axis=1), axis=1).ravel(), [len(signal) - 1]))
+    return time_in_sec[kept], signal[kept]
+
+
+def _plot_decimated_signal(ax, time_in_sec: numpy.ndarray, signal: numpy.ndarray, **kwargs) -> Line2D:
+    """
+    plots the min/max decimated signal (see decimate_min_max), whenever x limits change (zoom and pan of
+    the navigation toolbar) the visible part is decimated again, so zoomed in plots show every sample
+
+    Args:
+            ax (canvas.figure.axis): the axis where the signal should be drawn
+            time_in_sec (numpy.ndarray -> numpy.float64): list of seconds
+            signal (numpy.ndarray -> numpy.float64): signal
+            kwargs: Matplotlib's unchanged arguments of the line
+
+    Returns:
+            line (matplotlib.lines.Line2D): the line of the signal
+    """
+    buckets = max(DECIMATION_MIN_BUCKETS, int(ax.figure.bbox.width))
+    line, = ax.plot(*decimate_min_max(time_in_sec, signal, buckets), **kwargs)
+
+    def on_xlim_changed(changed_ax) -> None:
+        x_from, x_to = changed_ax.get_xlim()
+        # one sample outside the limits on both sides, so the line reaches the borders of the axis
+        from_idx = max(np.searchsorted(time_in_sec, x_from) - 1, 0)
+        to_idx = np.searchsorted(time_in_sec, x_to, side="right") + 1
+        line.set_data(*decimate_min_max(time_in_sec[from_idx:to_idx], signal[from_idx:to_idx], buckets))
+
+    # ax.clear removes the callback together with the line
+    ax.callbacks.connect("xlim_changed", on_xlim_changed)
+    return line
 
 
 def plot_signal(signal: numpy.ndarray, time_in_sec: numpy.ndarray
                 , canvas: matplotlib.backends.backend_qt5agg.FigureCanvasQTAgg
                 , title: str, x_label: str, y_label: str, ax_idx=0) -> None:
     """
-    this function only plots the signal in the canvas
+    this function only plots the signal in the canvas, decimated to the screen resolution (see decimate_min_max)
 
     Args:
             signal (numpy.ndarray -> numpy.float64): signal in volts
@@ -442,13 +817,13 @@ def plot_signal(signal: numpy.ndarray, time_in_sec: numpy.ndarray
     ax = axes[ax_idx]
     ax.clear()
     signal_in_uv = signal * 1000000
-    ax.plot(time_in_sec, signal_in_uv, linewidth=0.5)
+    _plot_decimated_signal(ax, time_in_sec, signal_in_uv, linewidth=0.5)
 
     ax.set_title(title)
     canvas.figure.text(0.5, 0.01, x_label, ha='center')
     canvas.figure.text(0.01, 0.5, y_label, va='center', rotation='vertical')
 
-    canvas.draw()
+    canvas.draw_idle()
 
 
 def plot_signal_with_spikes(signal: numpy.ndarray,
@@ -459,7 +834,8 @@ def plot_signal_with_spikes(signal: numpy.ndarray,
                             indices_colors_for_spikes: List[tuple], ax_idx: int = 0,
                             indices_colors_for_bursts: List[tuple] = []) -> None:
     """
-    this function plots both spikes and signal together in the one canvas window
+    this function plots both spikes and signal together in the one canvas window,
+    the signal is decimated to the screen resolution (see decimate_min_max)
 
         Args:
                 signal (numpy.ndarray -> numpy.float64): signal in volts
@@ -478,27 +854,31 @@ def plot_signal_with_spikes(signal: numpy.ndarray,
     axes = canvas.figure.get_axes()
     ax = axes[ax_idx]
     ax.clear()
-    ax.plot(time_in_sec, signal_in_uv, linewidth=0.5, color="darkmagenta")
+    _plot_decimated_signal(ax, time_in_sec, signal_in_uv, linewidth=0.5, color="darkmagenta")
     burst_legend = Line2D([], [], color='darkorange', marker='|', linestyle='None',
                           markersize=10, markeredgewidth=2.5, label='Burst')
     spike_legend = Line2D([], [], color='green', marker='o', linestyle='None',
                           markersize=5, markeredgewidth=1, label='Spike')
-    ax.legend(handles=[spike_legend, burst_legend])
+    # "best" location tests every point of every artist on each redraw
+    ax.legend(handles=[spike_legend, burst_legend], loc="upper right")
 
+    # one marker line per unit and one collection of every burst, so redrawing doesn't depend on their quantity
     for indices, colors in indices_colors_for_spikes:
-        indices_ = [ind / fs + time_in_sec[0] for ind in indices]
-        ax.plot(indices_, signal_in_uv[indices], 'ro', ms=2, color=colors, zorder=1)
+        indices = np.asarray(indices, dtype=np.int64)
+        ax.plot(indices / fs + time_in_sec[0], signal_in_uv[indices], marker='o', linestyle='None', ms=2,
+                color=colors, zorder=1)
     if len(indices_colors_for_bursts):
-        for indices in indices_colors_for_bursts:
-            burst_starts_list = indices[0][0]
-            burst_ends_list = indices[0][1]
-            for i in range(len(burst_starts_list)):
-                temp_burst_start = burst_starts_list[i] / fs + time_in_sec[0]
-                temp_burst_end = burst_ends_list[i] / fs + time_in_sec[0]
-                ax.axvspan(temp_burst_start, temp_burst_end, facecolor='0.2', alpha=0.5, color=indices[1])
-
-    canvas.figure.tight_layout()
-    canvas.draw()
+        burst_ranges, burst_colors = [], []
+        for (burst_starts, burst_ends), color in indices_colors_for_bursts:
+            burst_starts = np.asarray(burst_starts) / fs + time_in_sec[0]
+            burst_ends = np.asarray(burst_ends) / fs + time_in_sec[0]
+            burst_ranges.extend(zip(burst_starts, burst_ends - burst_starts))
+            burst_colors.extend([color] * len(burst_starts))
+        # bursts span the whole height of the axis like axvspan
+        ax.broken_barh(burst_ranges, (0, 1), transform=ax.get_xaxis_transform(), facecolors=burst_colors,
+                       edgecolors=burst_colors, alpha=0.5)
+
+    canvas.draw_idle()
     ax.set_title(title)
     canvas.figure.text(0.5, 0.01, x_label, ha='center')
     canvas.figure.text(0.01, 0.5, y_label, va='center', rotation='vertical')
@@ -536,7 +916,7 @@ def plot_bins(spike_in_bins, bin_ranges, bin_width: float
     ax.set_title(title)
     canvas.figure.text(0.5, 0.01, x_label, ha='center')
     canvas.figure.text(0.01, 0.5, y_label, va='center', rotation='vertical')
-    canvas.draw()
+    canvas.draw_idle()
 
 
 def _plot_each_spike(ax, cutouts: numpy.ndarray, fs: int, pre: float, post: float, n: int = 100
@@ -598,20 +978,21 @@ def plot_spikes_together(cutouts: numpy.ndarray, labels: numpy.ndarray
     labels = np.array(labels)
     if len(cutouts) < 1:
         ax.set_title('No Spike')
-        canvas.draw()
+        canvas.draw_idle()
         return
 
     for i in range(int(n_components)):
         idx = labels == i
         color = plt.rcParams['axes.prop_cycle'].by_key()['color'][i]
         _plot_each_spike(ax, cutouts[idx, :], fs, pre, post, n=number_spikes, color=color, title=title)
-    canvas.draw()
+    canvas.draw_idle()
 
 
 def plot_stimulus(stimulus: List[int], canvas: matplotlib.backends.backend_qt5agg.FigureCanvasQTAgg
                   , ax_idx: int = 0) -> None:
     """
-    this function plots lines to show stimulus in canvas, in particular window using matplotlib axvline function
+    this function plots lines to show stimulus in canvas, in particular window. all lines are one collection,
+    which spans the whole height of the axis like axvline, so redrawing doesn't depend on the quantity of stimulus
 
         Args:
                 stimulus (list -> int): indexes of stimulus
@@ -621,16 +1002,25 @@ def plot_stimulus(stimulus: List[int], canvas: matplotlib.backends.backend_qt5ag
     axes = canvas.figure.get_axes()
     ax = axes[ax_idx]
 
-    for s in stimulus:
-        ax.axvline(s, alpha=0.7, color='lime')
+    stimulus = np.asarray(stimulus, dtype=np.float64)
+    if len(stimulus):
+        segments = np.stack((np.column_stack((stimulus, np.zeros(len(stimulus)))),
+                             np.column_stack((stimulus, np.ones(len(stimulus))))), axis=1)
+        ax.add_collection(LineCollection(segments, colors='lime', alpha=0.7, transform=ax.get_xaxis_transform()),
+                          autolim=False)
+        # like axvline, stimulus widen only the x range
+        ax.update_datalim([(stimulus.min(), 0), (stimulus.max(), 0)], updatey=False)
+        ax.autoscale_view(scaley=False)
 
-    canvas.draw()
+    canvas.draw_idle()
 
 
 def filter_stimulus(stimulus: numpy.ndarray, useless_stimulus: List[tuple], from_s: float, fs: int) \
-        -> List[numpy.int64]:
+        -> numpy.ndarray:
     """
-    we need this function to clear stimulus which are in the useless_stimulus chosen by the user
+    we need this function to clear stimulus which are in the useless_stimulus chosen by the user.
+    useless ranges are merged into sorted, non overlapping intervals first, so every stimulus
+    is checked against only one interval found with binary search
 
         Args:
                 stimulus (numpy.ndarray -> numpy.int64): indexes of stimulus
@@ -640,8 +1030,39 @@ def filter_stimulus(stimulus: numpy.ndarray, useless_stimulus: List[tuple], from
 
 
         Returns:
-                stimulus (list -> numpy.int64): indexes of filtered stimulus
+                stimulus (numpy.ndarray -> numpy.int64): indexes of filtered stimulus
+    """
+    stimulus = np.asarray(stimulus)
+    interval_starts, interval_ends = _merge_open_intervals(useless_stimulus)
+    if not len(interval_starts):
+        return stimulus
+
+    stimulus_in_s = stimulus / fs + from_s
+    # the last interval which starts before the stimulus is the only one which can contain it
+    interval_idx = np.searchsorted(interval_starts, stimulus_in_s, side='left') - 1
+    inside = (interval_idx >= 0) & (stimulus_in_s < interval_ends[np.maximum(interval_idx, 0)])
+    return stimulus[~inside]
+
+
+def _merge_open_intervals(intervals: List[tuple]) -> (numpy.ndarray, numpy.ndarray):
+    """
+    _merge_open_intervals sorts and merges (from, to) intervals, both ends are excluded,
+    so intervals which only touch each other are not merged
+
+        Args:
+                intervals (list -> tuple): each item is from and to
+
+        Returns:
+                starts (numpy.ndarray -> numpy.float64): sorted starts of merged intervals
+                ends (numpy.ndarray -> numpy.float64): corresponding ends of merged intervals
     """
-    for i in range(0, len(useless_stimulus)):
-        stimulus = [st for st in stimulus if not (useless_stimulus[i][0] < (st / fs + from_s) < useless_stimulus[i][1])]
-    return stimulus
+    intervals = np.array(intervals, dtype=np.float64).reshape(-1, 2)
+    intervals = intervals[intervals[:, 0] < intervals[:, 1]]
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    if not len(intervals):
+        return intervals[:, 0], intervals[:, 1]
+
+    ends_so_far = np.maximum.accumulate(intervals[:, 1])
+    new_interval = np.insert(intervals[1:, 0] >= ends_so_far[:-1], 0, True)
+    last_of_interval = np.append(new_interval[1:], True)
+    return intervals[new_interval, 0], ends_so_far[last_of_interval]
@@ -0,0 +1,61 @@
+from functools import partial
+
+from PyQt5 import QtCore, QtWidgets
+
+
+class ProgressHandler:
+    """
+    ProgressHandler starts background tasks and shows their progress in the status bar of the main window,
+    the cancel button next to the progress bar cancels every running task
+
+    Args:
+        ui_main ('UI.NeuroSpace'): the main UI object of function
+    """
+    def __init__(self, ui_main) -> None:
+        self._tasks = []
+        self._status_bar = ui_main.statusBar()
+        self._progress_bar = QtWidgets.QProgressBar()
+        self._progress_bar.setMaximumWidth(200)
+        self._cancel_button = QtWidgets.QPushButton("Cancel")
+        self._cancel_button.clicked.connect(self.cancel_all)
+        self._status_bar.addPermanentWidget(self._progress_bar)
+        self._status_bar.addPermanentWidget(self._cancel_button)
+        self._set_busy(False)
+
+    def start(self, task) -> None:
+        """
+        start runs the task on the global thread pool and shows its progress until it ends
+
+        Args:
+            task (Controllers.BackgroundTask.BackgroundTask): the task to run
+        """
+        task.signals.progress.connect(self._show_progress)
+        task.signals.finished.connect(partial(self._task_ended, task, "finished"))
+        task.signals.failed.connect(partial(self._task_ended, task, "failed"))
+        task.signals.cancelled.connect(partial(self._task_ended, task, "cancelled"))
+        self._tasks.append(task)
+        self._set_busy(True)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def cancel_all(self) -> None:
+        """
+        cancel_all asks every running task to stop
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._status_bar.showMessage("Cancelling...")
+
+    def _show_progress(self, message: str, percent: int) -> None:
+        self._status_bar.showMessage(message)
+        self._progress_bar.setValue(percent)
+
+    def _task_ended(self, task, state: str, *args) -> None:
+        self._tasks.remove(task)
+        self._set_busy(bool(self._tasks))
+        self._status_bar.showMessage(f"{task.title} {state}", 5000)
+
+    def _set_busy(self, busy: bool) -> None:
+        self._progress_bar.setVisible(busy)
+        self._cancel_button.setVisible(busy)
+        if not busy:
+            self._progress_bar.setValue(0)
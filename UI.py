@@ -3,7 +3,12 @@ from PyQt5 import QtWidgets, QtGui, QtCore
 from Controllers.StimulusActionController import StimulusActionController
 from Controllers.SpikeTogetherController import SpikeTogetherController
 from PopupHandler import PopupHandler
+from ProgressHandler import ProgressHandler
 from utils import path_valid, get_default_widget, merge_files
+from Modules.ModelStore import model_store
+from Modules.Pipeline import pipeline
+from Modules.ResultStore import result_store
+from Modules.SignalCache import signal_cache
 from functools import partial
 from Controllers.WaveformController import WaveformController
 from Controllers.SpikeController import SpikeController
@@ -21,6 +26,7 @@ class NeuroSpace(QtWidgets.QMainWindow):
         file_name_menu (QtWidgets.QMainWindow.menuBar): the menubar object in the top of app
         window_key (int): controls which window is now current
         open_windows_dict (dict): active windows dict, the key - window id(int), the value - appropriate window object
+        progress_handler (ProgressHandler): runs analyses in background and shows their progress in the status bar
     """
     def __init__(self):
         super().__init__()
@@ -38,6 +44,7 @@ class NeuroSpace(QtWidgets.QMainWindow):
         self._add_mdi()
         # self._add_properties_dock()
         self._add_parameters_dock()
+        self.progress_handler = ProgressHandler(self)
 
         self.file_name_menu = None
     
@@ -73,8 +80,12 @@ class NeuroSpace(QtWidgets.QMainWindow):
         merge_files_action = QtWidgets.QAction("Merge Files", self)
         merge_files_action.triggered.connect(self._merge_files)
 
+        clear_cache_action = QtWidgets.QAction("Clear Cache", self)
+        clear_cache_action.triggered.connect(self._clear_cache)
+
         file_menu.addAction(open_action)
         file_menu.addAction(merge_files_action)
+        file_menu.addAction(clear_cache_action)
 
     def _add_toolbar(self):
         self.toolbar = QtWidgets.QToolBar(self)
@@ -147,6 +158,18 @@ class NeuroSpace(QtWidgets.QMainWindow):
         dir_name = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Directory")
         merge_files(dir_name)
 
+    def _clear_cache(self):
+        """
+        removes the saved results and fitted models of every recording (models saved under user's names are kept)
+        and the signals and spikes kept in memory, so the next analyses are calculated again
+        """
+        size_mb = (result_store.size_bytes + model_store.size_bytes) / 1024 ** 2
+        result_store.clear()
+        model_store.clear(keep_named=True)
+        signal_cache.clear()
+        pipeline.clear()
+        PopupHandler(self).info_popup("Clear Cache", f"Removed {size_mb:.1f} MB of saved results and models")
+
     def _on_icon_clicked(self, obj, dialog_title):
         self.setDisabled(True)
         dialog = QtWidgets.QDialog()
@@ -166,27 +189,27 @@ class NeuroSpace(QtWidgets.QMainWindow):
 
     def _on_waveform_icon_clicked(self):
         waveform_controller = partial(WaveformController, self._file, self.window_key, self.open_windows_dict,
-                                      self.mdi, self.parameters_dock, PopupHandler(self))
+                                      self.mdi, self.parameters_dock, PopupHandler(self), self.progress_handler)
         self._on_icon_clicked(waveform_controller, dialog_title="Waveform")
 
     def _on_spike_icon_clicked(self):
         spike_controller = partial(SpikeController, self._file, self.window_key, self.open_windows_dict,
-                                   self.mdi, self.parameters_dock, PopupHandler(self))
+                                   self.mdi, self.parameters_dock, PopupHandler(self), self.progress_handler)
         self._on_icon_clicked(spike_controller, dialog_title="Spike")
 
     def _on_bin_icon_clicked(self):
         spike_controller = partial(BinController, self._file, self.window_key, self.open_windows_dict,
-                                   self.mdi, self.parameters_dock, PopupHandler(self))
+                                   self.mdi, self.parameters_dock, PopupHandler(self), self.progress_handler)
         self._on_icon_clicked(spike_controller, dialog_title="Bin")
 
     def _on_spike_together_icon_clicked(self):
         spike_together = partial(SpikeTogetherController, self._file, self.window_key, self.open_windows_dict,
-                                 self.mdi, self.parameters_dock, PopupHandler(self))
+                                 self.mdi, self.parameters_dock, PopupHandler(self), self.progress_handler)
         self._on_icon_clicked(spike_together, dialog_title="SpikeTogether")
 
     def _on_stimulus_action_icon_clicked(self):
         stimulus_action = partial(StimulusActionController, self._file, self.window_key, self.open_windows_dict,
-                                  self.mdi, self.parameters_dock, PopupHandler(self))
+                                  self.mdi, self.parameters_dock, PopupHandler(self), self.progress_handler)
         self._on_icon_clicked(stimulus_action, dialog_title="StimulusAction")
 
     def error_popup(self, txt, title_text):
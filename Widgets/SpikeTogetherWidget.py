@@ -34,7 +34,7 @@ class SpikeTogetherWidget(WaveformWidget):
 
         (self.dead_time, self.threshold_from,
          self.threshold_to, self.spike_group_box) = create_group_dead_time_threshold("Spike")
-        self.component_number, comp_num_label = line_edit_with_label("Comp num", "Select Component number")
+        self.component_number, comp_num_label = line_edit_with_label("Comp num", "Select Component number or auto")
         _widget = merge_widgets(comp_num_label, self.component_number, vertical=False)
         self.spike_group_box.layout().addWidget(_widget, 0, 2, 1, 2)
         pre_post_group = self._create_pre_post_group()
@@ -66,7 +66,7 @@ class SpikeWidget(WaveformWidget):
         group_box_layout = QtWidgets.QGridLayout()
         self.pre, pre_label = line_edit_with_label("Pre", "Select time parameter")
         self.post, post_label = line_edit_with_label("Post", "Select time parameter")
-        self.component_number, spike_comp_num_label = line_edit_with_label("Comp num", "Select Component number")
+        self.component_number, spike_comp_num_label = line_edit_with_label("Comp num", "Select Component number or auto")
         spacer = QtWidgets.QSpacerItem(20, 10, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
 
         pre_post_widget = merge_widgets(pre_label, self.pre, spacer, post_label, self.post, spacer, spike_comp_num_label, vertical=False)